@@ -0,0 +1,173 @@
+import argparse
+import csv
+import importlib.util
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+from app.utils.extraction import extract_preferences
+from app.utils.gazetteer import get_index
+
+# Bulk preference extraction over archived chat messages.
+#
+# Messages are streamed from a JSONL or CSV corpus, cut into chunks and
+# spread over a process pool. Each message goes through the same
+# extract_preferences() the chat app uses, so results match the interactive
+# path; nothing touches the apps' conversation state. Results come back as
+# columns, one chunk at a time and in input order, and are written to Parquet
+# (one row group per chunk) or CSV.
+#
+#     python -m app.batch_extract messages.jsonl preferences.parquet --workers 8
+
+COLUMNS = ["destination", "duration", "budget", "currency", "interests", "travel_style"]
+
+
+def iter_messages(path: str, field: str = "message") -> Iterator[str]:
+    if path.endswith(".csv"):
+        with open(path, newline="", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                yield row.get(field) or ""
+    else:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line).get(field) or ""
+
+
+def extract_columns(messages: List[str]) -> Dict[str, List[Any]]:
+    # Preferences for a chunk of messages, as one list per column
+    columns: Dict[str, List[Any]] = {name: [] for name in COLUMNS}
+    for message in messages:
+        found = extract_preferences(message)
+        for name in COLUMNS:
+            columns[name].append(found.get(name))
+    return columns
+
+
+def _chunks(messages: Iterable[str], size: int) -> Iterator[List[str]]:
+    chunk = []
+    for message in messages:
+        chunk.append(message)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def extract_batch(
+    messages: Iterable[str],
+    workers: Optional[int] = None,
+    chunk_size: int = 5000
+) -> Iterator[Dict[str, List[Any]]]:
+    # Yields the columns for each chunk of `messages`, in order. Only a few
+    # chunks per worker are in flight, so memory stays flat on huge corpora.
+    workers = workers or os.cpu_count() or 1
+    # Build the gazetteer before forking so workers share it
+    get_index()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for chunk in _chunks(messages, chunk_size):
+            pending.append(pool.submit(extract_columns, chunk))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+class _ParquetWriter:
+    def __init__(self, path: str):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise RuntimeError("Writing Parquet needs pyarrow (pip install -r requirements.txt); or write to a .csv file")
+        self._pa = pa
+        self._schema = pa.schema([
+            ("destination", pa.string()),
+            ("duration", pa.int64()),
+            ("budget", pa.float64()),
+            ("currency", pa.string()),
+            ("interests", pa.list_(pa.string())),
+            ("travel_style", pa.string()),
+        ])
+        self._writer = pq.ParquetWriter(path, self._schema)
+
+    def write(self, columns: Dict[str, List[Any]]):
+        self._writer.write_table(self._pa.Table.from_pydict(columns, schema=self._schema))
+
+    def close(self):
+        self._writer.close()
+
+
+class _CSVWriter:
+    def __init__(self, path: str):
+        self._file = open(path, "w", newline="", encoding="utf-8")
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(COLUMNS)
+
+    def write(self, columns: Dict[str, List[Any]]):
+        for row in zip(*(columns[name] for name in COLUMNS)):
+            self._writer.writerow([
+                "|".join(value) if isinstance(value, list) else ("" if value is None else value)
+                for value in row
+            ])
+
+    def close(self):
+        self._file.close()
+
+
+def extract_corpus(
+    input_path: str,
+    output_path: str,
+    field: str = "message",
+    workers: Optional[int] = None,
+    chunk_size: int = 5000
+) -> Dict[str, float]:
+    workers = workers or os.cpu_count() or 1
+    writer = _CSVWriter(output_path) if output_path.endswith(".csv") else _ParquetWriter(output_path)
+    count = 0
+    start = time.perf_counter()
+    try:
+        for columns in extract_batch(iter_messages(input_path, field), workers, chunk_size):
+            writer.write(columns)
+            count += len(columns["destination"])
+    finally:
+        writer.close()
+    seconds = time.perf_counter() - start
+    rate = count / seconds if seconds else 0.0
+    return {
+        "messages": count,
+        "seconds": seconds,
+        "workers": workers,
+        "messages_per_second": rate,
+        "messages_per_second_per_core": rate / workers,
+    }
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Extract travel preferences from a corpus of chat messages")
+    parser.add_argument("input", help="JSONL or CSV file of messages")
+    parser.add_argument("output", help="Output file: .parquet or .csv")
+    parser.add_argument("--field", default="message", help="JSON key or CSV column holding the message text")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: all cores)")
+    parser.add_argument("--chunk-size", type=int, default=5000, help="Messages per task sent to a worker")
+    args = parser.parse_args(argv)
+
+    if not args.output.endswith(".csv") and importlib.util.find_spec("pyarrow") is None:
+        parser.error("writing Parquet needs pyarrow (pip install -r requirements.txt); or write to a .csv file")
+
+    stats = extract_corpus(args.input, args.output, args.field, args.workers, args.chunk_size)
+    print(
+        f"{stats['messages']:,} messages in {stats['seconds']:.1f}s with {stats['workers']} workers: "
+        f"{stats['messages_per_second']:,.0f} msg/s, {stats['messages_per_second_per_core']:,.0f} msg/s per core",
+        file=sys.stderr
+    )
+
+
+if __name__ == "__main__":
+    main()
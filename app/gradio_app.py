@@ -1,8 +1,16 @@
+import asyncio
 import gradio as gr
 import os
+import time
 from dotenv import load_dotenv
 from app.models.llm import LLMHandler
 from app.utils.prompts import generate_system_prompt
+from app.utils.cache import ItineraryCache, itinerary_key
+from app.utils.context import session_context, summarize_overflow_async
+from app.utils.gazetteer import find_destination
+from app.utils.metrics import ERRORS, STAGE_SECONDS, mount_metrics
+from app.utils.sessions import SessionStore
+from app.utils.tracing import Tracer, record_stage
 
 # Load environment variables
 load_dotenv()
@@ -10,22 +18,31 @@ load_dotenv()
 # Initialize the LLM handler
 llm_handler = LLMHandler()
 
-# Store conversation history
-class ConversationState:
-    def __init__(self):
-        self.history = []
-        self.current_preferences = {
-            "destination": None,
-            "duration": None,
-            "budget": None,
-            "interests": [],
-            "travel_style": None
-        }
-
-state = ConversationState()
-
-def update_preferences_display():
-    prefs = state.current_preferences
+# Identical trips share one generated itinerary
+itinerary_cache = ItineraryCache.from_env()
+
+# Conversation state, one session per browser tab
+sessions = SessionStore.from_env("gradio")
+
+# Background summaries in progress; the loop only keeps weak references
+summaries = set()
+
+# Sampled handler calls are traced to a file (see app/utils/tracing.py)
+tracer = Tracer.from_env("gradio")
+
+# Per-stage latency series, bound once
+_PROMPT_BUILD = STAGE_SECONDS.labels("gradio", "prompt_build")
+_EXTRACTION = STAGE_SECONDS.labels("gradio", "extraction")
+_LLM = STAGE_SECONDS.labels("gradio", "llm")
+_POSTPROCESS = STAGE_SECONDS.labels("gradio", "postprocess")
+
+def session_id(request: gr.Request) -> str:
+    # Gradio passes no request when a handler is called directly
+    return request.session_hash if request and request.session_hash else "local"
+
+def update_preferences_display(request: gr.Request):
+    with sessions.session(session_id(request)) as session:
+        prefs = session.preferences
     return f"""
     ### Current Travel Preferences
     - Destination: {prefs['destination'] or 'Not set'}
@@ -35,45 +52,62 @@ def update_preferences_display():
     - Travel Style: {prefs['travel_style'] or 'Not set'}
     """
 
-def process_message(message, history):
+@tracer.traced("chat")
+async def process_message(message, history, request: gr.Request):
+    history = history or []
     try:
-        # Convert Gradio history format to LLMHandler format
-        context = [
-            {"user": msg["content"] for msg in dialog if msg["role"] == "user"}
-            for dialog in (history if history else [])
-        ]
+        # Summary and recent turns of this session, in LLMHandler format
+        start = time.perf_counter()
+        with sessions.session(session_id(request)) as session:
+            context = session_context(session, message, "gradio")
+        record_stage(_PROMPT_BUILD, "prompt_build", start)
         
-        # Generate response using LLM
-        response = llm_handler.generate_response(message, context)
+        # Stream the response into the chat as it is generated
+        history.append({"role": "user", "content": message})
+        history.append({"role": "assistant", "content": ""})
+        start = time.perf_counter()
+        async for token in llm_handler.stream_response(message, context):
+            history[-1]["content"] += token
+            yield history
+        record_stage(_LLM, "llm", start)
         
         # Update preferences
-        update_preferences(message)
+        start = time.perf_counter()
+        with sessions.session(session_id(request)) as session:
+            session.add_turn(message, history[-1]["content"])
+            added = record_stage(_POSTPROCESS, "postprocess", start)
+            update_preferences(message, session.preferences)
+            record_stage(_EXTRACTION, "extraction", added)
+        yield history
         
-        # Return the history in the new format Gradio expects
-        history = history or []
-        history.append({"role": "user", "content": message})
-        history.append({"role": "assistant", "content": response})
-        return history
+        # Fold turns that no longer fit the context into the summary
+        task = asyncio.ensure_future(
+            summarize_overflow_async(sessions, session_id(request), llm_handler.summarize_async)
+        )
+        summaries.add(task)
+        task.add_done_callback(summaries.discard)
     except Exception as e:
-        history = history or []
-        history.append({"role": "user", "content": message})
-        history.append({"role": "assistant", "content": f"Error: {str(e)}"})
-        return history
+        ERRORS.inc("gradio", "chat")
+        if not history or history[-1]["role"] != "assistant":
+            history.append({"role": "user", "content": message})
+            history.append({"role": "assistant", "content": ""})
+        history[-1]["content"] = f"Error: {str(e)}"
+        yield history
+
+def update_preferences(message, prefs):
+    # Extract destination, before lowercasing so "Nice" isn't "nice"
+    destination = find_destination(message)
+    if destination:
+        prefs["destination"] = destination
 
-def update_preferences(message):
     # Simple preference extraction logic
     message = message.lower()
     
-    # Extract destination
-    if "to " in message and " for " in message:
-        destination = message.split("to ")[1].split(" for ")[0]
-        state.current_preferences["destination"] = destination
-    
     # Extract duration
     if " for " in message and " days" in message:
         try:
             duration = int(message.split(" for ")[1].split(" days")[0])
-            state.current_preferences["duration"] = duration
+            prefs["duration"] = duration
         except ValueError:
             pass
     
@@ -81,7 +115,7 @@ def update_preferences(message):
     if "$" in message:
         try:
             budget = float(message.split("$")[1].split()[0])
-            state.current_preferences["budget"] = budget
+            prefs["budget"] = budget
         except ValueError:
             pass
     
@@ -89,36 +123,46 @@ def update_preferences(message):
     interests = ["culture", "food", "adventure", "relaxation", "shopping", "history", "nature"]
     found_interests = [i for i in interests if i in message]
     if found_interests:
-        state.current_preferences["interests"] = found_interests
+        prefs["interests"] = found_interests
     
     # Extract travel style
     styles = ["luxury", "budget", "mid-range"]
     for style in styles:
         if style in message:
-            state.current_preferences["travel_style"] = style
+            prefs["travel_style"] = style
             break
 
-def generate_travel_itinerary():
-    if not state.current_preferences["destination"]:
-        return "Please provide a destination first."
+@tracer.traced("itinerary")
+async def generate_travel_itinerary(request: gr.Request):
+    with sessions.session(session_id(request)) as session:
+        prefs = session.preferences.as_dict()
+    if not prefs["destination"]:
+        yield "Please provide a destination first."
+        return
     
     try:
-        prompt = generate_system_prompt(state.current_preferences)
-        itinerary = llm_handler.generate_itinerary(prompt)
-        return itinerary
+        key = itinerary_key(prefs)
+        cached = await itinerary_cache.get_async(key)
+        if cached is not None:
+            yield cached
+            return
+        
+        start = time.perf_counter()
+        prompt = generate_system_prompt(prefs)
+        generating = record_stage(_PROMPT_BUILD, "prompt_build", start)
+        itinerary = ""
+        async for token in llm_handler.stream_itinerary(prompt):
+            itinerary += token
+            yield itinerary
+        record_stage(_LLM, "llm", generating)
+        await itinerary_cache.put_async(key, itinerary)
     except Exception as e:
-        return f"Error generating itinerary: {str(e)}"
-
-def clear_conversation():
-    state.history = []
-    state.current_preferences = {
-        "destination": None,
-        "duration": None,
-        "budget": None,
-        "interests": [],
-        "travel_style": None
-    }
-    return [], update_preferences_display()
+        ERRORS.inc("gradio", "itinerary")
+        yield f"Error generating itinerary: {str(e)}"
+
+def clear_conversation(request: gr.Request):
+    sessions.drop(session_id(request))
+    return [], update_preferences_display(request)
 
 # Create the Gradio interface
 with gr.Blocks(title="Travel Assistant", theme=gr.themes.Soft()) as demo:
@@ -208,5 +252,9 @@ if __name__ == "__main__":
     demo.launch(
         server_name="127.0.0.1",
         server_port=7861,
-        share=True
-    ) 
\ No newline at end of file
+        share=True,
+        prevent_thread_lock=True
+    )
+    # Gradio's app only exists once launched
+    mount_metrics(demo.app)
+    demo.block_thread() 
\ No newline at end of file
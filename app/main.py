@@ -1,15 +1,45 @@
+import asyncio
+import json
+import os
+import time
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.background import BackgroundTask
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
 from app.models.llm import LLMHandler
+from app.utils.cache import ItineraryCache, itinerary_key
+from app.utils.context import build_context, session_context, summarize_overflow_async
+from app.utils.extraction import extract_preferences
+from app.utils.metrics import ERRORS, STAGE_SECONDS, mount_metrics
 from app.utils.prompts import generate_system_prompt, generate_collection_prompt
+from app.utils.sessions import SessionStore
+from app.utils.tracing import Tracer, TracingMiddleware, record_stage
 
 app = FastAPI(title="Travel Assistant API")
 llm_handler = LLMHandler()
+itinerary_cache = ItineraryCache.from_env()
+sessions = SessionStore.from_env("api")
+tracer = Tracer.from_env("api")
+mount_metrics(app)
+app.add_middleware(TracingMiddleware, tracer=tracer)
+
+# Per-stage latency series, bound once
+_PROMPT_BUILD = STAGE_SECONDS.labels("api", "prompt_build")
+_EXTRACTION = STAGE_SECONDS.labels("api", "extraction")
+_LLM = STAGE_SECONDS.labels("api", "llm")
+_POSTPROCESS = STAGE_SECONDS.labels("api", "postprocess")
+
+# /generate-itineraries: entries per request, and generations in flight per request
+ITINERARY_BATCH_MAX = int(os.getenv("ITINERARY_BATCH_MAX", "1000"))
+ITINERARY_BATCH_CONCURRENCY = int(os.getenv("ITINERARY_BATCH_CONCURRENCY", "8"))
 
 class UserInput(BaseModel):
     message: str
     context: Optional[List[dict]] = []
+    # With a session id the server keeps the recent turns and preferences,
+    # so clients don't have to send the context back every time
+    session_id: Optional[str] = None
 
 class TravelPreferences(BaseModel):
     destination: Optional[str] = None
@@ -17,31 +47,216 @@ class TravelPreferences(BaseModel):
     budget: Optional[float] = None
     interests: Optional[List[str]] = None
     travel_style: Optional[str] = None
+    # Fields left out are taken from this session's preferences
+    session_id: Optional[str] = None
+
+def _chat_context(user_input: UserInput) -> List[dict]:
+    start = time.perf_counter()
+    try:
+        return _build_chat_context(user_input)
+    finally:
+        record_stage(_PROMPT_BUILD, "prompt_build", start)
+
+def _build_chat_context(user_input: UserInput) -> List[dict]:
+    if user_input.context or not user_input.session_id:
+        context = user_input.context or []
+        summary = context[0]["summary"] if context and "summary" in context[0] else None
+        turns = [(turn["user"], turn["assistant"]) for turn in context if "summary" not in turn]
+        return build_context(turns, user_input.message, summary)
+    with sessions.session(user_input.session_id) as session:
+        return session_context(session, user_input.message, "api")
+
+def _summarize_later(session_id: Optional[str]) -> Optional[BackgroundTask]:
+    # Runs once the response has been sent
+    if not session_id:
+        return None
+    return BackgroundTask(summarize_overflow_async, sessions, session_id, llm_handler.summarize_async)
+
+def _remember(session_id: str, message: str, response: str) -> Dict[str, Any]:
+    start = time.perf_counter()
+    preferences = extract_preferences(message)
+    extracted = record_stage(_EXTRACTION, "extraction", start)
+    with sessions.session(session_id) as session:
+        session.add_turn(message, response)
+        session.preferences.update(preferences)
+        preferences = session.preferences.as_dict()
+    record_stage(_POSTPROCESS, "postprocess", extracted)
+    return preferences
+
+def _itinerary_preferences(preferences: TravelPreferences) -> Dict[str, Any]:
+    values = preferences.dict(exclude={"session_id"})
+    if preferences.session_id:
+        with sessions.session(preferences.session_id) as session:
+            stored = session.preferences.as_dict()
+        values = {**stored, **{k: v for k, v in values.items() if v is not None}}
+    return values
+
+async def _itinerary(key: str, values: Dict[str, Any]) -> str:
+    response = await itinerary_cache.get_async(key)
+    if response is None:
+        start = time.perf_counter()
+        prompt = generate_system_prompt(values)
+        generating = record_stage(_PROMPT_BUILD, "prompt_build", start)
+        response = await llm_handler.generate_itinerary_async(prompt)
+        record_stage(_LLM, "llm", generating)
+        await itinerary_cache.put_async(key, response)
+    return response
 
 @app.get("/")
 async def root():
     return {"message": "Welcome to the Travel Assistant API"}
 
+@app.get("/healthz")
+async def healthz():
+    # The process is up and serving; says nothing about the models
+    return {"status": "ok"}
+
+@app.get("/readyz")
+async def readyz():
+    # Ready once any backend can take requests. The local model loads in
+    # the background and only joins in when it is ready.
+    backends = llm_handler.status()
+    ready = "ready" in backends.values()
+    return JSONResponse(
+        {"status": "ready" if ready else "not ready", "backends": backends},
+        status_code=200 if ready else 503
+    )
+
+@app.get("/backends")
+async def backends():
+    # Circuit breaker state and rolling p50/p99 latency per LLM backend
+    return llm_handler.backend_health()
+
 @app.post("/chat")
 async def chat_endpoint(user_input: UserInput):
     try:
-        response = llm_handler.generate_response(
-            user_input.message,
-            user_input.context
-        )
+        context = _chat_context(user_input)
+        start = time.perf_counter()
+        response = await llm_handler.generate_response_async(user_input.message, context)
+        record_stage(_LLM, "llm", start)
+        if user_input.session_id:
+            preferences = _remember(user_input.session_id, user_input.message, response)
+            return JSONResponse(
+                {"response": response, "preferences": preferences},
+                background=_summarize_later(user_input.session_id)
+            )
         return {"response": response}
     except Exception as e:
+        ERRORS.inc("api", "chat")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/generate-itinerary")
 async def generate_itinerary(preferences: TravelPreferences):
     try:
-        prompt = generate_system_prompt(preferences.dict())
-        response = llm_handler.generate_itinerary(prompt)
-        return {"itinerary": response}
+        values = _itinerary_preferences(preferences)
+        return {"itinerary": await _itinerary(itinerary_key(values), values)}
     except Exception as e:
+        ERRORS.inc("api", "itinerary")
         raise HTTPException(status_code=500, detail=str(e))
 
+async def _itinerary_lines(entries: List[Tuple[str, Dict[str, Any], List[int]]]) -> AsyncIterator[str]:
+    # One JSON line per distinct entry, in the order they finish, with the
+    # positions in the request it answers; then a line with the totals
+    slots = asyncio.Semaphore(ITINERARY_BATCH_CONCURRENCY)
+
+    async def generate(key: str, values: Dict[str, Any], indices: List[int]) -> Dict[str, Any]:
+        async with slots:
+            try:
+                return {"indices": indices, "itinerary": await _itinerary(key, values)}
+            except Exception as e:
+                ERRORS.inc("api", "itinerary_batch")
+                return {"indices": indices, "error": str(e)}
+
+    tasks = [asyncio.ensure_future(generate(*entry)) for entry in entries]
+    errors = 0
+    try:
+        for result in asyncio.as_completed(tasks):
+            line = await result
+            errors += "error" in line
+            yield json.dumps(line) + "\n"
+        yield json.dumps({"done": True, "itineraries": len(tasks) - errors, "errors": errors}) + "\n"
+    finally:
+        # The client may have gone away; don't keep generating for nobody
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+@app.post("/generate-itineraries")
+async def generate_itineraries(batch: List[TravelPreferences]):
+    # Many preference sets at once, streamed back as NDJSON. Entries that
+    # are the same once canonicalised (as the itinerary cache sees them)
+    # are generated once.
+    if len(batch) > ITINERARY_BATCH_MAX:
+        raise HTTPException(status_code=413, detail=f"at most {ITINERARY_BATCH_MAX} entries per request")
+    entries: Dict[str, Tuple[str, Dict[str, Any], List[int]]] = {}
+    for index, preferences in enumerate(batch):
+        values = _itinerary_preferences(preferences)
+        key = itinerary_key(values)
+        if key in entries:
+            entries[key][2].append(index)
+        else:
+            entries[key] = (key, values, [index])
+    return StreamingResponse(_itinerary_lines(list(entries.values())), media_type="application/x-ndjson")
+
+async def _server_sent_events(tokens: AsyncIterator[str]) -> AsyncIterator[str]:
+    # One "data" event per token, then "done" (or "error" if generation fails)
+    try:
+        async for token in tokens:
+            yield f"data: {json.dumps({'token': token})}\n\n"
+        yield "event: done\ndata: {}\n\n"
+    except Exception as e:
+        ERRORS.inc("api", "stream")
+        yield f"event: error\ndata: {json.dumps({'detail': str(e)})}\n\n"
+
+async def _replay(itinerary: str) -> AsyncIterator[str]:
+    yield itinerary
+
+async def _cached_itinerary(key: str, tokens: AsyncIterator[str]) -> AsyncIterator[str]:
+    # Passes the tokens through, caching the itinerary once it is complete
+    parts = []
+    async for token in tokens:
+        parts.append(token)
+        yield token
+    await itinerary_cache.put_async(key, "".join(parts))
+
+async def _remembered_reply(user_input: UserInput, tokens: AsyncIterator[str]) -> AsyncIterator[str]:
+    # Passes the tokens through, adding the turn to the session once it is complete
+    parts = []
+    async for token in tokens:
+        parts.append(token)
+        yield token
+    _remember(user_input.session_id, user_input.message, "".join(parts))
+
+@app.post("/chat/stream")
+async def chat_stream(user_input: UserInput):
+    tokens = llm_handler.stream_response(user_input.message, _chat_context(user_input))
+    if user_input.session_id:
+        tokens = _remembered_reply(user_input, tokens)
+    return StreamingResponse(
+        _server_sent_events(tokens),
+        media_type="text/event-stream",
+        background=_summarize_later(user_input.session_id)
+    )
+
+@app.post("/generate-itinerary/stream")
+async def generate_itinerary_stream(preferences: TravelPreferences):
+    values = _itinerary_preferences(preferences)
+    key = itinerary_key(values)
+    cached = await itinerary_cache.get_async(key)
+    if cached is not None:
+        tokens = _replay(cached)
+    else:
+        start = time.perf_counter()
+        prompt = generate_system_prompt(values)
+        record_stage(_PROMPT_BUILD, "prompt_build", start)
+        tokens = _cached_itinerary(key, llm_handler.stream_itinerary(prompt))
+    return StreamingResponse(_server_sent_events(tokens), media_type="text/event-stream")
+
+@app.delete("/sessions/{session_id}")
+async def end_session(session_id: str):
+    sessions.drop(session_id)
+    return {"session_id": session_id}
+
 @app.get("/get-collection-prompt")
 async def get_collection_prompt():
     return {"prompt": generate_collection_prompt()} 
\ No newline at end of file
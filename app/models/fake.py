@@ -0,0 +1,215 @@
+import asyncio
+import os
+import random
+import threading
+import time
+import zlib
+from typing import AsyncIterator, Iterator, List, Optional
+
+# A stand-in LLM for load tests and running offline (LLM_BACKEND=fake). It
+# takes the place of the Inference API in LLMHandler and of the
+# google.generativeai module in travel_assistant.py, costs no tokens and
+# needs no network.
+#
+# The same prompt always gets the same reply, FAKE_LLM_OUTPUT_TOKENS tokens
+# long (or max_new_tokens, if less). The first token comes after
+# FAKE_LLM_FIRST_TOKEN_MS, the rest at FAKE_LLM_TOKENS_PER_SECOND (0 for no
+# delay). FAKE_LLM_ERROR_RATE of calls fail after the first-token delay;
+# which ones is drawn from FAKE_LLM_SEED, so a run is repeatable as long as
+# requests arrive in the same order.
+
+WORDS = (
+    "beach", "fort", "market", "spice", "ferry", "temple", "sunset", "curry", "scooter",
+    "museum", "harbour", "old", "town", "walk", "lunch", "local", "tour", "view", "garden",
+    "station", "cafe", "hill", "river", "boat", "night", "street", "food", "palace"
+)
+
+
+class FakeLLMError(RuntimeError):
+    pass
+
+
+class IncompleteIterationError(Exception):
+    # As google.generativeai raises for a chat whose last streamed response
+    # wasn't read to the end
+    pass
+
+
+class FakeLLM:
+    def __init__(
+        self,
+        first_token_seconds: float = 0.2,
+        tokens_per_second: float = 50.0,
+        error_rate: float = 0.0,
+        output_tokens: int = 64,
+        seed: int = 0
+    ):
+        self.first_token_seconds = first_token_seconds
+        self.tokens_per_second = tokens_per_second
+        self.error_rate = error_rate
+        self.output_tokens = output_tokens
+        self.seed = seed
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            first_token_seconds=float(os.getenv("FAKE_LLM_FIRST_TOKEN_MS", "200")) / 1000,
+            tokens_per_second=float(os.getenv("FAKE_LLM_TOKENS_PER_SECOND", "50")),
+            error_rate=float(os.getenv("FAKE_LLM_ERROR_RATE", "0")),
+            output_tokens=int(os.getenv("FAKE_LLM_OUTPUT_TOKENS", "64")),
+            seed=int(os.getenv("FAKE_LLM_SEED", "0"))
+        )
+
+    def reply(self, prompt: str, max_tokens: Optional[int] = None) -> List[str]:
+        # The reply's tokens, a function of the prompt and the seed only
+        words = random.Random(zlib.crc32(prompt.encode()) ^ self.seed)
+        count = self.output_tokens if max_tokens is None else min(self.output_tokens, max_tokens)
+        tokens = []
+        sentence = 0
+        for i in range(count):
+            word = words.choice(WORDS)
+            if sentence == 0:
+                word = word.capitalize()
+            sentence += 1
+            if sentence >= 12 or i == count - 1:
+                word += "."
+                sentence = 0
+            tokens.append(word if i == 0 else " " + word)
+        return tokens
+
+    def _fails(self) -> bool:
+        if not self.error_rate:
+            return False
+        with self._lock:
+            return self._random.random() < self.error_rate
+
+    def _token_seconds(self) -> float:
+        return 1 / self.tokens_per_second if self.tokens_per_second > 0 else 0.0
+
+    def stream(self, prompt: str, max_tokens: Optional[int] = None) -> Iterator[str]:
+        fails = self._fails()
+        time.sleep(self.first_token_seconds)
+        if fails:
+            raise FakeLLMError("fake LLM error")
+        delay = self._token_seconds()
+        for i, token in enumerate(self.reply(prompt, max_tokens)):
+            if i and delay:
+                time.sleep(delay)
+            yield token
+
+    async def stream_async(self, prompt: str, max_tokens: Optional[int] = None) -> AsyncIterator[str]:
+        fails = self._fails()
+        await asyncio.sleep(self.first_token_seconds)
+        if fails:
+            raise FakeLLMError("fake LLM error")
+        delay = self._token_seconds()
+        for i, token in enumerate(self.reply(prompt, max_tokens)):
+            if i and delay:
+                await asyncio.sleep(delay)
+            yield token
+
+    def generate(self, prompt: str, max_tokens: Optional[int] = None) -> str:
+        return "".join(self.stream(prompt, max_tokens))
+
+    async def generate_async(self, prompt: str, max_tokens: Optional[int] = None) -> str:
+        return "".join([token async for token in self.stream_async(prompt, max_tokens)])
+
+
+class FakeTransport:
+    # In place of InferenceTransport
+    def __init__(self, llm: FakeLLM):
+        self.llm = llm
+
+    def text_generation(self, prompt: str, *, model: str, stream: bool = False, max_new_tokens: Optional[int] = None, **parameters):
+        if stream:
+            return self.llm.stream(prompt, max_new_tokens)
+        return self.llm.generate(prompt, max_new_tokens)
+
+    def close(self):
+        pass
+
+
+class AsyncFakeTransport:
+    # In place of AsyncInferenceTransport
+    def __init__(self, llm: FakeLLM):
+        self.llm = llm
+
+    async def text_generation(self, prompt: str, *, model: str, stream: bool = False, max_new_tokens: Optional[int] = None, **parameters):
+        if stream:
+            return self.llm.stream_async(prompt, max_new_tokens)
+        return await self.llm.generate_async(prompt, max_new_tokens)
+
+    async def close(self):
+        pass
+
+
+class _Text:
+    # A response, or a chunk of a streamed one
+    __slots__ = ("text",)
+
+    def __init__(self, text: str):
+        self.text = text
+
+
+def _max_tokens(generation_config) -> Optional[int]:
+    return (generation_config or {}).get("max_output_tokens")
+
+
+class FakeChatSession:
+    # Like the SDK's ChatSession, history (and so the next send_message)
+    # raises while the last streamed response hasn't been read to the end,
+    # which it never will be once the caller stops reading
+    def __init__(self, llm: FakeLLM, history: Optional[list] = None):
+        self.llm = llm
+        self._history = list(history or [])
+        self._streaming = False
+
+    @property
+    def history(self) -> list:
+        if self._streaming:
+            raise IncompleteIterationError("the last streamed response was not iterated to the end")
+        return self._history
+
+    def send_message(self, content: str, generation_config=None, stream: bool = False):
+        self.history
+        tokens = self.llm.stream(content, _max_tokens(generation_config))
+        if not stream:
+            response = _Text("".join(tokens))
+            self._add(content, response.text)
+            return response
+        self._streaming = True
+        return self._chunks(content, tokens)
+
+    def _chunks(self, content: str, tokens: Iterator[str]) -> Iterator[_Text]:
+        text = []
+        for token in tokens:
+            text.append(token)
+            yield _Text(token)
+        self._streaming = False
+        self._add(content, "".join(text))
+
+    def _add(self, content: str, reply: str):
+        self._history.append({"role": "user", "parts": [content]})
+        self._history.append({"role": "model", "parts": [reply]})
+
+
+class FakeGenerativeModel:
+    def __init__(self, llm: FakeLLM):
+        self.llm = llm
+
+    def start_chat(self, history: Optional[list] = None) -> FakeChatSession:
+        return FakeChatSession(self.llm, history)
+
+    def generate_content(self, contents: str, generation_config=None) -> _Text:
+        return _Text(self.llm.generate(contents, _max_tokens(generation_config)))
+
+
+class FakeGemini:
+    # In place of the google.generativeai module
+    def __init__(self, llm: FakeLLM):
+        self.llm = llm
+
+    def GenerativeModel(self, model_name: str, safety_settings=None, system_instruction: Optional[str] = None):
+        return FakeGenerativeModel(self.llm)
@@ -0,0 +1,152 @@
+import os
+import time
+from collections import deque
+from types import SimpleNamespace
+from typing import Deque, Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+from app.utils.metrics import LOCAL_PROMPT_EVAL
+
+# llama.cpp backend for the local model (the default LOCAL_MODEL_BACKEND,
+# llama_cpp), with prompt-prefix state reuse.
+#
+# Itinerary prompts all start with the same instruction tokens, and
+# the turns of a conversation share everything up to the newest message.
+# When a prompt shares at least LOCAL_PREFIX_MIN_TOKENS leading tokens with
+# a recent one, that prefix is evaluated once and the model state after it
+# saved; later prompts starting with it load the state and evaluate only
+# their own suffix. Up to LOCAL_PREFIX_CACHE_SIZE states are kept, the least
+# used going first. Each one holds the KV cache for its prefix plus a copy of
+# the logits buffer, so budget a few hundred MB per state for a 7B model.
+#
+# ctransformers (LOCAL_MODEL_BACKEND=ctransformers) can't save or restore
+# its context, so that backend has no equivalent.
+
+Tokens = Tuple[int, ...]
+
+
+class _PrefixState:
+    __slots__ = ("state", "hits")
+
+    def __init__(self, state):
+        self.state = state
+        self.hits = 0
+
+
+class LlamaCppModel:
+    # The ctransformers model interface that LLMHandler and BatchScheduler
+    # use, over a llama_cpp.Llama
+
+    def __init__(
+        self,
+        llama,
+        max_new_tokens: int = 512,
+        prefix_states: int = 2,
+        min_prefix_tokens: int = 32,
+        recent: int = 16
+    ):
+        self.llama = llama
+        self.config = SimpleNamespace(max_new_tokens=max_new_tokens)
+        self.prefix_states = prefix_states
+        self.min_prefix_tokens = min_prefix_tokens
+        self._states: Dict[Tokens, _PrefixState] = {}
+        self._recent: Deque[Tokens] = deque(maxlen=recent)
+
+    @classmethod
+    def from_pretrained(cls, model_path: str, max_new_tokens: int = 512) -> "LlamaCppModel":
+        from llama_cpp import Llama
+        llama = Llama(
+            model_path=model_path,
+            n_ctx=int(os.getenv("LOCAL_MODEL_CONTEXT", "4096")),
+            verbose=False
+        )
+        return cls(
+            llama,
+            max_new_tokens=max_new_tokens,
+            prefix_states=int(os.getenv("LOCAL_PREFIX_CACHE_SIZE", "2")),
+            min_prefix_tokens=int(os.getenv("LOCAL_PREFIX_MIN_TOKENS", "32"))
+        )
+
+    def tokenize(self, text: str) -> List[int]:
+        return self.llama.tokenize(text.encode("utf-8"))
+
+    def detokenize(self, tokens: Sequence[int], decode: bool = True) -> Union[str, bytes]:
+        data = self.llama.detokenize(list(tokens))
+        return data.decode("utf-8", errors="ignore") if decode else data
+
+    def is_eos_token(self, token: int) -> bool:
+        return token == self.llama.token_eos()
+
+    def generate(self, tokens: Sequence[int]) -> Iterator[int]:
+        start = time.perf_counter()
+        outcome = self._restore(tuple(tokens))
+        first = True
+        # Llama.generate evaluates only what follows the tokens already in
+        # its context
+        for token in self.llama.generate(tokens):
+            if first:
+                LOCAL_PROMPT_EVAL.observe(time.perf_counter() - start, outcome)
+                first = False
+            yield token
+
+    def __call__(
+        self,
+        prompt: str,
+        stream: bool = False,
+        max_new_tokens: Optional[int] = None
+    ) -> Union[str, Iterator[str]]:
+        tokens = self._generate_text(self.tokenize(prompt), max_new_tokens or self.config.max_new_tokens)
+        return tokens if stream else "".join(tokens)
+
+    def _generate_text(self, tokens: List[int], max_new_tokens: int) -> Iterator[str]:
+        generated = []
+        text = ""
+        for token in self.generate(tokens):
+            if self.is_eos_token(token):
+                break
+            generated.append(token)
+            # Decoded together, so multi-byte characters split across tokens survive
+            decoded = self.detokenize(generated)
+            yield decoded[len(text):]
+            text = decoded
+            if len(generated) >= max_new_tokens:
+                break
+
+    def _restore(self, tokens: Tokens) -> str:
+        # Puts the longest saved prefix of `tokens` into the model's context;
+        # "hit", "miss", or "off" without a prefix cache
+        if not self.prefix_states:
+            return "off"
+        best = max((prefix for prefix in self._states if tokens[:len(prefix)] == prefix), key=len, default=None)
+        if best is not None and len(best) < len(tokens):
+            saved = self._states[best]
+            saved.hits += 1
+            current = self.llama.input_ids[:self.llama.n_tokens]
+            if self.llama.longest_token_prefix(current, tokens) < len(best):
+                self.llama.load_state(saved.state)
+            return "hit"
+
+        prefix = self._shared_prefix(tokens)
+        self._recent.append(tokens)
+        if prefix is not None:
+            # Evaluated once here, unless already in the context; this request
+            # then only evaluates its suffix
+            current = self.llama.input_ids[:self.llama.n_tokens]
+            if self.llama.longest_token_prefix(current, prefix) < len(prefix):
+                self.llama.reset()
+                self.llama.eval(list(prefix))
+            else:
+                self.llama.n_tokens = len(prefix)
+            if len(self._states) >= self.prefix_states:
+                del self._states[min(self._states, key=lambda p: self._states[p].hits)]
+            self._states[prefix] = _PrefixState(self.llama.save_state())
+        return "miss"
+
+    def _shared_prefix(self, tokens: Tokens) -> Optional[Tokens]:
+        # The longest leading run `tokens` shares with a recent prompt, if
+        # long enough to be worth a saved state
+        longest = max((self.llama.longest_token_prefix(other, tokens) for other in self._recent), default=0)
+        # At least one token is left to evaluate for the first sample
+        longest = min(longest, len(tokens) - 1)
+        if longest < self.min_prefix_tokens:
+            return None
+        return tokens[:longest]
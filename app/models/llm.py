@@ -1,72 +1,462 @@
+import asyncio
 import os
-from typing import List, Union
-from huggingface_hub import InferenceClient
-from ctransformers import AutoModelForCausalLM
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Awaitable, Callable, Dict, Iterator, List, Optional, Tuple, TypeVar, Union
 from dotenv import load_dotenv
+from app.models.fake import AsyncFakeTransport, FakeLLM, FakeTransport
+from app.models.local_server import LocalModelClient, load_local_model
+from app.models.router import Router
+from app.models.scheduler import BatchScheduler
+from app.models.transport import AsyncInferenceTransport, InferenceTransport
+from app.utils.context import CONTEXT_TOKEN_BUDGET, fit_turns
+from app.utils.metrics import (
+    HEDGE_LATENCY_SAVED,
+    HEDGED_REQUESTS,
+    LLM_TOKENS,
+    LOCAL_MODEL_LOAD_SECONDS,
+    TIME_TO_FIRST_TOKEN
+)
+from app.utils.prompts import generate_summary_prompt
+from app.utils.ratelimit import RateLimiter
+from app.utils.singleflight import SingleFlight, ThreadSingleFlight
+from app.utils.stops import STOP_SEQUENCES, trim_stop, trim_stream_async
+from app.utils.tokens import count_tokens
 
 # Load environment variables
 load_dotenv()
 
+T = TypeVar("T")
+
 class LLMHandler:
     def __init__(self):
-        self.api_model = self._initialize_api_model()
-        self.local_model = self._initialize_local_model()
-        
-    def _initialize_api_model(self):
-        # Using HuggingFace's Inference API
-        api_token = os.getenv("HF_API_TOKEN")
-        if not api_token:
-            raise ValueError("HF_API_TOKEN not found in environment variables")
-        return InferenceClient(token=api_token)
-    
+        # With LLM_BACKEND=fake a stand-in answers in place of the API, and
+        # there is no local model: for load tests and running offline
+        # (app/models/fake.py)
+        self._fake = os.getenv("LLM_BACKEND", "live").lower() == "fake"
+        if self._fake:
+            fake = FakeLLM.from_env()
+            self.api_model = FakeTransport(fake)
+            self.async_api_model = AsyncFakeTransport(fake)
+        else:
+            # Using HuggingFace's Inference API, over pooled keep-alive
+            # connections (app/models/transport.py)
+            api_token = os.getenv("HF_API_TOKEN")
+            if not api_token:
+                raise ValueError("HF_API_TOKEN not found in environment variables")
+            self.api_model = InferenceTransport.from_env(api_token)
+            # Same API, for the FastAPI endpoints
+            self.async_api_model = AsyncInferenceTransport.from_env(api_token)
+        # Local model calls run on their own small thread pool so a generation
+        # never blocks the event loop, and at most LOCAL_MODEL_MAX_PENDING
+        # requests wait for it instead of piling up without bound. The calls
+        # themselves are interleaved by a BatchScheduler, so the pool is as
+        # large as a batch.
+        self._local_workers = int(os.getenv("LOCAL_MODEL_WORKERS", os.getenv("LOCAL_BATCH_MAX", "8")))
+        self._local_executor = ThreadPoolExecutor(
+            max_workers=self._local_workers,
+            thread_name_prefix="local-llm"
+        )
+        self._local_slots = asyncio.Semaphore(int(os.getenv("LOCAL_MODEL_MAX_PENDING", "32")))
+        # The local model loads in the background; until it is set, requests
+        # go to the API only
+        self.local_model = None
+        self.local_model_state = "loading"
+        self._local_loader = threading.Thread(
+            target=self._initialize_local_model,
+            name="local-llm-loader",
+            daemon=True
+        )
+        self._local_loader.start()
+        # Requests go to the first backend whose circuit breaker lets them
+        # through, then to the next if it fails
+        backends = ("api", "local", "api_secondary")
+        self._router = Router.from_env(backends)
+        # Metric series per backend, bound once
+        self._first_token = {backend: TIME_TO_FIRST_TOKEN.labels(backend) for backend in backends}
+        self._tokens_in = {backend: LLM_TOKENS.labels(backend, "in") for backend in backends}
+        self._tokens_out = {backend: LLM_TOKENS.labels(backend, "out") for backend in backends}
+        # Requests per second to each backend (<BACKEND>_RATE_LIMIT, default
+        # unlimited). Waited for inside the router's attempt, so a wait that
+        # is cancelled still releases a half-open breaker's probe slot, but
+        # with the clock restarted after it, so it isn't taken for the
+        # backend's latency
+        self._rate_limits = {backend: RateLimiter.from_env(backend) for backend in backends}
+        # Inference API request parameters by backend name, read once here;
+        # SECONDARY_MODEL adds a second model, tried after the local one
+        models = {"api": os.getenv("DEFAULT_MODEL", "mistralai/Mistral-7B-Instruct-v0.1")}
+        if os.getenv("SECONDARY_MODEL"):
+            models["api_secondary"] = os.getenv("SECONDARY_MODEL")
+        self._api_parameters = {
+            backend: {
+                "model": model,
+                "max_new_tokens": int(os.getenv("MAX_NEW_TOKENS", "512")),
+                "temperature": float(os.getenv("TEMPERATURE", "0.7")),
+                # Ends the reply where the model starts writing the next turn
+                "stop_sequences": list(STOP_SEQUENCES)
+            }
+            for backend, model in models.items()
+        }
+        # With HEDGE_REQUESTS on, a request that a backend hasn't answered by
+        # its observed HEDGE_PERCENTILE latency also goes to the next one, and
+        # the first answer wins. Not before HEDGE_MIN_SAMPLES latencies are
+        # known, so a cold start doesn't double every request.
+        hedging = os.getenv("HEDGE_REQUESTS", "false").lower() in ("1", "true", "yes")
+        self._hedge_percentile = float(os.getenv("HEDGE_PERCENTILE", "0.95")) if hedging else None
+        self._hedge_min_samples = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+        # Identical prompts in flight at the same time share one generation
+        self._flights = SingleFlight("llm")
+        self._thread_flights = ThreadSingleFlight("llm")
+
     def _initialize_local_model(self):
-        # Initialize local GGML model
-        model_path = "models/llama-2-7b-chat.gguf"
-        if os.path.exists(model_path):
-            return AutoModelForCausalLM.from_pretrained(
-                model_path,
-                model_type="llama",
-                max_new_tokens=512
-            )
-        return None
+        # With LOCAL_MODEL_SOCKET the model lives in a sidecar process shared
+        # by all workers (app/models/local_server.py); otherwise this process
+        # loads its own copy
+        if self._fake:
+            self.local_model_state = "absent"
+            return
+        socket_path = os.getenv("LOCAL_MODEL_SOCKET")
+        if socket_path:
+            self._connect_local_server(socket_path)
+            return
+        model_path = os.getenv("LOCAL_MODEL_PATH", "models/llama-2-7b-chat.gguf")
+        if not os.path.exists(model_path):
+            self.local_model_state = "absent"
+            return
+        try:
+            start = time.perf_counter()
+            model = load_local_model(model_path)
+            LOCAL_MODEL_LOAD_SECONDS.set(time.perf_counter() - start)
+            self.local_model = BatchScheduler.from_env(model)
+            self.local_model_state = "ready"
+        except Exception as e:
+            print(f"Error loading local model: {str(e)}")
+            self.local_model_state = "failed"
+
+    def _connect_local_server(self, socket_path: str):
+        # Waits for the sidecar to come up and finish loading. Each executor
+        # thread gets a pooled connection.
+        client = LocalModelClient(
+            socket_path,
+            pool_size=self._local_workers,
+            timeout=float(os.getenv("LOCAL_MODEL_TIMEOUT", "300"))
+        )
+        deadline = time.monotonic() + float(os.getenv("LOCAL_MODEL_CONNECT_TIMEOUT", "600"))
+        while True:
+            try:
+                status = client.status()
+            except OSError:
+                # Not started yet
+                status = {"state": "loading"}
+            if status["state"] != "loading":
+                break
+            if time.monotonic() > deadline:
+                print(f"Local model server at {socket_path} did not become ready")
+                status = {"state": "failed"}
+                break
+            time.sleep(1)
+        if status["state"] == "ready":
+            if status.get("load_seconds") is not None:
+                LOCAL_MODEL_LOAD_SECONDS.set(status["load_seconds"])
+            self.local_model = client
+        self.local_model_state = status["state"]
+
+    def wait_for_local_model(self, timeout: Optional[float] = None) -> bool:
+        # Blocks until loading has finished; True if the model is usable
+        self._local_loader.join(timeout)
+        return self.local_model is not None
+
+    def _backends(self) -> List[str]:
+        # In order of preference
+        backends = ["api", "local"] if self.local_model else ["api"]
+        return backends + [name for name in self._api_parameters if name != "api"]
+
+    def backend_health(self) -> Dict[str, dict]:
+        # Breaker state and rolling p50/p99 per backend
+        return self._router.snapshot()
+
+    def status(self) -> Dict[str, str]:
+        # Readiness of each backend: "ready", "open" while its circuit
+        # breaker is open (for the API, every API backend's), or for the
+        # local model also "loading", "failed" or "absent" (no model file)
+        health = self._router.backends
+        api = any(health[name].available() for name in self._backends() if name != "local")
+        local = self.local_model_state
+        if local == "ready" and not health["local"].available():
+            local = "open"
+        return {
+            "api": "ready" if api else "open",
+            "local": local,
+        }
 
     def generate_response(self, message: str, context: List[dict]) -> str:
-        # Try API model first, fallback to local if needed
+        return self._thread_flights.do(
+            self._format_prompt(message, context),
+            lambda: self._generate_response(message, context)
+        )
+
+    def _generate_response(self, message: str, context: List[dict]) -> str:
+        # API model first, local model if the API fails or its breaker is open
+        error = None
+        for backend in self._router.candidates(self._backends()):
+            try:
+                with self._router.attempt(backend) as attempt:
+                    self._rate_limits[backend].wait()
+                    attempt.waited()
+                    if backend == "local":
+                        return trim_stop(self._generate_local_response(message, context))
+                    return trim_stop(self._generate_api_response(message, context, backend))
+            except Exception as e:
+                error = e
+        raise error
+
+    async def generate_response_async(self, message: str, context: List[dict]) -> str:
+        return await self._flights.do(
+            self._format_prompt(message, context),
+            lambda: self._generate_response_async(message, context)
+        )
+
+    async def _generate_response_async(self, message: str, context: List[dict]) -> str:
+        # Same as _generate_response, without blocking the event loop, and
+        # hedged when HEDGE_REQUESTS is on
+        async def call(backend: str) -> str:
+            with self._router.attempt(backend) as attempt:
+                await self._rate_limits[backend].wait_async()
+                attempt.waited()
+                if backend == "local":
+                    return trim_stop(await self._generate_local_response_async(message, context))
+                return trim_stop(await self._generate_api_response_async(message, context, backend))
+
+        error = None
+        candidates = self._router.candidates(self._backends())
+        for backend in candidates:
+            try:
+                return (await self._hedged(backend, candidates, call))[1]
+            except Exception as e:
+                error = e
+        raise error
+
+    async def _hedged(
+        self,
+        backend: str,
+        candidates: Iterator[str],
+        call: Callable[[str], Awaitable[T]]
+    ) -> Tuple[str, T]:
+        # Runs call(backend). With hedging on, if it hasn't answered by the
+        # backend's observed p95, the next candidate gets the same request
+        # and the first to answer wins; the other is cancelled. Returns the
+        # winning backend and its answer.
+        delay = self._hedge_delay(backend)
+        tasks = {asyncio.ensure_future(call(backend)): backend}
+        started = time.perf_counter()
         try:
-            return self._generate_api_response(message, context)
-        except Exception as e:
-            if self.local_model:
-                return self._generate_local_response(message, context)
-            raise e
+            if delay is not None:
+                done, _ = await asyncio.wait(tasks, timeout=delay)
+                secondary = next(candidates, None) if not done else None
+                if secondary is not None:
+                    tasks[asyncio.ensure_future(call(secondary))] = secondary
+            if len(tasks) == 1:
+                if delay is not None:
+                    HEDGED_REQUESTS.inc("not_hedged")
+                return backend, await next(iter(tasks))
+
+            pending = set(tasks)
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None:
+                        error = task.exception()
+                        continue
+                    winner = tasks[task]
+                    HEDGED_REQUESTS.inc("primary" if winner == backend else "hedge")
+                    if winner != backend:
+                        self._record_saving(backend, time.perf_counter() - started)
+                        self._router.backends[backend].record_lower_bound(time.perf_counter() - started)
+                    return winner, task.result()
+            raise error
+        finally:
+            # Waited for, so the loser has let go of its backend on return
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _hedge_delay(self, backend: str) -> Optional[float]:
+        # None when not hedging, or before there are enough samples to know
+        # what slow is for this backend
+        if not self._hedge_percentile:
+            return None
+        health = self._router.backends[backend]
+        if len(health.latencies) < self._hedge_min_samples:
+            return None
+        return health.percentile(self._hedge_percentile)
+
+    def _record_saving(self, backend: str, elapsed: float):
+        # The primary was cancelled, so how long it would have taken is
+        # estimated from its own recent latencies beyond `elapsed`. Those
+        # include earlier lower bounds, so the estimate errs low.
+        slower = [latency for latency in self._router.backends[backend].latencies if latency > elapsed]
+        if slower:
+            HEDGE_LATENCY_SAVED.observe(sum(slower) / len(slower) - elapsed)
 
-    def _generate_api_response(self, message: str, context: List[dict]) -> str:
+    def _generate_api_response(self, message: str, context: List[dict], backend: str = "api") -> str:
         prompt = self._format_prompt(message, context)
-        response = self.api_model.text_generation(
-            prompt,
-            model=os.getenv("DEFAULT_MODEL", "mistralai/Mistral-7B-Instruct-v0.1"),
-            max_new_tokens=int(os.getenv("MAX_NEW_TOKENS", "512")),
-            temperature=float(os.getenv("TEMPERATURE", "0.7"))
-        )
-        return response
+        response = self.api_model.text_generation(prompt, **self._api_parameters[backend])
+        return self._count_tokens(backend, prompt, response)
+
+    async def _generate_api_response_async(self, message: str, context: List[dict], backend: str = "api") -> str:
+        prompt = self._format_prompt(message, context)
+        response = await self.async_api_model.text_generation(prompt, **self._api_parameters[backend])
+        return self._count_tokens(backend, prompt, response)
 
     def _generate_local_response(self, message: str, context: List[dict]) -> str:
         prompt = self._format_prompt(message, context)
-        response = self.local_model(prompt)
+        response = self._local_executor.submit(self.local_model, prompt, stop=STOP_SEQUENCES).result()
+        return self._count_tokens("local", prompt, response)
+
+    async def _generate_local_response_async(self, message: str, context: List[dict]) -> str:
+        # Streamed and joined, so a cancelled request (e.g. a hedge that
+        # lost) stops generating instead of running on in its thread
+        prompt = self._format_prompt(message, context)
+        return self._count_tokens("local", prompt, "".join([token async for token in self._stream_local(prompt)]))
+
+    def _count_tokens(self, backend: str, prompt: str, response: str) -> str:
+        self._tokens_in[backend].inc(count_tokens(prompt))
+        self._tokens_out[backend].inc(count_tokens(response))
         return response
 
     def generate_itinerary(self, prompt: str) -> str:
         # Specialized method for itinerary generation
-        try:
-            return self._generate_api_response(prompt, [])
-        except Exception as e:
-            if self.local_model:
-                return self._generate_local_response(prompt, [])
-            raise e
+        return self.generate_response(prompt, [])
+
+    async def generate_itinerary_async(self, prompt: str) -> str:
+        return await self.generate_response_async(prompt, [])
+
+    def stream_response(self, message: str, context: List[dict]) -> AsyncIterator[str]:
+        # Yields the response token by token. Falls back to the local model
+        # only if the API fails before producing anything.
+        prompt = self._format_prompt(message, context)
+        return self._flights.stream(prompt, lambda: self._stream(prompt))
+
+    def stream_itinerary(self, prompt: str) -> AsyncIterator[str]:
+        return self.stream_response(prompt, [])
+
+    async def _stream(self, prompt: str) -> AsyncIterator[str]:
+        # Moves on to the next backend only if nothing has been sent yet.
+        # Hedging races the backends to the first token.
+        streams: Dict[str, AsyncIterator[str]] = {}
+
+        async def first_token(backend: str) -> Optional[str]:
+            tokens = streams[backend] = self._backend_stream(backend, prompt)
+            try:
+                return await tokens.__anext__()
+            except StopAsyncIteration:
+                return None
+
+        error = None
+        candidates = self._router.candidates(self._backends())
+        for backend in candidates:
+            winner = None
+            try:
+                winner, token = await self._hedged(backend, candidates, first_token)
+            except Exception as e:
+                error = e
+                continue
+            finally:
+                tokens = streams.pop(winner, None)
+                for other in streams.values():
+                    await other.aclose()
+                streams.clear()
+            try:
+                if token is None:
+                    return
+                yield token
+                async for token in tokens:
+                    yield token
+                return
+            finally:
+                await tokens.aclose()
+        raise error
+
+    async def _backend_stream(self, backend: str, prompt: str) -> AsyncIterator[str]:
+        if backend == "local":
+            tokens = self._stream_local(prompt)
+        else:
+            tokens = self._stream_api(prompt, backend)
+        self._tokens_in[backend].inc(count_tokens(prompt))
+        first_token = self._first_token[backend]
+        tokens_out = self._tokens_out[backend]
+        with self._router.attempt(backend) as attempt:
+            await self._rate_limits[backend].wait_async()
+            attempt.waited()
+            async for token in trim_stream_async(tokens):
+                if attempt.first_token is None:
+                    attempt.started()
+                    first_token.observe(attempt.first_token)
+                tokens_out.inc(count_tokens(token))
+                yield token
+
+    async def _stream_api(self, prompt: str, backend: str = "api") -> AsyncIterator[str]:
+        tokens = await self.async_api_model.text_generation(prompt, stream=True, **self._api_parameters[backend])
+        async for token in tokens:
+            yield token
+
+    async def _stream_local(self, prompt: str) -> AsyncIterator[str]:
+        # The local model streams from a blocking generator, so run it on the
+        # local model's thread and hand tokens over through a queue
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        stop = threading.Event()
+        done = object()
+
+        def produce():
+            try:
+                for token in self.local_model(prompt, stream=True, stop=STOP_SEQUENCES):
+                    if stop.is_set():
+                        break
+                    loop.call_soon_threadsafe(queue.put_nowait, token)
+            except Exception as e:
+                loop.call_soon_threadsafe(queue.put_nowait, e)
+            finally:
+                loop.call_soon_threadsafe(queue.put_nowait, done)
+
+        async with self._local_slots:
+            worker = loop.run_in_executor(self._local_executor, produce)
+            try:
+                while True:
+                    item = await queue.get()
+                    if item is done:
+                        break
+                    if isinstance(item, Exception):
+                        raise item
+                    yield item
+            finally:
+                # The client may have gone away; don't keep generating for nobody
+                stop.set()
+                await worker
+
+    def summarize(self, summary: Optional[str], turns: List[Tuple[str, str]]) -> str:
+        # Folds `turns` into the running conversation summary
+        return self.generate_response(generate_summary_prompt(summary, turns), [])
+
+    async def summarize_async(self, summary: Optional[str], turns: List[Tuple[str, str]]) -> str:
+        return await self.generate_response_async(generate_summary_prompt(summary, turns), [])
 
     def _format_prompt(self, message: str, context: List[dict]) -> str:
-        # Format the conversation context and current message
+        # Format the conversation context and current message. Context may
+        # start with a {"summary": ...} of older turns; only the newest turns
+        # that fit CONTEXT_TOKEN_BUDGET are kept, using the turns' "tokens"
+        # counts where build_context has set them.
+        summary = context[0]["summary"] if context and "summary" in context[0] else None
+        context = [turn for turn in context if "summary" not in turn]
+        turns = [(turn["user"], turn["assistant"]) for turn in context]
+        tokens = [turn["tokens"] for turn in context] if all("tokens" in turn for turn in context) else None
+        turns = turns[fit_turns(turns, CONTEXT_TOKEN_BUDGET - count_tokens(summary), tokens):]
         formatted_context = "\n".join([
-            f"User: {turn['user']}\nAssistant: {turn['assistant']}"
-            for turn in context
+            f"User: {user}\nAssistant: {assistant}"
+            for user, assistant in turns
         ])
-        return f"{formatted_context}\nUser: {message}\nAssistant:" 
\ No newline at end of file
+        if summary:
+            formatted_context = f"Summary of the conversation so far: {summary}\n{formatted_context}"
+        return f"{formatted_context}\nUser: {message}\nAssistant:"
@@ -0,0 +1,287 @@
+import argparse
+import json
+import os
+import queue
+import socket
+import socketserver
+import threading
+import time
+from typing import Iterator, Optional, Sequence, Union
+
+from app.models.scheduler import BatchScheduler
+from app.utils.metrics import render_metrics
+
+# Local model sidecar.
+#
+# Every API worker that loads the GGUF model itself holds its own multi-GB
+# copy. Instead, one sidecar process owns the model and serves generations
+# over a Unix domain socket, and the workers talk to it through a small
+# connection pool (LOCAL_MODEL_SOCKET). The protocol is one JSON object per
+# line in each direction:
+#
+#   {"op": "status"}                                 -> {"state": ..., "load_seconds": ...}
+#   {"op": "metrics"}                                -> {"text": <Prometheus text>}
+#   {"op": "generate", "prompt": ..., "stream": false} -> {"text": ...}
+#   {"op": "generate", "prompt": ..., "stream": true}  -> {"token": ...}... {"done": true}
+#
+# Any request may instead be answered with {"error": ...}.
+#
+#   python -m app.models.local_server --socket /run/travel-assistant/llm.sock
+
+
+def load_local_model(model_path: str):
+    # Loads the GGUF model with LOCAL_MODEL_BACKEND (llama_cpp, which reuses
+    # prompt prefixes, or ctransformers), then warms it up with a tiny
+    # generation so the first real request doesn't pay for page faults and
+    # buffers
+    if os.getenv("LOCAL_MODEL_BACKEND", "llama_cpp") != "ctransformers":
+        from app.models.llama_backend import LlamaCppModel
+        model = LlamaCppModel.from_pretrained(model_path, max_new_tokens=512)
+    else:
+        from ctransformers import AutoModelForCausalLM
+        model = AutoModelForCausalLM.from_pretrained(
+            model_path,
+            model_type="llama",
+            max_new_tokens=512
+        )
+    model("Hello", max_new_tokens=1)
+    return model
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        # One connection carries any number of requests, one at a time
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                if request.get("op") == "status":
+                    self._send(self.server.status())
+                elif request.get("op") == "metrics":
+                    # The scheduler's queue wait, batch sizes and tokens/sec
+                    self._send({"text": render_metrics()})
+                else:
+                    self._generate(request)
+            except (BrokenPipeError, ConnectionResetError):
+                # The client went away, possibly mid-stream; stop generating
+                return
+            except Exception as e:
+                self._send({"error": str(e)})
+
+    def _generate(self, request: dict):
+        model = self.server.model
+        if model is None:
+            raise RuntimeError(f"local model is {self.server.state}")
+        kwargs = {"max_new_tokens": request["max_new_tokens"]} if request.get("max_new_tokens") else {}
+        if request.get("stop"):
+            kwargs["stop"] = request["stop"]
+        if request.get("stream"):
+            tokens = model(request["prompt"], stream=True, **kwargs)
+            try:
+                for token in tokens:
+                    self._send({"token": token})
+            finally:
+                # Cancels the generation if the client went away
+                tokens.close()
+            self._send({"done": True})
+        else:
+            self._send({"text": model(request["prompt"], **kwargs)})
+
+    def _send(self, message: dict):
+        self.wfile.write(json.dumps(message).encode() + b"\n")
+        self.wfile.flush()
+
+
+class LocalModelServer(socketserver.ThreadingUnixStreamServer):
+    # Connections are served on their own threads, so `model` must take
+    # concurrent calls; load() puts a BatchScheduler in front of the model
+    daemon_threads = True
+
+    def __init__(self, path: str, model=None):
+        if os.path.exists(path):
+            # Left behind by a previous run
+            os.unlink(path)
+        super().__init__(path, _Handler)
+        os.chmod(path, 0o600)
+        self.path = path
+        self.model = model
+        self.state = "ready" if model is not None else "loading"
+        self.load_seconds: Optional[float] = None
+
+    def load(self, model_path: str):
+        if not os.path.exists(model_path):
+            self.state = "absent"
+            return
+        try:
+            start = time.perf_counter()
+            model = load_local_model(model_path)
+            self.load_seconds = time.perf_counter() - start
+            self.model = BatchScheduler.from_env(model)
+            self.state = "ready"
+        except Exception as e:
+            print(f"Error loading local model: {str(e)}")
+            self.state = "failed"
+
+    def status(self) -> dict:
+        return {"state": self.state, "load_seconds": self.load_seconds}
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+class _Connection:
+    __slots__ = ("sock", "reader", "reused")
+
+    def __init__(self, path: str, timeout: Optional[float]):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        try:
+            self.sock.connect(path)
+        except OSError:
+            self.sock.close()
+            raise
+        self.reader = self.sock.makefile("rb")
+        self.reused = False
+
+    def send(self, message: dict):
+        self.sock.sendall(json.dumps(message).encode() + b"\n")
+
+    def receive(self) -> dict:
+        line = self.reader.readline()
+        if not line:
+            raise ConnectionError("local model server closed the connection")
+        return json.loads(line)
+
+    def close(self):
+        self.reader.close()
+        self.sock.close()
+
+
+class LocalModelClient:
+    # Callable like a ctransformers model, so LLMHandler uses either one the
+    # same way. Keeps up to `pool_size` connections open to the sidecar.
+    # `timeout` bounds each wait for a reply line (a token when streaming,
+    # the whole text otherwise), so a hung sidecar fails the request with
+    # socket.timeout instead of blocking its thread for good.
+
+    def __init__(self, path: str, pool_size: int = 4, timeout: Optional[float] = 300.0):
+        self.path = path
+        self.timeout = timeout
+        self._idle: "queue.LifoQueue[_Connection]" = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(pool_size)
+
+    def __call__(
+        self,
+        prompt: str,
+        stream: bool = False,
+        max_new_tokens: Optional[int] = None,
+        stop: Optional[Sequence[str]] = None
+    ) -> Union[str, Iterator[str]]:
+        message = {"op": "generate", "prompt": prompt, "stream": stream}
+        if max_new_tokens:
+            message["max_new_tokens"] = max_new_tokens
+        if stop:
+            message["stop"] = list(stop)
+        if stream:
+            return self._stream(message)
+        return self._call(message)["text"]
+
+    def status(self) -> dict:
+        return self._call({"op": "status"})
+
+    def metrics(self) -> str:
+        return self._call({"op": "metrics"})["text"]
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+    def _call(self, message: dict) -> dict:
+        for reply in self._exchange(message):
+            pass
+        if "error" in reply:
+            raise RuntimeError(reply["error"])
+        return reply
+
+    def _stream(self, message: dict) -> Iterator[str]:
+        for reply in self._exchange(message):
+            if "error" in reply:
+                raise RuntimeError(reply["error"])
+            if "token" in reply:
+                yield reply["token"]
+
+    def _exchange(self, message: dict) -> Iterator[dict]:
+        # The replies to `message`. A pooled connection the sidecar has closed
+        # since (e.g. it restarted) is replaced once, before anything arrived.
+        # A stream abandoned half way closes its connection, which stops the
+        # generation on the other end.
+        for attempt in range(2):
+            conn = self._acquire()
+            reusable = False
+            try:
+                try:
+                    conn.send(message)
+                    reply = conn.receive()
+                except socket.timeout:
+                    # The sidecar is there but not answering; trying again
+                    # would only wait as long again
+                    raise
+                except OSError:
+                    if attempt or not conn.reused:
+                        raise
+                    self.close()
+                    continue
+                while "token" in reply:
+                    yield reply
+                    reply = conn.receive()
+                reusable = True
+            finally:
+                self._release(conn, reusable)
+            yield reply
+            return
+
+    def _acquire(self) -> _Connection:
+        self._slots.acquire()
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        try:
+            return _Connection(self.path, self.timeout)
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def _release(self, conn: _Connection, reusable: bool):
+        if reusable:
+            conn.reused = True
+            self._idle.put(conn)
+        else:
+            conn.close()
+        self._slots.release()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the local model over a Unix domain socket")
+    parser.add_argument("--socket", default=os.getenv("LOCAL_MODEL_SOCKET", "local-model.sock"))
+    parser.add_argument("--model", default=os.getenv("LOCAL_MODEL_PATH", "models/llama-2-7b-chat.gguf"))
+    args = parser.parse_args()
+
+    server = LocalModelServer(args.socket)
+    # Status requests are answered while the model loads
+    threading.Thread(target=server.load, args=(args.model,), name="local-llm-loader", daemon=True).start()
+    print(f"Serving the local model on {args.socket}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Deque, Dict, Iterator, Optional, Sequence
+
+from app.utils.metrics import BACKEND_CIRCUIT_STATE, BACKEND_LATENCY, BACKEND_REQUESTS, LLM_REQUEST_SECONDS
+from app.utils.tracing import current_trace
+
+# Backend health and routing.
+#
+# Each backend keeps its latencies over the last BACKEND_LATENCY_WINDOW
+# requests and a circuit breaker. After BACKEND_FAILURE_THRESHOLD failures
+# in a row the breaker opens and the backend is skipped, so requests go
+# straight to the next one instead of waiting out a failing upstream. After
+# BACKEND_OPEN_SECONDS it is half-open: one request at a time is let through
+# as a probe, and the breaker closes again on the first success.
+#
+# Latency is the time until a backend's response starts: the first token of
+# a stream, or the whole response otherwise. LLM_REQUEST_SECONDS has each
+# call's full duration, and a traced request gets an "llm.<backend>" span
+# per call.
+
+CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class BackendHealth:
+    def __init__(self, name: str, failure_threshold: int = 5, open_seconds: float = 30.0, window: int = 200):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.latencies: Deque[float] = deque(maxlen=window)
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+        self._lock = threading.Lock()
+        self._ok = BACKEND_REQUESTS.labels(name, "ok")
+        self._errors = BACKEND_REQUESTS.labels(name, "error")
+        self.duration = LLM_REQUEST_SECONDS.labels(name)
+        self.span = f"llm.{name}"
+        BACKEND_CIRCUIT_STATE.set(_STATE_VALUES[CLOSED], name)
+
+    def admit(self) -> bool:
+        # Whether a request may go to this backend now; in half-open state
+        # this takes the single probe slot
+        with self._lock:
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.open_seconds:
+                self._set_state(HALF_OPEN)
+            if self.state == CLOSED:
+                return True
+            if self.state == HALF_OPEN and not self.probing:
+                self.probing = True
+                return True
+            return False
+
+    def available(self) -> bool:
+        # Whether admit() would consider this backend now: closed, half-open,
+        # or open for long enough to be probed. Takes no probe slot.
+        with self._lock:
+            return self.state != OPEN or time.monotonic() - self.opened_at >= self.open_seconds
+
+    def record(self, seconds: float, ok: Optional[bool]):
+        # ok is None for a request abandoned by its caller, which says
+        # nothing about the backend
+        with self._lock:
+            self.probing = False
+            if ok is None:
+                return
+            (self._ok if ok else self._errors).inc()
+            if ok:
+                self.latencies.append(seconds)
+                self.failures = 0
+                if self.state != CLOSED:
+                    self._set_state(CLOSED)
+            else:
+                self.failures += 1
+                if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                    self.opened_at = time.monotonic()
+                    self._set_state(OPEN)
+        if ok:
+            BACKEND_LATENCY.set(self.percentile(0.5), self.name, "0.5")
+            BACKEND_LATENCY.set(self.percentile(0.99), self.name, "0.99")
+
+    def record_lower_bound(self, seconds: float):
+        # A request abandoned after `seconds` because another backend answered
+        # first would have taken at least that long. Kept in the window so
+        # the slow responses that hedging cuts short still count.
+        with self._lock:
+            self.latencies.append(seconds)
+
+    def percentile(self, q: float) -> Optional[float]:
+        latencies = sorted(self.latencies)
+        if not latencies:
+            return None
+        return latencies[min(int(q * len(latencies)), len(latencies) - 1)]
+
+    def snapshot(self) -> dict:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.failures,
+            "p50": self.percentile(0.5),
+            "p99": self.percentile(0.99),
+            "samples": len(self.latencies),
+        }
+
+    def _set_state(self, state: str):
+        self.state = state
+        BACKEND_CIRCUIT_STATE.set(_STATE_VALUES[state], self.name)
+
+
+class _Attempt:
+    __slots__ = ("start", "first_token")
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.first_token: Optional[float] = None
+
+    def waited(self):
+        # Starts the clock again after a wait that isn't the backend's doing,
+        # such as its rate limit
+        self.start = time.perf_counter()
+
+    def started(self):
+        # Marks the first token of a streamed response
+        if self.first_token is None:
+            self.first_token = time.perf_counter() - self.start
+
+
+class Router:
+    def __init__(self, names: Sequence[str], **options):
+        self.backends: Dict[str, BackendHealth] = {name: BackendHealth(name, **options) for name in names}
+
+    @classmethod
+    def from_env(cls, names: Sequence[str]) -> "Router":
+        return cls(
+            names,
+            failure_threshold=int(os.getenv("BACKEND_FAILURE_THRESHOLD", "5")),
+            open_seconds=float(os.getenv("BACKEND_OPEN_SECONDS", "30")),
+            window=int(os.getenv("BACKEND_LATENCY_WINDOW", "200"))
+        )
+
+    def candidates(self, usable: Sequence[str]) -> Iterator[str]:
+        # The backends to try, in order: those admitted by their breaker, or
+        # if every breaker is open, all of them as a last resort. Lazy, so a
+        # half-open backend's probe slot is only taken if it is tried.
+        admitted = False
+        for name in usable:
+            if self.backends[name].admit():
+                admitted = True
+                yield name
+        if not admitted:
+            yield from usable
+
+    @contextmanager
+    def attempt(self, name: str) -> Iterator[_Attempt]:
+        attempt = _Attempt()
+        ok = None
+        try:
+            yield attempt
+            ok = True
+        except Exception:
+            ok = False
+            raise
+        finally:
+            elapsed = time.perf_counter() - attempt.start
+            health = self.backends[name]
+            health.record(attempt.first_token if attempt.first_token is not None else elapsed, ok)
+            if ok is not None:
+                health.duration.observe(elapsed)
+            trace = current_trace()
+            if trace is not None:
+                outcome = "abandoned" if ok is None else "ok" if ok else "error"
+                args = {"outcome": outcome}
+                if attempt.first_token is not None:
+                    args["first_token_ms"] = round(attempt.first_token * 1000, 1)
+                trace.add(health.span, attempt.start, attempt.start + elapsed, args)
+
+    def snapshot(self) -> Dict[str, dict]:
+        return {name: health.snapshot() for name, health in self.backends.items()}
@@ -0,0 +1,223 @@
+import codecs
+import os
+import queue
+import threading
+import time
+from typing import Iterator, List, Optional, Sequence, Union
+
+from app.utils.metrics import LOCAL_BATCH_SIZE, LOCAL_QUEUE_WAIT, LOCAL_TOKENS, LOCAL_TOKENS_PER_SECOND
+from app.utils.stops import StopTrimmer
+
+# Request scheduling for the local model.
+#
+# A ctransformers model holds a single sequence, so calling it directly
+# makes every request wait for the whole generation in front of it: a short
+# chat reply queues behind a 512-token itinerary. The scheduler owns the
+# model on one thread. It gathers requests for LOCAL_BATCH_WINDOW_MS (or
+# until LOCAL_BATCH_MAX are waiting) and interleaves their generation,
+# LOCAL_BATCH_QUANTUM tokens at a time, admitting new requests between
+# rounds. Each round goes to the request with the fewest tokens left to
+# generate, so a chat reply overtakes an itinerary; every round a request is
+# passed over takes a quarter quantum off its remaining tokens, so long
+# requests still make progress under a stream of short ones.
+#
+# The model has one context: switching requests means evaluating the other
+# request's prompt and tokens so far again. Running the shortest request
+# first keeps switches to about one per arrival, where round robin would
+# switch every quantum.
+#
+# A request with stop sequences ends at the first one in its text, which is
+# left out of the output. Requests whose caller has gone away are dropped at
+# the start of each round. Should the scheduler thread itself fail, every
+# waiting request, and every later one, gets the error.
+
+
+class _Request:
+    __slots__ = ("prompt", "tokens", "generated", "max_new_tokens", "queued", "started", "done", "skipped", "out",
+                 "decoder", "stops", "cancelled", "tokens_iter")
+
+    def __init__(self, prompt: str, max_new_tokens: int, stop: Optional[Sequence[str]] = None):
+        self.prompt = prompt
+        self.tokens: List[int] = []
+        self.generated: List[int] = []
+        self.max_new_tokens = max_new_tokens
+        self.queued = time.perf_counter()
+        self.started = False
+        self.done = False
+        # Rounds spent waiting for another request
+        self.skipped = 0
+        # Text pieces, then _DONE or the exception that ended the request
+        self.out: "queue.SimpleQueue" = queue.SimpleQueue()
+        # Tokens may split a UTF-8 character
+        self.decoder = codecs.getincrementaldecoder("utf-8")(errors="ignore")
+        self.stops = StopTrimmer(stop) if stop else None
+        self.cancelled = False
+        self.tokens_iter = None
+
+
+_DONE = object()
+
+
+class BatchScheduler:
+    # Callable like a ctransformers model, from any number of threads
+
+    def __init__(self, model, window: float = 0.01, max_batch: int = 8, quantum: int = 32):
+        self.model = model
+        self.window = window
+        self.max_batch = max_batch
+        self.quantum = quantum
+        self.max_new_tokens = getattr(getattr(model, "config", None), "max_new_tokens", 512)
+        self._pending: "queue.SimpleQueue[_Request]" = queue.SimpleQueue()
+        # The request whose tokens are in the model's context
+        self._current: Optional[_Request] = None
+        self._active: List[_Request] = []
+        # What stopped the scheduler thread, if it has stopped
+        self._error: Optional[Exception] = None
+        self._thread = threading.Thread(target=self._run, name="local-llm-scheduler", daemon=True)
+        self._thread.start()
+
+    @classmethod
+    def from_env(cls, model) -> "BatchScheduler":
+        return cls(
+            model,
+            window=float(os.getenv("LOCAL_BATCH_WINDOW_MS", "10")) / 1000,
+            max_batch=int(os.getenv("LOCAL_BATCH_MAX", "8")),
+            quantum=int(os.getenv("LOCAL_BATCH_QUANTUM", "32"))
+        )
+
+    def __call__(
+        self,
+        prompt: str,
+        stream: bool = False,
+        max_new_tokens: Optional[int] = None,
+        stop: Optional[Sequence[str]] = None
+    ) -> Union[str, Iterator[str]]:
+        request = _Request(prompt, max_new_tokens or self.max_new_tokens, stop)
+        self._pending.put(request)
+        if self._error is not None:
+            raise RuntimeError("local model scheduler has stopped") from self._error
+        tokens = self._receive(request)
+        return tokens if stream else "".join(tokens)
+
+    def _receive(self, request: _Request) -> Iterator[str]:
+        try:
+            while True:
+                item = request.out.get()
+                if item is _DONE:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            # Stops generating for a caller that has gone away
+            request.cancelled = True
+
+    def _run(self):
+        try:
+            self._schedule()
+        except BaseException as e:
+            error = e if isinstance(e, Exception) else RuntimeError(f"local model scheduler stopped: {e!r}")
+            self._error = error
+            waiting = [request for request in self._active if not request.done]
+            while True:
+                try:
+                    waiting.append(self._pending.get_nowait())
+                except queue.Empty:
+                    break
+            for request in waiting:
+                request.done = True
+                request.out.put(error)
+            raise
+
+    def _schedule(self):
+        active = self._active
+        while True:
+            if not active:
+                active.append(self._pending.get())
+                deadline = time.perf_counter() + self.window
+            else:
+                deadline = 0.0
+            while len(active) < self.max_batch:
+                try:
+                    active.append(self._pending.get(timeout=max(deadline - time.perf_counter(), 0)) if deadline
+                                  else self._pending.get_nowait())
+                except queue.Empty:
+                    break
+            # Callers that have gone away, whether or not they would run now
+            for request in active:
+                if request.cancelled:
+                    self._finish(request, None)
+            active[:] = [request for request in active if not request.done]
+            if not active:
+                continue
+            LOCAL_BATCH_SIZE.observe(len(active))
+            start = time.perf_counter()
+            request = min(active, key=self._priority)
+            for other in active:
+                if other is not request:
+                    other.skipped += 1
+            generated = self._step(request)
+            elapsed = time.perf_counter() - start
+            if generated and elapsed > 0:
+                LOCAL_TOKENS_PER_SECOND.set(generated / elapsed)
+            active[:] = [request for request in active if not request.done]
+
+    def _priority(self, request: _Request):
+        remaining = request.max_new_tokens - len(request.generated) - request.skipped * self.quantum // 4
+        # On a tie, stay with the request already in the model's context
+        return remaining, request is not self._current
+
+    def _step(self, request: _Request) -> int:
+        # Generates up to a quantum of tokens for `request`; returns how many
+        if request.cancelled:
+            self._finish(request, None)
+            return 0
+        model = self.model
+        generated = 0
+        try:
+            if self._current is not request:
+                if self._current is not None and self._current.tokens_iter is not None:
+                    # Its state is about to be overwritten; it resumes from its tokens
+                    self._current.tokens_iter.close()
+                    self._current.tokens_iter = None
+                if request.started:
+                    LOCAL_TOKENS.inc("reevaluated", amount=len(request.tokens) + len(request.generated))
+                else:
+                    request.started = True
+                    LOCAL_QUEUE_WAIT.observe(time.perf_counter() - request.queued)
+                    request.tokens = model.tokenize(request.prompt)
+                request.tokens_iter = model.generate(request.tokens + request.generated)
+                self._current = request
+            while generated < self.quantum:
+                token = next(request.tokens_iter, None)
+                if token is None or model.is_eos_token(token):
+                    self._finish(request, None)
+                    break
+                request.generated.append(token)
+                generated += 1
+                piece = request.decoder.decode(model.detokenize([token], decode=False))
+                if request.stops is not None:
+                    piece = request.stops.feed(piece)
+                if piece:
+                    request.out.put(piece)
+                if (len(request.generated) >= request.max_new_tokens or request.cancelled
+                        or request.stops is not None and request.stops.stopped):
+                    self._finish(request, None)
+                    break
+        except Exception as e:
+            self._finish(request, e)
+        LOCAL_TOKENS.inc("generated", amount=generated)
+        return generated
+
+    def _finish(self, request: _Request, error: Optional[Exception]):
+        request.done = True
+        if request.tokens_iter is not None:
+            request.tokens_iter.close()
+            request.tokens_iter = None
+        if self._current is request:
+            self._current = None
+        if error is None and request.stops is not None:
+            held = request.stops.flush()
+            if held:
+                request.out.put(held)
+        request.out.put(error if error is not None else _DONE)
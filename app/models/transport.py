@@ -0,0 +1,264 @@
+import asyncio
+import json
+import os
+import random
+import threading
+import time
+from typing import AsyncIterator, Iterator, Optional, Union
+
+from app.utils.metrics import INFERENCE_API_RETRIES
+
+# HTTP transport for the Inference API's text generation, in place of
+# huggingface_hub's InferenceClient.
+#
+# AsyncInferenceClient opens a new aiohttp session, so a new TCP connection
+# and TLS handshake, for every call, and waits for a loading model with
+# time.sleep on the event loop. Here each transport keeps one pool of up to
+# HF_POOL_SIZE keep-alive connections, idle ones closed after
+# HF_KEEPALIVE_SECONDS. HF_CONNECT_TIMEOUT bounds connecting and
+# HF_READ_TIMEOUT the wait for each read. Connection errors, timeouts and
+# 429/5xx responses are retried up to HF_MAX_RETRIES times, after a
+# full-jitter exponential backoff from HF_BACKOFF_SECONDS (or Retry-After),
+# as long as the response can still start within HF_REQUEST_DEADLINE of the
+# call. A stream that has started is never retried.
+
+INFERENCE_URL = "https://api-inference.huggingface.co/models/"
+# Rate limited, model loading, or trouble between us and the model
+RETRY_STATUSES = frozenset((429, 500, 502, 503, 504))
+MAX_BACKOFF_SECONDS = 8.0
+
+
+class _Transport:
+    def __init__(
+        self,
+        token: str,
+        base_url: str = INFERENCE_URL,
+        pool_size: int = 16,
+        keepalive_seconds: float = 60.0,
+        connect_timeout: float = 5.0,
+        read_timeout: float = 60.0,
+        deadline: float = 120.0,
+        max_retries: int = 3,
+        backoff_seconds: float = 0.5
+    ):
+        self.base_url = base_url
+        self.pool_size = pool_size
+        self.keepalive_seconds = keepalive_seconds
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.deadline = deadline
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
+
+    @classmethod
+    def from_env(cls, token: str):
+        return cls(
+            token,
+            base_url=os.getenv("HF_INFERENCE_URL", INFERENCE_URL),
+            pool_size=int(os.getenv("HF_POOL_SIZE", "16")),
+            keepalive_seconds=float(os.getenv("HF_KEEPALIVE_SECONDS", "60")),
+            connect_timeout=float(os.getenv("HF_CONNECT_TIMEOUT", "5")),
+            read_timeout=float(os.getenv("HF_READ_TIMEOUT", "60")),
+            deadline=float(os.getenv("HF_REQUEST_DEADLINE", "120")),
+            max_retries=int(os.getenv("HF_MAX_RETRIES", "3")),
+            backoff_seconds=float(os.getenv("HF_BACKOFF_SECONDS", "0.5"))
+        )
+
+    def _request(self, prompt: str, model: str, stream: bool, parameters: dict):
+        # A model can also be the full URL of an Inference Endpoint
+        url = model if model.startswith(("http://", "https://")) else self.base_url + model
+        parameters = {"return_full_text": False, **parameters}
+        if "stop_sequences" in parameters:
+            # The server's name for them
+            parameters["stop"] = list(parameters.pop("stop_sequences"))
+        body = json.dumps({"inputs": prompt, "parameters": parameters, "stream": stream})
+        return url, body
+
+    def _retry_delay(self, attempt: int, deadline: float, retry_after: Optional[str]) -> Optional[float]:
+        # Seconds to wait before retrying, or None to give up
+        if attempt >= self.max_retries:
+            return None
+        try:
+            delay = float(retry_after)
+        except (TypeError, ValueError):
+            delay = random.uniform(0, min(MAX_BACKOFF_SECONDS, self.backoff_seconds * 2 ** attempt))
+        if time.monotonic() + delay >= deadline:
+            return None
+        return delay
+
+    @staticmethod
+    def _generated_text(data) -> str:
+        return (data[0] if isinstance(data, list) else data)["generated_text"]
+
+    @staticmethod
+    def _stream_token(line: bytes) -> Optional[str]:
+        # The text of one server-sent event from a text-generation stream, or
+        # None for anything else: blank lines, keep-alives, special tokens
+        if not line.startswith(b"data:"):
+            return None
+        event = json.loads(line[5:])
+        if event.get("error") is not None:
+            raise RuntimeError(f"Inference API error: {event['error']}")
+        token = event["token"]
+        return None if token.get("special") else token["text"]
+
+
+class InferenceTransport(_Transport):
+    # For the sync paths (Gradio). A requests.Session's connection pool is
+    # thread-safe, and nothing here uses its cookies.
+
+    def __init__(self, token: str, **options):
+        super().__init__(token, **options)
+        self._session = None
+        self._lock = threading.Lock()
+
+    @property
+    def session(self):
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    import requests
+                    from requests.adapters import HTTPAdapter
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.pool_size)
+                    session.mount("http://", adapter)
+                    session.mount("https://", adapter)
+                    self._session = session
+        return self._session
+
+    def text_generation(self, prompt: str, *, model: str, stream: bool = False, **parameters) -> Union[str, Iterator[str]]:
+        response = self._post(*self._request(prompt, model, stream, parameters), stream)
+        if stream:
+            return self._tokens(response)
+        return self._generated_text(response.json())
+
+    def close(self):
+        if self._session is not None:
+            self._session.close()
+
+    def _post(self, url: str, body: str, stream: bool):
+        import requests
+        deadline = time.monotonic() + self.deadline
+        attempt = 0
+        while True:
+            remaining = max(deadline - time.monotonic(), 0.001)
+            retry_after = None
+            try:
+                response = self.session.post(
+                    url,
+                    data=body,
+                    headers=self.headers,
+                    stream=stream,
+                    timeout=(min(self.connect_timeout, remaining), min(self.read_timeout, remaining))
+                )
+                if response.status_code not in RETRY_STATUSES:
+                    response.raise_for_status()
+                    return response
+                reason = str(response.status_code)
+                retry_after = response.headers.get("Retry-After")
+                response.close()
+                try:
+                    response.raise_for_status()
+                except requests.HTTPError as e:
+                    error = e
+            except requests.Timeout as e:
+                reason, error = "timeout", e
+            except requests.ConnectionError as e:
+                reason, error = "connection", e
+            delay = self._retry_delay(attempt, deadline, retry_after)
+            if delay is None:
+                raise error
+            INFERENCE_API_RETRIES.inc(reason)
+            time.sleep(delay)
+            attempt += 1
+
+    def _tokens(self, response) -> Iterator[str]:
+        with response:
+            for line in response.iter_lines():
+                token = self._stream_token(line)
+                if token is not None:
+                    yield token
+
+
+class AsyncInferenceTransport(_Transport):
+    # For the FastAPI endpoints. The aiohttp session belongs to the event
+    # loop it was made on, so another loop gets its own.
+
+    def __init__(self, token: str, **options):
+        super().__init__(token, **options)
+        self._session = None
+        self._loop = None
+
+    def session(self):
+        import aiohttp
+        loop = asyncio.get_running_loop()
+        if self._session is None or self._session.closed or self._loop is not loop:
+            connector = aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=self.keepalive_seconds)
+            self._session = aiohttp.ClientSession(connector=connector, headers=self.headers)
+            self._loop = loop
+        return self._session
+
+    async def text_generation(
+        self,
+        prompt: str,
+        *,
+        model: str,
+        stream: bool = False,
+        **parameters
+    ) -> Union[str, AsyncIterator[str]]:
+        response = await self._post(*self._request(prompt, model, stream, parameters))
+        if stream:
+            return self._tokens(response)
+        return self._generated_text(await response.json(content_type=None))
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+    async def _post(self, url: str, body: str):
+        import aiohttp
+        session = self.session()
+        deadline = time.monotonic() + self.deadline
+        attempt = 0
+        while True:
+            remaining = max(deadline - time.monotonic(), 0.001)
+            timeout = aiohttp.ClientTimeout(
+                total=None,
+                connect=min(self.connect_timeout, remaining),
+                sock_read=min(self.read_timeout, remaining)
+            )
+            retry_after = None
+            try:
+                response = await session.post(url, data=body, timeout=timeout)
+                if response.status not in RETRY_STATUSES:
+                    response.raise_for_status()
+                    return response
+                reason = str(response.status)
+                retry_after = response.headers.get("Retry-After")
+                response.release()
+                try:
+                    response.raise_for_status()
+                except aiohttp.ClientResponseError as e:
+                    error = e
+            except asyncio.TimeoutError as e:
+                reason, error = "timeout", e
+            except aiohttp.ClientConnectionError as e:
+                reason, error = "connection", e
+            delay = self._retry_delay(attempt, deadline, retry_after)
+            if delay is None:
+                raise error
+            INFERENCE_API_RETRIES.inc(reason)
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def _tokens(self, response) -> AsyncIterator[str]:
+        # Released when done or abandoned; an unfinished body closes the
+        # connection instead of returning it to the pool
+        try:
+            async for line in response.content:
+                token = self._stream_token(line)
+                if token is not None:
+                    yield token
+        finally:
+            response.release()
@@ -0,0 +1,245 @@
+import asyncio
+import json
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional, Tuple
+
+from app.utils.gazetteer import find_destination
+from app.utils.metrics import ITINERARY_CACHE
+
+# Cache of generated itineraries, keyed on what the user asked for rather
+# than on how they phrased it.
+#
+# "Goa, 3 days, budget" and "goa , 3 days, cheap" describe the same trip, so
+# preferences are reduced to a canonical key first: the gazetteer's name for
+# the destination, the duration, the budget rounded into a bucket within its
+# currency, sorted interests and a normalised travel style. Entries live in an
+# in-memory LRU with a TTL and, if a path is configured, in an SQLite file that
+# survives restarts. A disk hit is promoted back into memory. Async callers
+# use get_async/put_async, which only touch the file off the event loop. The
+# file is pruned when opened and every PRUNE_EVERY puts: expired rows go,
+# then the oldest written beyond max_rows.
+
+# Budgets fall into buckets 25% wide: [1.25^k, 1.25^(k+1))
+BUDGET_BUCKET_RATIO = 1.25
+
+# Puts between two prunes of the SQLite file, which can exceed max_rows by
+# at most this many rows in between
+PRUNE_EVERY = 100
+
+_STYLE_SYNONYMS = {
+    "cheap": "budget",
+    "backpacker": "budget",
+    "backpacking": "budget",
+    "economy": "budget",
+    "moderate": "mid-range",
+    "midrange": "mid-range",
+    "mid range": "mid-range",
+    "standard": "mid-range",
+    "luxurious": "luxury",
+    "premium": "luxury",
+    "upscale": "luxury",
+}
+
+_SPACES = re.compile(r"\s+")
+
+
+def _normalise(text: Optional[str]) -> Optional[str]:
+    if not text:
+        return None
+    return _SPACES.sub(" ", text.replace(",", " ")).strip().lower() or None
+
+
+def budget_bucket(budget: Optional[float]) -> Optional[int]:
+    if not budget or budget <= 0:
+        return None
+    return math.floor(math.log(budget, BUDGET_BUCKET_RATIO))
+
+
+def canonical_preferences(preferences: Dict[str, Any]) -> Dict[str, Any]:
+    destination = preferences.get("destination")
+    if destination:
+        destination = find_destination(destination) or destination
+    style = _normalise(preferences.get("travel_style"))
+    return {
+        "destination": _normalise(destination),
+        "duration": int(preferences["duration"]) if preferences.get("duration") else None,
+        "currency": (preferences.get("currency") or "USD").upper(),
+        "budget": budget_bucket(preferences.get("budget")),
+        "interests": sorted({i for i in map(_normalise, preferences.get("interests") or []) if i}),
+        "travel_style": _STYLE_SYNONYMS.get(style, style),
+    }
+
+
+def itinerary_key(preferences: Dict[str, Any]) -> str:
+    return json.dumps(canonical_preferences(preferences), sort_keys=True, separators=(",", ":"))
+
+
+class ItineraryCache:
+    def __init__(
+        self,
+        name: str = "itinerary",
+        max_entries: int = 256,
+        ttl: float = 24 * 3600,
+        path: Optional[str] = None,
+        max_rows: int = 10000
+    ):
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_rows = max_rows
+        # key -> (expires_at, itinerary), least recently used first
+        self._entries: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        self._puts = 0
+        if path:
+            # The SQLite file has its own lock, and on the async paths its
+            # own thread, so a slow disk never holds up memory lookups or the
+            # event loop
+            self._db_lock = threading.Lock()
+            self._disk = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"{name}-cache")
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS itineraries "
+                "(cache TEXT, key TEXT, expires_at REAL, itinerary TEXT, PRIMARY KEY (cache, key))"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS itineraries_expiry ON itineraries (cache, expires_at)")
+            self._prune()
+
+    @classmethod
+    def from_env(cls, name: str = "itinerary") -> "ItineraryCache":
+        return cls(
+            name=name,
+            max_entries=int(os.getenv("ITINERARY_CACHE_SIZE", "256")),
+            ttl=float(os.getenv("ITINERARY_CACHE_TTL", str(24 * 3600))),
+            path=os.getenv("ITINERARY_CACHE_PATH") or None,
+            max_rows=int(os.getenv("ITINERARY_CACHE_MAX_ROWS", "10000"))
+        )
+
+    def _count(self, result: str):
+        ITINERARY_CACHE.inc(self.name, result)
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        itinerary = self._get_memory(key, now)
+        if itinerary is None and self._db is not None:
+            itinerary = self._get_disk(key, now)
+        if itinerary is None:
+            self._count("miss")
+        return itinerary
+
+    async def get_async(self, key: str) -> Optional[str]:
+        # As get, with the SQLite lookup off the event loop
+        now = time.time()
+        itinerary = self._get_memory(key, now)
+        if itinerary is None and self._db is not None:
+            itinerary = await asyncio.get_running_loop().run_in_executor(self._disk, self._get_disk, key, now)
+        if itinerary is None:
+            self._count("miss")
+        return itinerary
+
+    def put(self, key: str, itinerary: str):
+        expires_at = time.time() + self.ttl
+        with self._lock:
+            self._store(key, expires_at, itinerary)
+        if self._db is not None:
+            self._put_disk(key, expires_at, itinerary)
+
+    async def put_async(self, key: str, itinerary: str):
+        # As put, with the SQLite write (and any prune) off the event loop
+        expires_at = time.time() + self.ttl
+        with self._lock:
+            self._store(key, expires_at, itinerary)
+        if self._db is not None:
+            await asyncio.get_running_loop().run_in_executor(self._disk, self._put_disk, key, expires_at, itinerary)
+
+    def _get_memory(self, key: str, now: float) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] > now:
+                self._entries.move_to_end(key)
+                self._count("hit")
+                return entry[1]
+            del self._entries[key]
+            self._count("expired")
+            return None
+
+    def _get_disk(self, key: str, now: float) -> Optional[str]:
+        with self._db_lock:
+            row = self._db.execute(
+                "SELECT expires_at, itinerary FROM itineraries WHERE cache = ? AND key = ?",
+                (self.name, key)
+            ).fetchone()
+            if row is None:
+                return None
+            if row[0] <= now:
+                self._db.execute("DELETE FROM itineraries WHERE cache = ? AND key = ?", (self.name, key))
+                self._db.commit()
+                self._count("expired")
+                return None
+        with self._lock:
+            self._store(key, row[0], row[1])
+        self._count("disk_hit")
+        return row[1]
+
+    def _put_disk(self, key: str, expires_at: float, itinerary: str):
+        with self._db_lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO itineraries VALUES (?, ?, ?, ?)",
+                (self.name, key, expires_at, itinerary)
+            )
+            self._puts += 1
+            if self._puts % PRUNE_EVERY == 0:
+                self._prune()
+            else:
+                self._db.commit()
+
+    def _prune(self):
+        # Rows whose key is never read again would otherwise stay forever.
+        # The TTL is the same for every row, so the earliest to expire are
+        # the oldest written.
+        expired = self._db.execute(
+            "DELETE FROM itineraries WHERE cache = ? AND expires_at <= ?", (self.name, time.time())
+        ).rowcount
+        evicted = self._db.execute(
+            "DELETE FROM itineraries WHERE cache = ? AND key IN "
+            "(SELECT key FROM itineraries WHERE cache = ? ORDER BY expires_at DESC LIMIT -1 OFFSET ?)",
+            (self.name, self.name, self.max_rows)
+        ).rowcount
+        self._db.commit()
+        if expired > 0:
+            ITINERARY_CACHE.inc(self.name, "expired", amount=expired)
+        if evicted > 0:
+            ITINERARY_CACHE.inc(self.name, "disk_eviction", amount=evicted)
+
+    def _store(self, key: str, expires_at: float, itinerary: str):
+        self._entries[key] = (expires_at, itinerary)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._count("eviction")
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        if self._db is not None:
+            with self._db_lock:
+                self._db.execute("DELETE FROM itineraries WHERE cache = ?", (self.name,))
+                self._db.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        stats = {
+            result: int(ITINERARY_CACHE.value(self.name, result))
+            for result in ("hit", "disk_hit", "miss", "eviction", "disk_eviction", "expired")
+        }
+        stats["entries"] = len(self._entries)
+        return stats
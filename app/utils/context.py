@@ -0,0 +1,153 @@
+import os
+from typing import Awaitable, Callable, List, Optional, Sequence, Tuple
+
+from app.utils.metrics import PROMPT_TOKENS
+from app.utils.sessions import Session, SessionStore
+from app.utils.tokens import count_tokens
+
+# Conversation context within a token budget.
+#
+# A prompt carries the most recent turns that fit CONTEXT_TOKEN_BUDGET,
+# newest first, plus a running summary of everything older. Turns that no
+# longer fit are folded into the summary by an LLM call made in the
+# background after the response has been sent, so the request path never
+# waits for it and never re-reads the whole conversation. A session counts
+# each turn's tokens once, when it is added, and the context passes the
+# counts on to prompt formatting.
+
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))
+
+Turn = Tuple[str, str]
+
+
+def turn_tokens(turn: Turn) -> int:
+    return count_tokens(turn[0]) + count_tokens(turn[1])
+
+
+def fit_turns(turns: Sequence[Turn], budget: int, tokens: Optional[Sequence[int]] = None) -> int:
+    # Index of the oldest turn that still fits when keeping the newest
+    # turns. `tokens` has their counts if known; otherwise only the turns
+    # up to the first that doesn't fit are counted.
+    used = 0
+    for i in range(len(turns) - 1, -1, -1):
+        used += tokens[i] if tokens is not None else turn_tokens(turns[i])
+        if used > budget:
+            return i + 1
+    return 0
+
+
+def _recent_tokens(turns: Sequence[Turn], budget: int) -> List[int]:
+    # Token counts of the newest turns that fit, oldest first
+    counts = []
+    used = 0
+    for turn in reversed(turns):
+        count = turn_tokens(turn)
+        used += count
+        if used > budget:
+            break
+        counts.append(count)
+    counts.reverse()
+    return counts
+
+
+def build_context(
+    turns: Sequence[Turn],
+    message: str,
+    summary: Optional[str] = None,
+    full_tokens: Optional[int] = None,
+    app: str = "api",
+    tokens: Optional[Sequence[int]] = None
+) -> List[dict]:
+    # The LLMHandler-style context for `message`: the summary, if any, then
+    # the recent turns that fit the budget, each with its token count.
+    # `tokens` has the turns' counts if already known; without them only the
+    # turns that fit (and the first that doesn't) are counted. `full_tokens`
+    # is what sending the whole conversation would have cost, recorded next
+    # to what is sent when known.
+    budget = CONTEXT_TOKEN_BUDGET - count_tokens(summary)
+    if tokens is None:
+        counts = _recent_tokens(turns, budget)
+    else:
+        counts = tokens[fit_turns(turns, budget, tokens):]
+    recent = turns[len(turns) - len(counts):]
+    PROMPT_TOKENS.observe(count_tokens(summary) + sum(counts) + count_tokens(message), app, "sent")
+    if full_tokens is not None:
+        PROMPT_TOKENS.observe(full_tokens + count_tokens(message), app, "full_history")
+    context = [{"summary": summary}] if summary else []
+    context.extend(
+        {"user": user, "assistant": assistant, "tokens": count}
+        for (user, assistant), count in zip(recent, counts)
+    )
+    return context
+
+
+def session_context(session: Session, message: str, app: str) -> List[dict]:
+    return build_context(
+        session.history, message, session.summary, session.history_tokens, app, session.turn_tokens
+    )
+
+
+def _take_overflow(store: SessionStore, session_id: str) -> Tuple[Optional[str], List[Turn]]:
+    # Marks the turns that no longer fit as being summarised, unless a
+    # summary for this session is already under way: those past the
+    # session's max_turns, then those over the token budget
+    with store.session(session_id, create=False) as session:
+        if session is None or session.summarizing:
+            return None, []
+        budget = CONTEXT_TOKEN_BUDGET - count_tokens(session.summary)
+        start = fit_turns(session.history, budget, session.turn_tokens)
+        turns = [*session.overflow, *session.history[:start]]
+        if not turns:
+            return None, []
+        session.summarizing = True
+        return session.summary, turns
+
+
+def _fold(store: SessionStore, session_id: str, turns: List[Turn], summary: Optional[str]):
+    with store.session(session_id, create=False) as session:
+        if session is None:
+            return
+        session.summarizing = False
+        if summary:
+            folded = set(map(id, turns))
+            kept = [i for i, turn in enumerate(session.history) if id(turn) not in folded]
+            session.history = [session.history[i] for i in kept]
+            session.turn_tokens = [session.turn_tokens[i] for i in kept]
+            session.overflow = [turn for turn in session.overflow if id(turn) not in folded] or ()
+            session.summary = summary.strip()
+
+
+def summarize_overflow(
+    store: SessionStore,
+    session_id: str,
+    summarize: Callable[[Optional[str], List[Turn]], str]
+):
+    # Folds the session's overflowing turns into its summary. Meant to run
+    # off the request path; a failed summary leaves the turns in place.
+    summary, turns = _take_overflow(store, session_id)
+    if not turns:
+        return
+    folded = None
+    try:
+        folded = summarize(summary, turns)
+    except Exception as e:
+        print(f"Error summarizing conversation: {str(e)}")
+    finally:
+        _fold(store, session_id, turns, folded)
+
+
+async def summarize_overflow_async(
+    store: SessionStore,
+    session_id: str,
+    summarize: Callable[[Optional[str], List[Turn]], Awaitable[str]]
+):
+    summary, turns = _take_overflow(store, session_id)
+    if not turns:
+        return
+    folded = None
+    try:
+        folded = await summarize(summary, turns)
+    except Exception as e:
+        print(f"Error summarizing conversation: {str(e)}")
+    finally:
+        _fold(store, session_id, turns, folded)
@@ -0,0 +1,170 @@
+import os
+import re
+from functools import lru_cache
+from typing import Any, Dict, List, Optional
+from app.utils.gazetteer import find_destination
+
+# Travel preference extraction shared by the chat apps.
+#
+# All patterns are compiled once at import. Patterns that start with a literal
+# ("for", "stay for", "$", ...) are searched directly, which lets the regex
+# engine skip ahead to the literal at C speed. Patterns that start with a
+# number cannot do that and would otherwise try every position of the message
+# one by one, so the message is scanned for numbers once and those patterns
+# are only tried where a number starts. Patterns are still tried in the same
+# priority order, so the first pattern that matches anywhere wins, exactly as
+# with one `re.search` per pattern.
+#
+# Users paste whole blog posts into the chat, so every `+` and `*` in the
+# patterns is capped at SCAN_WINDOW repetitions when compiled. A single match
+# attempt then looks at a bounded number of characters and extraction stays
+# linear in the message length. A window of 0 compiles the patterns unbounded.
+#
+# Destinations are looked up in the offline gazetteer rather than captured
+# from free text (see app/utils/gazetteer.py).
+
+SCAN_WINDOW = int(os.getenv("PREFERENCE_SCAN_WINDOW", "64"))
+
+DURATION_PATTERNS = [
+    # Days
+    r"for (\d+)\s*(?:days?|d)",                      # "for 2 days", "for 2d"
+    r"(\d+)\s*(?:days?|d)(?:\s|$)",                  # "2 days", "2d"
+
+    # Nights
+    r"for (\d+)\s*(?:nights?|n)",                    # "for 2 nights", "for 2n"
+    r"(\d+)\s*(?:nights?|n)(?:\s|$)",                # "2 nights", "2n"
+
+    # Weeks
+    r"for (\d+)\s*(?:weeks?|w)",                     # "for 2 weeks", "for 2w"
+    r"(\d+)\s*(?:weeks?|w)(?:\s|$)",                 # "2 weeks", "2w"
+
+    # Months
+    r"for (\d+)\s*(?:months?|mo|mnth|m)",            # "for 2 months", "for 2mo", "for 2m"
+    r"(\d+)\s*(?:months?|mo|mnth|m)(?:\s|$)",        # "2 months", "2mo", "2m"
+
+    # Generic phrasing
+    r"stay for (\d+)\s*(?:days?|nights?|weeks?|months?)",  # "stay for 2 weeks"
+    r"spend (\d+)\s*(?:days?|nights?|weeks?|months?)"      # "spend 5 days"
+]
+
+BUDGET_PATTERNS = [
+    r"\$(\d+(?:,\d{3})*(?:\.\d{2})?)",  # $1,000 or $1,000.00
+    r"₹(\d+(?:,\d{2})*(?:,\d{2})*(?:\.\d{2})?)",  # ₹1,00,000
+    r"(\d+(?:,\d{3})*(?:\.\d{2})?) dollars?",  # 1,000 dollars
+    r"(\d+(?:,\d{2})*(?:,\d{2})*(?:\.\d{2})?) rupees?",  # 1,00,000 rupees
+    r"(\d+(?:,\d{2})*(?:,\d{2})*(?:\.\d{2})?) inr",  # 1,00,000 inr
+    r"(\d+(?:,\d{2})*(?:,\d{2})*(?:\.\d{2})?) rs",  # 1,00,000 rs
+    r"(\d+(?:,\d{2})*(?:,\d{2})*(?:\.\d{2})?) lakh",  # 1 lakh
+    r"(\d+(?:,\d{2})*(?:,\d{2})*(?:\.\d{2})?) lakhs",  # 2 lakhs
+    r"(\d+(?:,\d{2})*(?:,\d{2})*(?:\.\d{2})?) crore",  # 1 crore
+    r"(\d+(?:,\d{2})*(?:,\d{2})*(?:\.\d{2})?) crores",  # 2 crores
+    r"budget of (\d+(?:,\d{3})*(?:\.\d{2})?)",  # budget of 1,000
+    r"around (\d+(?:,\d{3})*(?:\.\d{2})?)"  # around 1,000
+]
+
+INTERESTS = [
+    "culture", "food", "adventure", "relaxation", "shopping", "history", "nature",
+    "beach", "mountains", "city", "countryside", "art", "music", "sports",
+    "wildlife", "architecture", "local cuisine", "nightlife", "family",
+    "romantic", "solo", "group", "luxury", "budget", "mid-range"
+]
+
+STYLES = {
+    "luxury": ["luxury", "premium", "high-end", "5-star", "five star"],
+    "budget": ["budget", "cheap", "economy", "low-cost", "affordable"],
+    "mid-range": ["mid-range", "moderate", "standard", "comfortable"]
+}
+
+
+def _budget_rule(pattern: str):
+    # Multiplier and currency implied by the wording a budget pattern matches
+    if "lakh" in pattern:
+        multiplier = 100000
+    elif "crore" in pattern:
+        multiplier = 10000000
+    else:
+        multiplier = 1
+    currency = "INR" if "₹" in pattern or "rupees" in pattern or "inr" in pattern or "rs" in pattern or "lakh" in pattern or "crore" in pattern else "USD"
+    return multiplier, currency
+
+
+def _bounded(pattern: str, window: int) -> str:
+    if not window:
+        return pattern
+    # Repeated groups such as (?:,\d{3}) are several characters wide, so they
+    # get a quarter of the window to keep each attempt within about `window`
+    # characters
+    pattern = re.sub(r"\)\*", "){0,%d}" % max(1, window // 4), pattern)
+    pattern = re.sub(r"(?<!\\)\+", "{1,%d}" % window, pattern)
+    return re.sub(r"(?<!\\)\*", "{0,%d}" % window, pattern)
+
+
+@lru_cache(maxsize=None)
+def _compiled(window: int):
+    def compile_pattern(pattern: str):
+        # (starts with a number, compiled pattern)
+        return pattern.startswith(r"(\d"), re.compile(_bounded(pattern, window))
+
+    durations = [compile_pattern(p) for p in DURATION_PATTERNS]
+    budgets = [compile_pattern(p) + _budget_rule(p) for p in BUDGET_PATTERNS]
+    return durations, budgets
+
+
+_NUMBER = re.compile(r"\d+")
+_STYLES = list(STYLES.items())
+_compiled(SCAN_WINDOW)
+
+
+def _search(number_led: bool, pattern, text: str, numbers: List[int]):
+    if not number_led:
+        return pattern.search(text)
+    # A number-led match always starts where a run of digits starts, so the
+    # first of these positions that matches is what `re.search` would return
+    match = pattern.match
+    for pos in numbers:
+        m = match(text, pos)
+        if m:
+            return m
+    return None
+
+
+def extract_preferences(message: str, window: Optional[int] = None) -> Dict[str, Any]:
+    # Returns only the preferences the message mentions
+    durations, budgets = _compiled(SCAN_WINDOW if window is None else window)
+    text = message.lower()
+    numbers = [m.start() for m in _NUMBER.finditer(text)]
+    found: Dict[str, Any] = {}
+
+    destination = find_destination(message)
+    if destination:
+        found["destination"] = destination
+
+    for number_led, pattern in durations:
+        match = _search(number_led, pattern, text, numbers)
+        if match:
+            try:
+                found["duration"] = int(match.group(1))
+                break
+            except ValueError:
+                pass
+
+    for number_led, pattern, multiplier, currency in budgets:
+        match = _search(number_led, pattern, text, numbers)
+        if match:
+            try:
+                found["budget"] = float(match.group(1).replace(',', '')) * multiplier
+                found["currency"] = currency
+                break
+            except ValueError:
+                pass
+
+    interests = [interest for interest in INTERESTS if interest in text]
+    if interests:
+        found["interests"] = interests
+
+    for style, keywords in _STYLES:
+        if any(keyword in text for keyword in keywords):
+            found["travel_style"] = style
+            break
+
+    return found
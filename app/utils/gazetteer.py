@@ -0,0 +1,144 @@
+import os
+import re
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+# Offline place-name lookup used to recognise destinations in chat messages.
+#
+# Names and aliases from a TSV file (app/data/places.tsv by default, or
+# GAZETTEER_PATH) are loaded into a trie keyed by word. The trie is built on
+# the first lookup rather than at import, so app startup doesn't pay for it.
+# A lookup walks the words of a message once and takes the longest place name
+# starting at each word, so its cost is linear in the message length.
+
+GAZETTEER_PATH = os.getenv(
+    "GAZETTEER_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "places.tsv")
+)
+
+_WORD = re.compile(r"\w+")
+_END = ""  # trie key for "a name ends here"; never a word
+
+# A place right after one of these words is most likely the destination...
+_TOWARDS_WORDS = {"to", "visit", "visiting", "explore", "exploring", "towards"}
+# ...and less surely after these ("I am in Paris, want to go to Lyon")
+_CUE_WORDS = {"in", "about", "of", "for", "see", "around"}
+# One shortly after these is where the user is travelling from, unless a word
+# that clearly points at the destination comes in between
+_ORIGIN_WORDS = {"from", "live", "living", "based", "leaving"}
+# A name that is also a common word matches in lower case after a travel cue:
+# "visit" and the like, or "to" after one of these ("trip to nice", but not
+# "want to split the cost")
+_TRAVEL_WORDS = {
+    "trip", "travel", "travelling", "traveling", "go", "went", "fly", "flying", "head", "heading",
+    "move", "moving", "drive", "driving", "holiday", "vacation", "journey", "tour"
+}
+
+_index: Optional[Dict[str, Any]] = None
+_stats: Dict[str, Any] = {}
+_lock = threading.Lock()
+
+
+def _load(path: str) -> Dict[str, Any]:
+    root: Dict[str, Any] = {}
+    entries = nodes = 0
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip() or line.startswith("#"):
+                continue
+            fields = line.rstrip("\n").split("\t")
+            name = fields[0]
+            aliases = [a.strip() for a in fields[2].split(",")] if len(fields) > 2 and fields[2] else []
+            cased = len(fields) > 3 and "cased" in fields[3]
+            for spelling in [name] + aliases:
+                words = _WORD.findall(spelling)
+                if not words:
+                    continue
+                node = root
+                for word in words:
+                    child = node.get(word.lower())
+                    if child is None:
+                        child = node[word.lower()] = {}
+                        nodes += 1
+                    node = child
+                # Names that are also common words ("Nice") and all-caps
+                # aliases ("US") only match when written exactly like this
+                exact = words if cased or spelling.isupper() else None
+                node[_END] = (name, exact)
+            entries += 1
+    _stats.update(path=path, entries=entries, nodes=nodes)
+    return root
+
+
+def get_index() -> Dict[str, Any]:
+    global _index
+    if _index is None:
+        with _lock:
+            if _index is None:
+                start = time.perf_counter()
+                index = _load(GAZETTEER_PATH)
+                _stats["build_ms"] = (time.perf_counter() - start) * 1000
+                _index = index
+    return _index
+
+
+def gazetteer_stats() -> Dict[str, Any]:
+    # Size of the index and how long it took to build, once it has been built
+    return dict(_stats)
+
+
+def _is_origin(lower: List[str], i: int) -> bool:
+    for word in reversed(lower[max(0, i - 3):i]):
+        if word in _ORIGIN_WORDS:
+            return True
+        if word in _TOWARDS_WORDS:
+            return False
+    return False
+
+
+def _after_travel_cue(lower: List[str], i: int) -> bool:
+    if not i:
+        return False
+    cue = lower[i - 1]
+    if cue == "to":
+        return i > 1 and lower[i - 2] in _TRAVEL_WORDS
+    return cue in _TOWARDS_WORDS
+
+
+def find_destination(message: str) -> Optional[str]:
+    # Returns the canonical name of the place the message most likely wants
+    # to travel to: the first one after a cue like "to" or "visit", then the
+    # first after a weaker one like "in", otherwise the first one mentioned
+    # that isn't where the user is travelling from
+    index = get_index()
+    words = _WORD.findall(message)
+    lower = [word.lower() for word in words]
+    cued = fallback = None
+    i, n = 0, len(words)
+    while i < n:
+        node = index
+        match = None
+        travel_cue = _after_travel_cue(lower, i)
+        j = i
+        while j < n:
+            node = node.get(lower[j])
+            if node is None:
+                break
+            j += 1
+            entry = node.get(_END)
+            if entry and (entry[1] is None or entry[1] == words[i:j] or (travel_cue and words[i:j] == lower[i:j])):
+                match = (j, entry[0])
+        if match is None:
+            i += 1
+            continue
+        end, name = match
+        if not _is_origin(lower, i):
+            if i and lower[i - 1] in _TOWARDS_WORDS:
+                return name
+            if cued is None and i and lower[i - 1] in _CUE_WORDS:
+                cued = name
+            if fallback is None:
+                fallback = name
+        i = end
+    return cued or fallback
@@ -0,0 +1,389 @@
+import threading
+import weakref
+from bisect import bisect_left
+from typing import Dict, List, Sequence, Tuple
+
+# In-process metrics, rendered in the Prometheus text format.
+#
+# Recording is cheap enough for the hot path. Counters and histograms take
+# no lock: each thread adds to its own row of numbers, and rendering sums
+# the rows. Label values are looked up once with labels(), and the series
+# it returns records without building a key, so call sites on the hot path
+# bind their series up front. observe()/inc() with label values do the
+# lookup each time, for everything else.
+
+# Seconds; suits everything from a regex pass to a full itinerary
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# What Prometheus expects the text format to be served as
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class _ThreadEnd:
+    # Kept in a thread's locals; collected when the thread exits
+    __slots__ = ("__weakref__",)
+
+
+class _Rows:
+    # One row of numbers per live thread that records, summed when read.
+    # When a thread exits, its row is added into the base row and dropped,
+    # so threads started per request don't leave a row each behind.
+    __slots__ = ("width", "_local", "_rows", "_base", "_lock")
+
+    def __init__(self, width: int):
+        self.width = width
+        self._local = threading.local()
+        self._rows: Dict[int, List[float]] = {}
+        self._base = [0] * width
+        self._lock = threading.Lock()
+
+    def row(self) -> List[float]:
+        try:
+            return self._local.row
+        except AttributeError:
+            row = [0] * self.width
+            end = self._local.end = _ThreadEnd()
+            weakref.finalize(end, self._fold, row).atexit = False
+            with self._lock:
+                self._rows[id(row)] = row
+            self._local.row = row
+            return row
+
+    def _fold(self, row: List[float]):
+        with self._lock:
+            for i, value in enumerate(row):
+                self._base[i] += value
+            del self._rows[id(row)]
+
+    def totals(self) -> List[float]:
+        with self._lock:
+            totals = list(self._base)
+            for row in self._rows.values():
+                for i, value in enumerate(row):
+                    totals[i] += value
+        return totals
+
+
+class HistogramSeries:
+    __slots__ = ("buckets", "_rows")
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        # Count per bucket (+Inf last), then the sum
+        self._rows = _Rows(len(buckets) + 2)
+
+    def observe(self, value: float):
+        row = self._rows.row()
+        row[bisect_left(self.buckets, value)] += 1
+        row[-1] += value
+
+
+class CounterSeries:
+    __slots__ = ("_rows",)
+
+    def __init__(self):
+        self._rows = _Rows(1)
+
+    def inc(self, amount: float = 1):
+        self._rows.row()[0] += amount
+
+    def value(self) -> float:
+        return self._rows.totals()[0]
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._series: Dict[Tuple[str, ...], object] = {}
+
+    def labels(self, *label_values: str):
+        series = self._series.get(label_values)
+        if series is None:
+            series = self._series.setdefault(label_values, self._new_series())
+        return series
+
+    def _new_series(self):
+        raise NotImplementedError
+
+    def _label_text(self, label_values: Tuple[str, ...]) -> str:
+        return ",".join(f'{k}="{v}"' for k, v in zip(self.label_names, label_values))
+
+    def _header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def _new_series(self) -> HistogramSeries:
+        return HistogramSeries(self.buckets)
+
+    def observe(self, value: float, *label_values: str):
+        self.labels(*label_values).observe(value)
+
+    def values(self, *label_values: str) -> List[float]:
+        # Count per bucket (+Inf last), then the sum
+        series = self._series.get(label_values)
+        return series._rows.totals() if series is not None else [0] * (len(self.buckets) + 2)
+
+    def render(self) -> List[str]:
+        lines = self._header()
+        # A copy, made without giving up the GIL: labels() may add a series
+        # from another thread while this renders
+        for label_values, series in sorted(list(self._series.items())):
+            labels = self._label_text(label_values)
+            prefix = labels + "," if labels else ""
+            totals = series._rows.totals()
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), totals):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+            suffix = "{" + labels + "}" if labels else ""
+            lines.append(f"{self.name}_count{suffix} {cumulative}")
+            lines.append(f"{self.name}_sum{suffix} {totals[-1]}")
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_series(self) -> CounterSeries:
+        return CounterSeries()
+
+    def inc(self, *label_values: str, amount: float = 1):
+        self.labels(*label_values).inc(amount)
+
+    def value(self, *label_values: str) -> float:
+        series = self._series.get(label_values)
+        return series.value() if series is not None else 0
+
+    def total(self) -> float:
+        # Over all label values
+        return sum(series.value() for series in list(self._series.values()))
+
+    def render(self) -> List[str]:
+        lines = self._header()
+        for label_values, series in sorted(list(self._series.items())):
+            labels = self._label_text(label_values)
+            value = series.value()
+            lines.append(f"{self.name}{{{labels}}} {value}" if labels else f"{self.name} {value}")
+        return lines
+
+
+class Gauge(_Metric):
+    # Setting a value is a single store, so gauges need no rows
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        super().__init__(name, help, labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def set(self, value: float, *label_values: str):
+        self._values[label_values] = value
+
+    def value(self, *label_values: str) -> float:
+        return self._values.get(label_values, 0)
+
+    def render(self) -> List[str]:
+        lines = self._header()
+        for label_values, value in sorted(list(self._values.items())):
+            labels = self._label_text(label_values)
+            lines.append(f"{self.name}{{{labels}}} {value}" if labels else f"{self.name} {value}")
+        return lines
+
+
+TIME_TO_FIRST_TOKEN = Histogram(
+    "travel_assistant_time_to_first_token_seconds",
+    "Time from sending a request to the LLM until the first token arrives",
+    labels=("backend",)
+)
+
+ITINERARY_CACHE = Counter(
+    "travel_assistant_itinerary_cache_total",
+    "Itinerary cache lookups and removals by outcome",
+    labels=("cache", "result")
+)
+
+COALESCED_CALLS = Counter(
+    "travel_assistant_coalesced_calls_total",
+    "Requests that joined an identical generation already in flight instead of starting their own",
+    labels=("flight", "kind")
+)
+
+SESSION_COUNT = Gauge(
+    "travel_assistant_sessions",
+    "Conversation sessions held in memory",
+    labels=("store",)
+)
+
+SESSION_BYTES = Gauge(
+    "travel_assistant_session_bytes",
+    "Estimated memory used by conversation sessions",
+    labels=("store",)
+)
+
+SESSION_EVICTIONS = Counter(
+    "travel_assistant_session_evictions_total",
+    "Sessions dropped for being idle, or to stay under the count or memory cap",
+    labels=("store", "reason")
+)
+
+PROMPT_TOKENS = Histogram(
+    "travel_assistant_prompt_tokens",
+    "Prompt size per chat request: tokens sent, and tokens the whole conversation would have taken",
+    labels=("app", "context"),
+    buckets=(64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768)
+)
+
+LOCAL_MODEL_LOAD_SECONDS = Gauge(
+    "travel_assistant_local_model_load_seconds",
+    "Time taken to load and warm up the local model"
+)
+
+LOCAL_QUEUE_WAIT = Histogram(
+    "travel_assistant_local_queue_wait_seconds",
+    "Time a local model request waited before its first token was generated"
+)
+
+LOCAL_BATCH_SIZE = Histogram(
+    "travel_assistant_local_batch_size",
+    "Requests interleaved on the local model per scheduling round",
+    buckets=(1, 2, 4, 8, 16, 32)
+)
+
+LOCAL_TOKENS = Counter(
+    "travel_assistant_local_tokens_total",
+    "Tokens processed by the local model: generated, or evaluated again to resume a paused request",
+    labels=("kind",)
+)
+
+LOCAL_TOKENS_PER_SECOND = Gauge(
+    "travel_assistant_local_tokens_per_second",
+    "Tokens generated per second by the local model over the last scheduling round"
+)
+
+LOCAL_PROMPT_EVAL = Histogram(
+    "travel_assistant_local_prompt_eval_seconds",
+    "Time from starting a local generation to its first token, by prompt-prefix cache outcome",
+    labels=("prefix",)
+)
+
+BACKEND_REQUESTS = Counter(
+    "travel_assistant_backend_requests_total",
+    "LLM backend requests by outcome",
+    labels=("backend", "outcome")
+)
+
+BACKEND_CIRCUIT_STATE = Gauge(
+    "travel_assistant_backend_circuit_state",
+    "Circuit breaker state per LLM backend: 0 closed, 1 half-open, 2 open",
+    labels=("backend",)
+)
+
+BACKEND_LATENCY = Gauge(
+    "travel_assistant_backend_latency_seconds",
+    "Rolling latency quantiles per LLM backend, until the response starts",
+    labels=("backend", "quantile")
+)
+
+HEDGED_REQUESTS = Counter(
+    "travel_assistant_hedged_requests_total",
+    "Requests eligible for hedging, by which backend answered: not_hedged, primary, or hedge",
+    labels=("outcome",)
+)
+
+HEDGE_LATENCY_SAVED = Histogram(
+    "travel_assistant_hedge_latency_saved_seconds",
+    "Estimated time saved by requests a hedge answered, from the primary backend's recent latencies"
+)
+
+INFERENCE_API_RETRIES = Counter(
+    "travel_assistant_inference_api_retries_total",
+    "Inference API requests retried, by reason: an HTTP status, timeout, or connection",
+    labels=("reason",)
+)
+
+RATE_LIMIT_WAIT = Histogram(
+    "travel_assistant_rate_limit_wait_seconds",
+    "Time LLM requests waited for their backend's rate limit",
+    labels=("backend",)
+)
+
+STAGE_SECONDS = Histogram(
+    "travel_assistant_stage_seconds",
+    "Time per request-handling stage: prompt_build, extraction, llm, postprocess",
+    labels=("app", "stage")
+)
+
+LLM_REQUEST_SECONDS = Histogram(
+    "travel_assistant_llm_request_seconds",
+    "LLM calls per backend, from sending the request to the end of the response",
+    labels=("backend",)
+)
+
+LLM_TOKENS = Counter(
+    "travel_assistant_llm_tokens_total",
+    "Tokens sent to (in) and generated by (out) each LLM backend, counted as words and punctuation marks",
+    labels=("backend", "direction")
+)
+
+ERRORS = Counter(
+    "travel_assistant_errors_total",
+    "Requests that ended in an error, by app and handler",
+    labels=("app", "handler")
+)
+
+REGISTRY = [
+    TIME_TO_FIRST_TOKEN,
+    ITINERARY_CACHE,
+    COALESCED_CALLS,
+    SESSION_COUNT,
+    SESSION_BYTES,
+    SESSION_EVICTIONS,
+    PROMPT_TOKENS,
+    LOCAL_MODEL_LOAD_SECONDS,
+    LOCAL_QUEUE_WAIT,
+    LOCAL_BATCH_SIZE,
+    LOCAL_TOKENS,
+    LOCAL_TOKENS_PER_SECOND,
+    LOCAL_PROMPT_EVAL,
+    BACKEND_REQUESTS,
+    BACKEND_CIRCUIT_STATE,
+    BACKEND_LATENCY,
+    HEDGED_REQUESTS,
+    HEDGE_LATENCY_SAVED,
+    INFERENCE_API_RETRIES,
+    RATE_LIMIT_WAIT,
+    STAGE_SECONDS,
+    LLM_REQUEST_SECONDS,
+    LLM_TOKENS,
+    ERRORS,
+]
+
+
+def render_metrics() -> str:
+    lines: List[str] = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def mount_metrics(app, path: str = "/metrics"):
+    # Serves render_metrics() at `path` on a Starlette app: FastAPI's, or
+    # the one a launched Gradio Blocks runs on (demo.app)
+    from starlette.responses import Response
+    from starlette.routing import Route
+
+    async def metrics(request):
+        return Response(render_metrics(), headers={"Content-Type": CONTENT_TYPE})
+
+    # Ahead of any catch-all route the app has
+    app.router.routes.insert(0, Route(path, metrics, methods=["GET"]))
@@ -1,13 +1,10 @@
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional, Tuple
 
 def generate_system_prompt(preferences: Dict[str, Any]) -> str:
-    return f"""You are a knowledgeable travel assistant. Please create a detailed travel itinerary based on the following preferences:
-    
-Destination: {preferences.get('destination', 'Not specified')}
-Duration: {preferences.get('duration', 'Not specified')} days
-Budget: {'$' + str(preferences.get('budget')) if preferences.get('budget') else 'Not specified'}
-Interests: {', '.join(preferences.get('interests', [])) if preferences.get('interests') else 'Not specified'}
-Travel Style: {preferences.get('travel_style', 'Not specified')}
+    # The instructions come first and the preferences last, so every
+    # itinerary prompt starts with the same tokens and a backend can reuse
+    # their evaluation (see app/models/llama_backend.py)
+    return f"""You are a knowledgeable travel assistant. Please create a detailed travel itinerary based on the preferences below.
 
 Please provide a day-by-day itinerary with:
 1. Recommended activities and attractions
@@ -15,7 +12,30 @@ Please provide a day-by-day itinerary with:
 3. Travel tips and recommendations
 4. Local customs and cultural considerations
 5. Weather-appropriate suggestions
+
+Destination: {preferences.get('destination', 'Not specified')}
+Duration: {preferences.get('duration', 'Not specified')} days
+Budget: {'$' + str(preferences.get('budget')) if preferences.get('budget') else 'Not specified'}
+Interests: {', '.join(preferences.get('interests', [])) if preferences.get('interests') else 'Not specified'}
+Travel Style: {preferences.get('travel_style', 'Not specified')}
+"""
+
+def generate_chat_instruction(preferences: Dict[str, Any], summary: Optional[str] = None) -> str:
+    instruction = f"""You are a helpful travel assistant. Your role is to help users plan their trips, provide travel recommendations, and answer questions about destinations. Be friendly, informative, and specific in your responses.
+
+Current travel preferences:
+- Destination: {preferences['destination'] or 'Not specified'}
+- Duration: {f"{preferences['duration']} days" if preferences['duration'] else 'Not specified'}
+- Budget: {f"{preferences['currency']} {preferences['budget']}" if preferences['budget'] else 'Not specified'}
+- Interests: {', '.join(preferences['interests']) if preferences['interests'] else 'Not specified'}
+- Travel Style: {preferences['travel_style'] or 'Not specified'}
+"""
+    if summary:
+        instruction += f"""
+Summary of the conversation so far:
+{summary}
 """
+    return instruction
 
 def generate_collection_prompt() -> str:
     return """I'm a travel assistant helping you plan your perfect trip. To provide the best recommendations, I'll need some information:
@@ -26,4 +46,15 @@ def generate_collection_prompt() -> str:
 4. What are your main interests? (e.g., culture, food, adventure, relaxation)
 5. What's your preferred travel style? (e.g., luxury, budget, mid-range)
 
-Please share as much detail as you're comfortable with, and I'll help create a personalized itinerary.""" 
\ No newline at end of file
+Please share as much detail as you're comfortable with, and I'll help create a personalized itinerary."""
+
+def generate_summary_prompt(summary: Optional[str], turns: List[Tuple[str, str]]) -> str:
+    conversation = "\n".join(f"User: {user}\nAssistant: {assistant}" for user, assistant in turns)
+    return f"""Summarize this travel planning conversation in at most 150 words. Keep every destination, date, duration, budget, interest and preference the user mentioned, and any decisions made. Leave out greetings and small talk.
+
+Summary so far:
+{summary or 'None'}
+
+Conversation to add:
+{conversation}
+"""
@@ -0,0 +1,60 @@
+import asyncio
+import os
+import threading
+import time
+
+from app.utils.metrics import RATE_LIMIT_WAIT
+
+# Requests per second to one LLM backend, as a token bucket.
+#
+# The bucket holds up to `burst` requests and refills at `rate` per second.
+# A caller takes a token even when there is none left, and waits for the
+# moment it would have been there, so waiters go in the order they arrived
+# and none of them polls. A rate of 0 means no limit. The same limiter
+# serves threads (wait) and the event loop (wait_async).
+#
+# Limits come from <BACKEND>_RATE_LIMIT and <BACKEND>_RATE_BURST, e.g.
+# API_RATE_LIMIT=5 for the Inference API; they are per process.
+
+
+class RateLimiter:
+    def __init__(self, name: str, rate: float = 0.0, burst: int = 1):
+        self.name = name
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+        self._waited = RATE_LIMIT_WAIT.labels(name)
+
+    @classmethod
+    def from_env(cls, name: str) -> "RateLimiter":
+        prefix = name.upper()
+        return cls(
+            name,
+            rate=float(os.getenv(f"{prefix}_RATE_LIMIT", "0")),
+            burst=int(os.getenv(f"{prefix}_RATE_BURST", "1"))
+        )
+
+    def _reserve(self) -> float:
+        # Takes a token; returns how long to wait until it is due
+        if not self.rate:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            delay = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        self._waited.observe(delay)
+        return delay
+
+    def wait(self):
+        delay = self._reserve()
+        if delay:
+            time.sleep(delay)
+
+    async def wait_async(self):
+        delay = self._reserve()
+        if delay:
+            await asyncio.sleep(delay)
@@ -0,0 +1,209 @@
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from app.utils.metrics import SESSION_BYTES, SESSION_COUNT, SESSION_EVICTIONS
+from app.utils.tokens import count_tokens
+
+# Per-user conversation state.
+#
+# Each Gradio session (request.session_hash) or API session id gets its own
+# preferences and a bounded recent history, so concurrent planners never see
+# each other's trips. Records use __slots__ to stay small. The store evicts
+# sessions that have been idle for too long, then the least recently used
+# ones once there are too many or their estimated size exceeds the memory cap.
+
+
+class Preferences:
+    __slots__ = ("destination", "duration", "budget", "currency", "interests", "travel_style")
+
+    FIELDS = __slots__
+
+    def __init__(self, currency: Optional[str] = None):
+        self.destination: Optional[str] = None
+        self.duration: Optional[int] = None
+        self.budget: Optional[float] = None
+        self.currency = currency
+        self.interests: List[str] = []
+        self.travel_style: Optional[str] = None
+
+    # Item access, so code written against the old preference dicts keeps working
+
+    def __getitem__(self, field: str) -> Any:
+        return getattr(self, field)
+
+    def __setitem__(self, field: str, value: Any):
+        setattr(self, field, value)
+
+    def get(self, field: str, default: Any = None) -> Any:
+        return getattr(self, field, default)
+
+    def update(self, values: Dict[str, Any]):
+        for field, value in values.items():
+            setattr(self, field, value)
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {field: getattr(self, field) for field in self.FIELDS}
+
+    def nbytes(self) -> int:
+        size = sys.getsizeof(self) + sys.getsizeof(self.interests)
+        for value in (self.destination, self.currency, self.travel_style, *self.interests):
+            if value is not None:
+                size += sys.getsizeof(value)
+        return size
+
+
+class Session:
+    __slots__ = (
+        "preferences", "history", "turn_tokens", "overflow", "max_turns", "summary", "summarizing", "history_tokens", "chat",
+        "last_seen", "size"
+    )
+
+    def __init__(self, currency: Optional[str], max_turns: int):
+        self.preferences = Preferences(currency)
+        # (user, assistant) pairs not yet folded into the summary, oldest
+        # first. A plain list: a deque costs ~600 bytes even when empty.
+        self.history: List[Tuple[str, str]] = []
+        # Each history turn's tokens, counted once when it is added
+        self.turn_tokens: List[int] = []
+        # Turns pushed out of history by max_turns, oldest first, waiting to
+        # be folded into the summary with the ones over the token budget. A
+        # tuple until there are any, as an empty one costs nothing.
+        self.overflow: Sequence[Tuple[str, str]] = ()
+        self.max_turns = max_turns
+        self.summary: Optional[str] = None
+        self.summarizing = False
+        # Tokens in the whole conversation, summarised or not
+        self.history_tokens = 0
+        # The LLM backend's own conversation object, if it keeps one; its
+        # `nbytes`, the size of its copy of the conversation, counts too
+        self.chat: Any = None
+        self.last_seen = time.monotonic()
+        self.size = 0
+
+    def add_turn(self, user: str, assistant: str):
+        tokens = count_tokens(user) + count_tokens(assistant)
+        self.history.append((user, assistant))
+        self.turn_tokens.append(tokens)
+        self.history_tokens += tokens
+        if len(self.history) > self.max_turns:
+            # Bounded too, for when summaries keep failing; only then is a
+            # turn lost without being summarised
+            self.overflow = [*self.overflow, *self.history[:-self.max_turns]][-self.max_turns:]
+            del self.history[:-self.max_turns]
+            del self.turn_tokens[:-self.max_turns]
+
+    def nbytes(self) -> int:
+        size = sys.getsizeof(self) + sys.getsizeof(self.history) + sys.getsizeof(self.overflow)
+        size += sys.getsizeof(self.turn_tokens)
+        size += self.preferences.nbytes()
+        if self.summary:
+            size += sys.getsizeof(self.summary)
+        if self.chat is not None:
+            size += sys.getsizeof(self.chat) + getattr(self.chat, "nbytes", 0)
+        for user, assistant in (*self.history, *self.overflow):
+            size += sys.getsizeof(user) + sys.getsizeof(assistant)
+        return size
+
+
+class SessionStore:
+    def __init__(
+        self,
+        name: str = "sessions",
+        max_sessions: int = 10000,
+        idle_timeout: float = 3600,
+        max_bytes: int = 64 * 1024 * 1024,
+        max_turns: int = 20,
+        currency: Optional[str] = None
+    ):
+        self.name = name
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.max_bytes = max_bytes
+        self.max_turns = max_turns
+        self.currency = currency
+        # session id -> Session, least recently used first
+        self._sessions: "OrderedDict[str, Session]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, name: str = "sessions", currency: Optional[str] = None) -> "SessionStore":
+        return cls(
+            name=name,
+            max_sessions=int(os.getenv("SESSION_MAX_COUNT", "10000")),
+            idle_timeout=float(os.getenv("SESSION_IDLE_TIMEOUT", "3600")),
+            max_bytes=int(os.getenv("SESSION_MAX_BYTES", str(64 * 1024 * 1024))),
+            max_turns=int(os.getenv("SESSION_MAX_TURNS", "20")),
+            currency=currency
+        )
+
+    @contextmanager
+    def session(self, session_id: str, create: bool = True) -> Iterator[Optional[Session]]:
+        # The session for `session_id`, created if needed (or None when
+        # `create` is off). Its size is re-measured afterwards, so change it
+        # inside the with block.
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is not None:
+                self._sessions.move_to_end(session_id)
+            elif create:
+                session = self._sessions[session_id] = Session(self.currency, self.max_turns)
+            if session is not None:
+                session.last_seen = time.monotonic()
+        if session is None:
+            yield None
+            return
+        try:
+            yield session
+        finally:
+            with self._lock:
+                if self._sessions.get(session_id) is session:
+                    size = session.nbytes()
+                    self._bytes += size - session.size
+                    session.size = size
+                self._evict(keep=session_id)
+
+    def drop(self, session_id: str):
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+            if session is not None:
+                self._bytes -= session.size
+            self._publish()
+
+    def _evict(self, keep: str):
+        idle_before = time.monotonic() - self.idle_timeout
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if session_id == keep:
+                break
+            if session.last_seen < idle_before:
+                reason = "idle"
+            elif len(self._sessions) > self.max_sessions:
+                reason = "count"
+            elif self._bytes > self.max_bytes:
+                reason = "memory"
+            else:
+                break
+            del self._sessions[session_id]
+            self._bytes -= session.size
+            SESSION_EVICTIONS.inc(self.name, reason)
+        self._publish()
+
+    def _publish(self):
+        SESSION_COUNT.set(len(self._sessions), self.name)
+        SESSION_BYTES.set(self._bytes, self.name)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "sessions": len(self._sessions),
+            "bytes": self._bytes,
+            "evictions": {
+                reason: int(SESSION_EVICTIONS.value(self.name, reason))
+                for reason in ("idle", "count", "memory")
+            },
+        }
@@ -0,0 +1,194 @@
+import asyncio
+import threading
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Hashable, Iterator, List, Optional
+
+from app.utils.metrics import COALESCED_CALLS
+
+# Single-flight: concurrent requests for the same key share one upstream call.
+#
+# The first caller for a key starts the work; everyone who asks for the same
+# key while it is in flight waits for that result instead of starting their
+# own. Streams are shared the same way: the upstream stream is consumed once,
+# in the background, and every subscriber replays it from the first chunk, so
+# a late joiner still gets the whole response. A stream is cancelled once its
+# last subscriber goes away. Keys are forgotten as soon as the work finishes;
+# remembering results is the caches' job, not this one's.
+#
+# SingleFlight is for asyncio code, ThreadSingleFlight for threaded code such
+# as Gradio's synchronous handlers.
+
+
+def _forget(flights: Dict[Hashable, Any], key: Hashable, flight: Any):
+    # Drop `key` unless a newer flight has already taken its place
+    if flights.get(key) is flight:
+        del flights[key]
+
+
+class SingleFlight:
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: Dict[Hashable, asyncio.Future] = {}
+        self._streams: Dict[Hashable, "_Broadcast"] = {}
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        future = self._calls.get(key)
+        if future is None:
+            future = asyncio.ensure_future(fn())
+            self._calls[key] = future
+            future.add_done_callback(lambda f: _forget(self._calls, key, f))
+        else:
+            COALESCED_CALLS.inc(self.name, "call")
+        # One caller giving up mustn't cancel the call for everybody else
+        return await asyncio.shield(future)
+
+    async def stream(self, key: Hashable, fn: Callable[[], AsyncIterator[Any]]) -> AsyncIterator[Any]:
+        broadcast = self._streams.get(key)
+        if broadcast is None:
+            broadcast = self._streams[key] = _Broadcast()
+            broadcast.task = asyncio.ensure_future(self._pump(key, broadcast, fn))
+        else:
+            COALESCED_CALLS.inc(self.name, "stream")
+        broadcast.subscribers += 1
+        try:
+            i = 0
+            while True:
+                wake = broadcast.wake
+                while i < len(broadcast.chunks):
+                    yield broadcast.chunks[i]
+                    i += 1
+                if broadcast.done:
+                    if broadcast.error is not None:
+                        raise broadcast.error
+                    return
+                await wake.wait()
+        finally:
+            broadcast.subscribers -= 1
+            if not broadcast.subscribers and not broadcast.done:
+                _forget(self._streams, key, broadcast)
+                broadcast.task.cancel()
+
+    async def _pump(self, key: Hashable, broadcast: "_Broadcast", fn: Callable[[], AsyncIterator[Any]]):
+        try:
+            async for chunk in fn():
+                broadcast.chunks.append(chunk)
+                broadcast.notify()
+        except asyncio.CancelledError:
+            broadcast.error = ConnectionAbortedError("stream cancelled")
+        except Exception as e:
+            broadcast.error = e
+        finally:
+            broadcast.done = True
+            broadcast.notify()
+            _forget(self._streams, key, broadcast)
+
+
+class _Broadcast:
+    def __init__(self):
+        self.chunks: List[Any] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self.task: Optional[asyncio.Future] = None
+        self.wake = asyncio.Event()
+
+    def notify(self):
+        self.wake.set()
+        self.wake = asyncio.Event()
+
+
+class ThreadSingleFlight:
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, "_ThreadCall"] = {}
+        self._streams: Dict[Hashable, "_ThreadBroadcast"] = {}
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _ThreadCall()
+        if not leader:
+            COALESCED_CALLS.inc(self.name, "call")
+            call.finished.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = fn()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.finished.set()
+
+    def stream(self, key: Hashable, fn: Callable[[], Iterator[Any]]) -> Iterator[Any]:
+        with self._lock:
+            broadcast = self._streams.get(key)
+            leader = broadcast is None
+            if leader:
+                broadcast = self._streams[key] = _ThreadBroadcast()
+            broadcast.subscribers += 1
+        if leader:
+            threading.Thread(target=self._pump, args=(key, broadcast, fn), daemon=True).start()
+        else:
+            COALESCED_CALLS.inc(self.name, "stream")
+        try:
+            i = 0
+            while True:
+                with broadcast.changed:
+                    while i == len(broadcast.chunks) and not broadcast.done:
+                        broadcast.changed.wait()
+                    chunks = broadcast.chunks[i:]
+                    done = broadcast.done
+                for chunk in chunks:
+                    yield chunk
+                i += len(chunks)
+                if done and i == len(broadcast.chunks):
+                    if broadcast.error is not None:
+                        raise broadcast.error
+                    return
+        finally:
+            with self._lock:
+                broadcast.subscribers -= 1
+                if not broadcast.subscribers and not broadcast.done:
+                    broadcast.abandoned = True
+                    _forget(self._streams, key, broadcast)
+
+    def _pump(self, key: Hashable, broadcast: "_ThreadBroadcast", fn: Callable[[], Iterator[Any]]):
+        try:
+            for chunk in fn():
+                if broadcast.abandoned:
+                    break
+                with broadcast.changed:
+                    broadcast.chunks.append(chunk)
+                    broadcast.changed.notify_all()
+        except Exception as e:
+            broadcast.error = e
+        finally:
+            with self._lock:
+                _forget(self._streams, key, broadcast)
+            with broadcast.changed:
+                broadcast.done = True
+                broadcast.changed.notify_all()
+
+
+class _ThreadCall:
+    def __init__(self):
+        self.finished = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class _ThreadBroadcast:
+    def __init__(self):
+        self.chunks: List[Any] = []
+        self.done = False
+        self.abandoned = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self.changed = threading.Condition()
@@ -0,0 +1,95 @@
+from typing import AsyncIterator, Iterator, Sequence
+
+# Stop sequences for the "User: ...\nAssistant:" transcripts the models are
+# prompted with. Left to itself a model carries on past its own turn,
+# writing the user's next message and its reply to that, until it runs out
+# of tokens. Backends that take stop sequences are given these, and output
+# is trimmed at them as well: the Inference API includes the stop sequence
+# it stopped at, and a streamed reply may be cut off mid-sequence.
+
+STOP_SEQUENCES = ("\nUser:", "\nAssistant:")
+
+
+def trim_stop(text: str, stops: Sequence[str] = STOP_SEQUENCES) -> str:
+    # `text` up to the first stop sequence in it
+    ends = [i for i in (text.find(stop) for stop in stops) if i != -1]
+    return text[:min(ends)] if ends else text
+
+
+class StopTrimmer:
+    # Trims streamed text at the first stop sequence. The end of a piece
+    # that could be the start of one is held back until the next piece
+    # settles it.
+    __slots__ = ("stops", "stopped", "_held", "_longest")
+
+    def __init__(self, stops: Sequence[str] = STOP_SEQUENCES):
+        self.stops = tuple(stops)
+        self.stopped = False
+        self._held = ""
+        self._longest = max(map(len, self.stops), default=0)
+
+    def feed(self, piece: str) -> str:
+        # The text that can be passed on; sets `stopped` at a stop sequence,
+        # after which the rest of the stream should be dropped
+        if self.stopped:
+            return ""
+        text = self._held + piece
+        trimmed = trim_stop(text, self.stops)
+        if len(trimmed) < len(text):
+            self.stopped = True
+            self._held = ""
+            return trimmed
+        held = self._partial(text)
+        self._held = text[len(text) - held:] if held else ""
+        return text[:len(text) - held]
+
+    def flush(self) -> str:
+        # What was held back, once the stream has ended
+        text, self._held = self._held, ""
+        return text
+
+    def _partial(self, text: str) -> int:
+        # The length of the longest end of `text` that starts a stop sequence
+        for n in range(min(len(text), self._longest - 1), 0, -1):
+            tail = text[-n:]
+            if any(stop.startswith(tail) for stop in self.stops):
+                return n
+        return 0
+
+
+def trim_stream(pieces: Iterator[str], stops: Sequence[str] = STOP_SEQUENCES) -> Iterator[str]:
+    # Yields `pieces` up to the first stop sequence, then closes `pieces` so
+    # whatever generates them can stop
+    trimmer = StopTrimmer(stops)
+    try:
+        for piece in pieces:
+            text = trimmer.feed(piece)
+            if text:
+                yield text
+            if trimmer.stopped:
+                return
+        text = trimmer.flush()
+        if text:
+            yield text
+    finally:
+        close = getattr(pieces, "close", None)
+        if close is not None:
+            close()
+
+
+async def trim_stream_async(pieces: AsyncIterator[str], stops: Sequence[str] = STOP_SEQUENCES) -> AsyncIterator[str]:
+    trimmer = StopTrimmer(stops)
+    try:
+        async for piece in pieces:
+            text = trimmer.feed(piece)
+            if text:
+                yield text
+            if trimmer.stopped:
+                return
+        text = trimmer.flush()
+        if text:
+            yield text
+    finally:
+        aclose = getattr(pieces, "aclose", None)
+        if aclose is not None:
+            await aclose()
@@ -0,0 +1,12 @@
+import re
+from typing import Optional
+
+# Tokens are counted as words and punctuation marks. That tracks the models'
+# BPE token counts closely enough for budgeting prompts, without loading a
+# tokenizer.
+
+_TOKEN = re.compile(r"\w+|[^\w\s]")
+
+
+def count_tokens(text: Optional[str]) -> int:
+    return len(_TOKEN.findall(text)) if text else 0
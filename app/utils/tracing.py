@@ -0,0 +1,300 @@
+import contextvars
+import cProfile
+import functools
+import inspect
+import itertools
+import json
+import logging
+import logging.handlers
+import os
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Iterator, List, Optional
+
+# Per-request traces: nested spans for the stages of a request (prompt
+# build, each LLM backend call, extraction, postprocessing), to see where a
+# slow request spent its time.
+#
+# A request is sampled with probability TRACE_SAMPLE_RATE (default 0, off).
+# A sampled request's spans are appended to TRACE_DIR/<app>-<pid>.trace.json
+# in the Trace Event format, which chrome://tracing, Perfetto and speedscope
+# open: one process per file, one row per request, spans nested by time.
+# Files are rotated at TRACE_MAX_BYTES, keeping TRACE_BACKUPS old ones. With
+# TRACE_PROFILE=true sampled requests are also run under cProfile, one at a
+# time, and the stats saved as TRACE_DIR/<app>-<trace id>.prof, keeping the
+# newest TRACE_PROFILES. cProfile sees everything its thread runs, so for an
+# async request that includes other requests' steps in between its own.
+#
+# The API reports a traced request's spans in a Server-Timing header. With
+# TRACE_SERVER_TIMING=true every request is traced in memory for it, and
+# only sampled ones written out.
+#
+# Spans are recorded with the timestamps the stage metrics already take, so
+# a request that isn't traced costs one context variable lookup per stage.
+
+_current: contextvars.ContextVar[Optional["Trace"]] = contextvars.ContextVar("trace", default=None)
+
+# cProfile can only profile one thing at a time
+_profiling = threading.Lock()
+
+_numbers = itertools.count(1)
+
+
+class Trace:
+    __slots__ = ("name", "id", "number", "sampled", "profile", "profile_path", "spans", "start", "_wall")
+
+    def __init__(self, name: str, sampled: bool, profile: Optional[cProfile.Profile] = None):
+        self.name = name
+        self.id = f"{random.getrandbits(64):016x}"
+        # The row the request gets in a trace viewer
+        self.number = next(_numbers)
+        self.sampled = sampled
+        self.profile = profile
+        self.profile_path = None
+        # (name, start, end, args) with perf_counter times
+        self.spans = []
+        self._wall = time.time()
+        self.start = time.perf_counter()
+
+    def add(self, name: str, start: float, end: float, args: Optional[dict] = None):
+        self.spans.append((name, start, end, args))
+
+    @contextmanager
+    def active(self) -> Iterator["Trace"]:
+        # Makes this the current trace, and profiles, until exit
+        token = _current.set(self)
+        if self.profile is not None:
+            try:
+                self.profile.enable()
+            except ValueError:
+                # Another profiler is already running (Python 3.12+)
+                pass
+        try:
+            yield self
+        finally:
+            if self.profile is not None:
+                self.profile.disable()
+            _current.reset(token)
+
+    def server_timing(self) -> str:
+        # Milliseconds per span name so far, and in total
+        totals = {}
+        for name, start, end, _ in self.spans:
+            totals[name] = totals.get(name, 0.0) + end - start
+        totals["total"] = time.perf_counter() - self.start
+        return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in totals.items())
+
+    def events(self, category: str) -> List[dict]:
+        # Trace Event format: the request, then its spans
+        pid = os.getpid()
+        end = time.perf_counter()
+
+        def event(name, start, stop, args):
+            return {
+                "name": name,
+                "cat": category,
+                "ph": "X",
+                "ts": round((self._wall + start - self.start) * 1e6),
+                "dur": round((stop - start) * 1e6),
+                "pid": pid,
+                "tid": self.number,
+                "args": args or {}
+            }
+
+        args = {"trace_id": self.id}
+        if self.profile_path is not None:
+            args["profile"] = self.profile_path
+        events = [
+            {"name": "thread_name", "ph": "M", "pid": pid, "tid": self.number, "args": {"name": f"{self.name} {self.id}"}},
+            event(self.name, self.start, end, args)
+        ]
+        events.extend(event(*span) for span in self.spans)
+        return events
+
+
+def current_trace() -> Optional[Trace]:
+    return _current.get()
+
+
+def record_stage(series, name: str, start: float) -> float:
+    # Observes the time since `start` on a stage's histogram series and adds
+    # it to the current trace as a span; returns when the stage ended
+    end = time.perf_counter()
+    series.observe(end - start)
+    trace = _current.get()
+    if trace is not None:
+        trace.add(name, start, end)
+    return end
+
+
+class _TraceFile(logging.handlers.RotatingFileHandler):
+    # Trace Event format's JSON array form, whose closing "]" may be left
+    # out, so traces can be appended as they finish
+    terminator = ",\n"
+
+    def _open(self):
+        stream = super()._open()
+        if stream.tell() == 0:
+            stream.write("[\n")
+        return stream
+
+
+class Tracer:
+    def __init__(
+        self,
+        app: str,
+        sample_rate: float = 0.0,
+        directory: str = "traces",
+        max_bytes: int = 10 * 1024 * 1024,
+        backups: int = 5,
+        profile: bool = False,
+        profiles: int = 20,
+        server_timing: bool = False
+    ):
+        self.app = app
+        self.sample_rate = sample_rate
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.profile = profile
+        self.profiles = profiles
+        self.server_timing = server_timing
+        self._file = None
+        self._lock = threading.Lock()
+        self._saved_profiles = deque()
+
+    @classmethod
+    def from_env(cls, app: str):
+        return cls(
+            app,
+            sample_rate=float(os.getenv("TRACE_SAMPLE_RATE", "0")),
+            directory=os.getenv("TRACE_DIR", "traces"),
+            max_bytes=int(os.getenv("TRACE_MAX_BYTES", str(10 * 1024 * 1024))),
+            backups=int(os.getenv("TRACE_BACKUPS", "5")),
+            profile=os.getenv("TRACE_PROFILE", "false").lower() == "true",
+            profiles=int(os.getenv("TRACE_PROFILES", "20")),
+            server_timing=os.getenv("TRACE_SERVER_TIMING", "false").lower() == "true"
+        )
+
+    def start(self, name: str) -> Optional[Trace]:
+        # A trace for a request, or None if it isn't traced
+        sampled = self.sample_rate > 0 and random.random() < self.sample_rate
+        if not sampled and not self.server_timing:
+            return None
+        profile = None
+        if sampled and self.profile and _profiling.acquire(blocking=False):
+            profile = cProfile.Profile()
+        return Trace(name, sampled, profile)
+
+    def finish(self, trace: Trace):
+        if trace.profile is not None:
+            try:
+                self._save_profile(trace)
+            finally:
+                _profiling.release()
+        if trace.sampled:
+            self._write(trace)
+
+    def traced(self, name: str):
+        # Decorates a streaming Gradio handler, a generator or async
+        # generator function, to trace each call from its first item to its
+        # last. The trace is made current for each step separately, as Gradio
+        # may run the steps in different threads.
+        def decorate(handler):
+            if inspect.isasyncgenfunction(handler):
+                @functools.wraps(handler)
+                async def traced_handler(*args, **kwargs):
+                    trace = self.start(name)
+                    items = handler(*args, **kwargs)
+                    if trace is None:
+                        async for item in items:
+                            yield item
+                        return
+                    try:
+                        while True:
+                            with trace.active():
+                                try:
+                                    item = await items.__anext__()
+                                except StopAsyncIteration:
+                                    break
+                            yield item
+                    finally:
+                        await items.aclose()
+                        self.finish(trace)
+            elif inspect.isgeneratorfunction(handler):
+                @functools.wraps(handler)
+                def traced_handler(*args, **kwargs):
+                    trace = self.start(name)
+                    items = handler(*args, **kwargs)
+                    if trace is None:
+                        yield from items
+                        return
+                    try:
+                        while True:
+                            with trace.active():
+                                try:
+                                    item = next(items)
+                                except StopIteration:
+                                    break
+                            yield item
+                    finally:
+                        items.close()
+                        self.finish(trace)
+            else:
+                raise TypeError(f"{handler.__name__} is not a generator function")
+            return traced_handler
+        return decorate
+
+    def _save_profile(self, trace: Trace):
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"{self.app}-{trace.id}.prof")
+        trace.profile.dump_stats(path)
+        trace.profile_path = path
+        self._saved_profiles.append(path)
+        while len(self._saved_profiles) > self.profiles:
+            try:
+                os.remove(self._saved_profiles.popleft())
+            except OSError:
+                pass
+
+    def _write(self, trace: Trace):
+        if self._file is None:
+            with self._lock:
+                if self._file is None:
+                    os.makedirs(self.directory, exist_ok=True)
+                    # One file per process, since rotation isn't safe across processes
+                    path = os.path.join(self.directory, f"{self.app}-{os.getpid()}.trace.json")
+                    self._file = _TraceFile(path, maxBytes=self.max_bytes, backupCount=self.backups, delay=True)
+        lines = ",\n".join(json.dumps(event, separators=(",", ":")) for event in trace.events(self.app))
+        # The handler serializes writes and rotation, and reports rather
+        # than raises errors
+        self._file.handle(logging.makeLogRecord({"msg": lines}))
+
+
+class TracingMiddleware:
+    # ASGI middleware that traces HTTP requests and sends a traced request's
+    # spans so far in a Server-Timing header
+    def __init__(self, app, tracer: Tracer):
+        self.app = app
+        self.tracer = tracer
+
+    async def __call__(self, scope, receive, send):
+        trace = self.tracer.start(f"{scope['method']} {scope['path']}") if scope["type"] == "http" else None
+        if trace is None:
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                headers = [*message.get("headers", ()), (b"server-timing", trace.server_timing().encode("latin-1"))]
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            with trace.active():
+                await self.app(scope, receive, send_with_timing)
+        finally:
+            self.tracer.finish(trace)
@@ -0,0 +1,71 @@
+"""/chat throughput against a stubbed 50 ms backend, by number of concurrent clients.
+
+"before" calls the blocking LLMHandler.generate_response from the endpoint, as
+chat_endpoint used to; "after" is the current endpoint. Fails if the current
+endpoint doesn't scale with concurrency.
+
+    python -m benchmarks.bench_async_concurrency
+"""
+import asyncio
+import os
+import sys
+import time
+
+os.environ.setdefault("HF_API_TOKEN", "benchmark")
+
+from app import main as api  # noqa: E402
+
+LATENCY = 0.05
+REQUESTS_PER_CLIENT = 2
+
+
+class StubInferenceClient:
+    def text_generation(self, prompt, **kwargs):
+        time.sleep(LATENCY)
+        return "stub response"
+
+
+class StubAsyncInferenceClient:
+    async def text_generation(self, prompt, **kwargs):
+        await asyncio.sleep(LATENCY)
+        return "stub response"
+
+
+async def blocking_chat_endpoint(user_input):
+    return {"response": api.llm_handler.generate_response(user_input.message, user_input.context)}
+
+
+async def throughput(endpoint, clients):
+    async def client(n):
+        # Distinct messages, so identical requests aren't coalesced into one call
+        for i in range(REQUESTS_PER_CLIENT):
+            await endpoint(api.UserInput(message=f"Plan a trip to Goa for {n * REQUESTS_PER_CLIENT + i} days"))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client(n) for n in range(clients)))
+    return clients * REQUESTS_PER_CLIENT / (time.perf_counter() - start)
+
+
+async def run():
+    api.llm_handler.api_model = StubInferenceClient()
+    api.llm_handler.async_api_model = StubAsyncInferenceClient()
+    print(f"{'clients':>8} {'before req/s':>14} {'after req/s':>13}")
+    results = {}
+    for clients in (1, 10, 50, 200):
+        # The blocking endpoint serializes everything; past 50 clients it only takes longer
+        before = await throughput(blocking_chat_endpoint, clients) if clients <= 50 else None
+        after = results[clients] = await throughput(api.chat_endpoint, clients)
+        print(f"{clients:>8} {before or float('nan'):>14.1f} {after:>13.1f}")
+    return results[200] / results[1]
+
+
+def main():
+    scaling = asyncio.run(run())
+    print(f"throughput from 1 to 200 clients: x{scaling:.0f}")
+    if scaling < 50:
+        print("endpoint does not scale with concurrent clients")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
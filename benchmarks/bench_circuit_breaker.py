@@ -0,0 +1,85 @@
+"""/chat latency through an Inference API outage, with and without the circuit breaker.
+
+A stubbed API fails every request after a --timeout-ms wait, as a hung
+upstream does, for the whole run; the stubbed local model answers in 50 ms.
+"no breaker" never opens the circuit, which is how LLMHandler used to fall
+back: every request waits out the API first. Reports latency percentiles and
+how many requests still went to the API. Fails if the breaker doesn't cut
+p50 latency during the outage.
+
+    python -m benchmarks.bench_circuit_breaker
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+os.environ.setdefault("HF_API_TOKEN", "benchmark")
+os.environ.setdefault("LOCAL_MODEL_PATH", "/nonexistent")
+
+from app.models.llm import LLMHandler  # noqa: E402
+from app.models.router import Router  # noqa: E402
+
+LOCAL_LATENCY = 0.05
+
+
+class FailingAPI:
+    def __init__(self, timeout):
+        self.timeout = timeout
+        self.calls = 0
+
+    async def text_generation(self, prompt, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(self.timeout)
+        raise TimeoutError("Inference API timed out")
+
+
+def local_model(prompt, stream=False, stop=None):
+    time.sleep(LOCAL_LATENCY)
+    return iter(["local response"]) if stream else "local response"
+
+
+async def run(handler, requests, concurrency):
+    latencies = []
+    slots = asyncio.Semaphore(concurrency)
+
+    async def one(i):
+        async with slots:
+            start = time.perf_counter()
+            await handler.generate_response_async(f"Plan day {i} in Goa", [])
+            latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    return sorted(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--timeout-ms", type=float, default=500)
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=4)
+    args = parser.parse_args()
+
+    print(f"{'':>11} {'p50 ms':>8} {'p99 ms':>8} {'API calls':>10}")
+    results = {}
+    for name, threshold in (("no breaker", 10 ** 9), ("breaker", 5)):
+        handler = LLMHandler()
+        handler.wait_for_local_model()
+        handler.local_model = local_model
+        handler._router = Router(("api", "local"), failure_threshold=threshold, open_seconds=30)
+        api = handler.async_api_model = FailingAPI(args.timeout_ms / 1000)
+        latencies = asyncio.run(run(handler, args.requests, args.concurrency))
+        p50 = statistics.median(latencies)
+        p99 = latencies[min(int(len(latencies) * 0.99), len(latencies) - 1)]
+        results[name] = p50
+        print(f"{name:>11} {p50 * 1000:>8.0f} {p99 * 1000:>8.0f} {api.calls:>10}")
+
+    if results["breaker"] >= results["no breaker"]:
+        print("the circuit breaker doesn't cut latency during an outage")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
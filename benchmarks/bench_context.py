@@ -0,0 +1,86 @@
+"""Prompt tokens per turn over a long conversation: whole history vs token budget.
+
+Plays a 60-turn conversation through a session. Each turn's prompt is built
+once from the whole history, as the apps used to, and once with the budgeted
+context builder and a stub summarizer. Reports prompt tokens and the time spent
+building prompts, and fails if the budgeted prompt ever goes over budget.
+
+    python -m benchmarks.bench_context
+"""
+import sys
+import time
+
+from app.utils import context as ctx
+from app.utils.sessions import SessionStore
+from app.utils.tokens import count_tokens
+from benchmarks.corpus import SHORT_MESSAGES
+
+TURNS = 60
+REPLY = "Here are a few ideas for your trip, with costs and travel times for each day. " * 6
+
+
+def full_prompt(history, message):
+    prompt = "".join(f"User: {user}\nAssistant: {assistant}\n" for user, assistant in history)
+    return prompt + f"User: {message}\nAssistant:"
+
+
+def budgeted_prompt(context, message):
+    prompt = "".join(
+        f"Summary: {turn['summary']}\n" if "summary" in turn else f"User: {turn['user']}\nAssistant: {turn['assistant']}\n"
+        for turn in context
+    )
+    return prompt + f"User: {message}\nAssistant:"
+
+
+def stub_summarize(summary, turns):
+    # Stands in for the LLM: a summary of a fixed, realistic size
+    return "The user is planning a trip; destination, dates, budget and interests so far. " * 4
+
+
+def main():
+    store = SessionStore(max_turns=1000)
+    history = []
+    full_total = budgeted_total = 0
+    full_seconds = budgeted_seconds = 0.0
+    over_budget = 0
+    print(f"{'turn':>5} {'full history':>13} {'budgeted':>9}")
+    for turn in range(1, TURNS + 1):
+        message = SHORT_MESSAGES[turn % len(SHORT_MESSAGES)]
+
+        start = time.perf_counter()
+        prompt = full_prompt(history, message)
+        full_seconds += time.perf_counter() - start
+        full = count_tokens(prompt)
+
+        start = time.perf_counter()
+        with store.session("bench") as session:
+            context = ctx.session_context(session, message, "bench")
+        prompt = budgeted_prompt(context, message)
+        budgeted_seconds += time.perf_counter() - start
+        budgeted = count_tokens(prompt)
+
+        full_total += full
+        budgeted_total += budgeted
+        if budgeted > ctx.CONTEXT_TOKEN_BUDGET + count_tokens(message) + 4 * len(context):
+            over_budget += 1
+        if turn % 10 == 0:
+            print(f"{turn:>5} {full:>13,} {budgeted:>9,}")
+
+        history.append((message, REPLY))
+        with store.session("bench") as session:
+            session.add_turn(message, REPLY)
+        # Off the request path in the apps
+        ctx.summarize_overflow(store, "bench", stub_summarize)
+
+    print(
+        f"conversation total: {full_total:,} tokens with the whole history, "
+        f"{budgeted_total:,} budgeted (budget {ctx.CONTEXT_TOKEN_BUDGET:,} per prompt)"
+    )
+    print(f"prompt build time: {full_seconds * 1000:.1f} ms whole history, {budgeted_seconds * 1000:.1f} ms budgeted")
+    if over_budget:
+        print(f"{over_budget} prompts went over the token budget")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
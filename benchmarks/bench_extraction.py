@@ -0,0 +1,115 @@
+"""Messages/sec of preference extraction, before and after.
+
+"Before" is the original update_preferences loop: one re.search per pattern
+and free-text destination capture. Everything except the destination, which
+now comes from the gazetteer, must match.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_extraction
+"""
+import re
+import time
+
+from app.utils.extraction import (
+    BUDGET_PATTERNS,
+    DURATION_PATTERNS,
+    INTERESTS,
+    STYLES,
+    extract_preferences,
+)
+from app.utils.gazetteer import get_index
+from benchmarks.corpus import LONG_MESSAGES, SHORT_MESSAGES
+
+DESTINATION_PATTERNS = [
+    r"trip (?:to|of|in) ([a-zA-Z\s]+)(?:\s|$)",
+    r"visit ([a-zA-Z\s]+)(?:\s|$)",
+    r"going to ([a-zA-Z\s]+)(?:\s|$)",
+    r"travel to ([a-zA-Z\s]+)(?:\s|$)",
+    r"plan a trip (?:to|of|in) ([a-zA-Z\s]+)(?:\s|$)",
+    r"want to go (?:to )?([a-zA-Z\s]+)(?:\s|$)",
+    r"interested in ([a-zA-Z\s]+)(?:\s|$)",
+    r"like ([a-zA-Z\s]+)(?:\s|$)",
+    r"love ([a-zA-Z\s]+)(?:\s|$)",
+    r"go ([a-zA-Z\s]+)(?:\s|$)",
+    r"trip for ([a-zA-Z\s]+)(?:\s|$)",
+    r"prefer ([a-zA-Z\s]+)(?:\s|$)",
+    r"looking for ([a-zA-Z\s]+)(?:\s|$)",
+    r"dream(?:ing)? (?:about|of)? ([a-zA-Z\s]+)(?:\s|$)",
+]
+
+
+def legacy_extract_preferences(message):
+    # The original update_preferences loop: one re.search per pattern
+    found = {}
+    message = message.lower()
+    for pattern in DESTINATION_PATTERNS:
+        match = re.search(pattern, message)
+        if match:
+            destination = match.group(1).strip()
+            if destination:
+                found["destination"] = destination
+                break
+    for pattern in DURATION_PATTERNS:
+        match = re.search(pattern, message)
+        if match:
+            try:
+                found["duration"] = int(match.group(1))
+                break
+            except ValueError:
+                pass
+    for pattern in BUDGET_PATTERNS:
+        match = re.search(pattern, message)
+        if match:
+            try:
+                amount = match.group(1).replace(',', '')
+                if "lakh" in pattern:
+                    amount = float(amount) * 100000
+                elif "crore" in pattern:
+                    amount = float(amount) * 10000000
+                else:
+                    amount = float(amount)
+                found["budget"] = amount
+                found["currency"] = "INR" if "₹" in pattern or "rupees" in pattern or "inr" in pattern or "rs" in pattern or "lakh" in pattern or "crore" in pattern else "USD"
+                break
+            except ValueError:
+                pass
+    found_interests = [interest for interest in INTERESTS if interest in message]
+    if found_interests:
+        found["interests"] = found_interests
+    for style, keywords in STYLES.items():
+        if any(keyword in message for keyword in keywords):
+            found["travel_style"] = style
+            break
+    return found
+
+
+def messages_per_second(extract, messages, min_time=1.0):
+    count = 0
+    start = time.perf_counter()
+    while True:
+        for message in messages:
+            extract(message)
+        count += len(messages)
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            return count / elapsed
+
+
+def without_destination(preferences):
+    return {k: v for k, v in preferences.items() if k != "destination"}
+
+
+def main():
+    get_index()
+    for name, messages in (("short", SHORT_MESSAGES), ("long", LONG_MESSAGES)):
+        for message in messages:
+            after = without_destination(extract_preferences(message))
+            assert after == without_destination(legacy_extract_preferences(message)), message
+        before = messages_per_second(legacy_extract_preferences, messages)
+        after = messages_per_second(extract_preferences, messages)
+        print(f"{name:>5}: before {before:>10,.0f} msg/s   after {after:>10,.0f} msg/s   x{after / before:.2f}")
+
+
+if __name__ == "__main__":
+    main()
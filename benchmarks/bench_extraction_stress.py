@@ -0,0 +1,59 @@
+"""Worst-case preference extraction time on 10 KB - 1 MB messages.
+
+Fails if the time per byte at the largest size is more than MAX_GROWTH times
+the time per byte at the smallest, i.e. if extraction stops being linear.
+
+    python -m benchmarks.bench_extraction_stress
+"""
+import sys
+import time
+
+from app.utils.extraction import extract_preferences
+from benchmarks.corpus import BLOG_POST
+
+SIZES = [10_000, 100_000, 1_000_000]
+MAX_GROWTH = 3.0
+
+
+def repeat_to(chunk, size, prefix="", suffix=""):
+    return prefix + chunk * ((size - len(prefix) - len(suffix)) // len(chunk)) + suffix
+
+
+# Inputs that make unbounded patterns capture or rescan the rest of the message
+INPUTS = {
+    "blog post": lambda size: repeat_to(BLOG_POST, size),
+    "long capture": lambda size: repeat_to("abc ", size, prefix="i'd like ", suffix="!"),
+    "unterminated words": lambda size: repeat_to("visit " + "a" * 50 + "1", size),
+    "repeated triggers": lambda size: repeat_to("dreaming of go like ", size, suffix="1"),
+    "digit runs": lambda size: repeat_to("1", size, suffix=" x"),
+    "comma groups": lambda size: repeat_to("100,", size, suffix="0"),
+    "numbers and spaces": lambda size: repeat_to("12     ", size),
+}
+
+
+def worst_time(message, rounds=3):
+    best = float("inf")
+    for _ in range(rounds):
+        start = time.perf_counter()
+        extract_preferences(message)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    failed = False
+    print(f"{'input':<20}" + "".join(f"{size // 1000:>10} KB" for size in SIZES) + "    growth")
+    for name, make in INPUTS.items():
+        times = [worst_time(make(size)) for size in SIZES]
+        per_byte = [t / size for t, size in zip(times, SIZES)]
+        growth = per_byte[-1] / per_byte[0]
+        failed |= growth > MAX_GROWTH
+        row = "".join(f"{t * 1000:>10.2f} ms" for t in times)
+        print(f"{name:<20}{row}    x{growth:.2f}{'  FAIL' if growth > MAX_GROWTH else ''}")
+    if failed:
+        print(f"extraction time grew more than x{MAX_GROWTH} per byte")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""Gazetteer build cost, index memory and per-message lookup cost.
+
+Then checks a few messages' destinations, and fails if any comes out wrong.
+
+    python -m benchmarks.bench_gazetteer
+"""
+import sys
+import time
+import tracemalloc
+
+from app.utils import gazetteer
+from benchmarks.corpus import LONG_MESSAGES, SHORT_MESSAGES
+
+# (message, destination) the lookup must get right
+EXPECTED = [
+    ("plan a trip to china for 10 days", "China"),
+    ("i want to visit turkey", "Turkey"),
+    ("going to jordan", "Jordan"),
+    ("go to florence", "Florence"),
+    # Names that are also common words: exact case, or lower case after a travel cue
+    ("a trip to nice in june", "Nice"),
+    ("Nice or Lyon, whichever is cheaper", "Nice"),
+    ("we want to split the cost of a nice hotel", None),
+    # A "to" cue outranks an earlier "in"
+    ("I am in Paris now, want to go to Lyon?", "Lyon"),
+]
+
+
+def rss_kb():
+    # Resident set size from /proc (Linux)
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+    return 0
+
+
+def lookup_us(messages, min_time=1.0):
+    count = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < min_time:
+        for message in messages:
+            gazetteer.find_destination(message)
+        count += len(messages)
+    return (time.perf_counter() - start) / count * 1e6
+
+
+def main():
+    rss_before = rss_kb()
+    tracemalloc.start()
+    gazetteer.get_index()
+    index_bytes, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    rss_after = rss_kb()
+
+    stats = gazetteer.gazetteer_stats()
+    print(f"index: {stats['entries']} places, {stats['nodes']} trie nodes, built in {stats['build_ms']:.1f} ms")
+    print(f"index memory: {index_bytes / 1024:.0f} KB allocated, RSS +{rss_after - rss_before} KB")
+    for name, messages in (("short", SHORT_MESSAGES), ("long", LONG_MESSAGES)):
+        size = sum(map(len, messages)) / len(messages)
+        print(f"{name:>5} lookup: {lookup_us(messages):8.1f} us/message (avg {size:,.0f} chars)")
+
+    # After the index has been measured, as the first lookup builds it
+    wrong = [(message, expected) for message, expected in EXPECTED if gazetteer.find_destination(message) != expected]
+    for message, expected in wrong:
+        print(f"{message!r}: expected {expected}, got {gazetteer.find_destination(message)}")
+    if wrong:
+        print(f"{len(wrong)} of {len(EXPECTED)} destinations wrong")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""Gemini request size (and, live, latency) per turn: transcript prompt vs ChatSession.
+
+"transcript" is how travel_assistant used to call Gemini: a fresh chat per
+message whose single user message holds the instructions, the preferences
+and the whole conversation. "chat" is the per-session ChatSession with a
+system instruction, trimmed to the context budget and summarised as the app
+does now. Request bytes are the JSON body each approach sends to
+generateContent. Gemini's API is stateless, so a ChatSession re-sends its
+history too; what keeps the request small is the budget.
+
+    python -m benchmarks.bench_gemini_chat            # request bytes only, offline
+    python -m benchmarks.bench_gemini_chat --live     # also latency; needs GOOGLE_API_KEY and google-generativeai
+"""
+import argparse
+import json
+import os
+import time
+
+from app.utils import context as ctx
+from app.utils.prompts import generate_chat_instruction
+from app.utils.sessions import SessionStore
+from benchmarks.corpus import SHORT_MESSAGES
+
+MODEL_NAME = "gemini-2.0-flash-lite"
+REPLY = "Here are a few ideas for your trip, with costs and travel times for each day. " * 8
+SUMMARY = "The user is planning a trip; destination, dates, budget and interests so far. " * 4
+
+
+def transcript_request(preferences, history, message):
+    prompt = generate_chat_instruction(preferences) + "\nPrevious conversation:\n"
+    for user, assistant in history:
+        prompt += f"User: {user}\nAssistant: {assistant}\n"
+    prompt += f"User: {message}\nAssistant:"
+    return {"contents": [{"role": "user", "parts": [{"text": prompt}]}]}
+
+
+def chat_request(session, message):
+    context = ctx.session_context(session, message, "bench")
+    summary = context[0]["summary"] if context and "summary" in context[0] else None
+    contents = []
+    for turn in context:
+        if "summary" not in turn:
+            contents.append({"role": "user", "parts": [{"text": turn["user"]}]})
+            contents.append({"role": "model", "parts": [{"text": turn["assistant"]}]})
+    contents.append({"role": "user", "parts": [{"text": message}]})
+    instruction = generate_chat_instruction(session.preferences, summary)
+    return {"systemInstruction": {"parts": [{"text": instruction}]}, "contents": contents}
+
+
+def size(request):
+    return len(json.dumps(request).encode())
+
+
+def request_bytes(turns):
+    store = SessionStore(max_turns=1000)
+    history = []
+    rows = []
+    for turn in range(1, turns + 1):
+        message = SHORT_MESSAGES[turn % len(SHORT_MESSAGES)]
+        with store.session("bench") as session:
+            transcript = size(transcript_request(session.preferences, history, message))
+            chat = size(chat_request(session, message))
+            session.add_turn(message, REPLY)
+        history.append((message, REPLY))
+        ctx.summarize_overflow(store, "bench", lambda summary, old: SUMMARY)
+        rows.append((turn, transcript, chat))
+    return rows
+
+
+def live_latency(turns):
+    import google.generativeai as genai
+
+    genai.configure(api_key=os.environ["GOOGLE_API_KEY"])
+    preferences = {"destination": "Goa", "duration": 3, "budget": 20000, "currency": "INR",
+                   "interests": ["food", "beach"], "travel_style": "budget"}
+    model = genai.GenerativeModel(model_name=MODEL_NAME)
+    chat_model = genai.GenerativeModel(model_name=MODEL_NAME, system_instruction=generate_chat_instruction(preferences))
+    chat = chat_model.start_chat(history=[])
+    config = genai.types.GenerationConfig(max_output_tokens=256, candidate_count=1)
+    history = []
+    rows = []
+    for turn in range(1, turns + 1):
+        message = SHORT_MESSAGES[turn % len(SHORT_MESSAGES)]
+        prompt = transcript_request(preferences, history, message)["contents"][0]["parts"][0]["text"]
+        start = time.perf_counter()
+        reply = model.start_chat(history=[]).send_message(prompt, generation_config=config).text
+        transcript = time.perf_counter() - start
+        start = time.perf_counter()
+        chat.send_message(message, generation_config=config)
+        chatted = time.perf_counter() - start
+        history.append((message, reply))
+        rows.append((turn, transcript, chatted))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--turns", type=int, default=40)
+    parser.add_argument("--live", action="store_true", help="also time real Gemini calls")
+    args = parser.parse_args()
+
+    rows = request_bytes(args.turns)
+    print(f"{'turn':>5} {'transcript B':>13} {'chat B':>9}")
+    for turn, transcript, chat in rows:
+        if turn % 5 == 0:
+            print(f"{turn:>5} {transcript:>13,} {chat:>9,}")
+    print(
+        f"total over {args.turns} turns: {sum(r[1] for r in rows):,} B transcript, "
+        f"{sum(r[2] for r in rows):,} B chat"
+    )
+
+    if args.live:
+        rows = live_latency(min(args.turns, 12))
+        print(f"{'turn':>5} {'transcript s':>13} {'chat s':>9}")
+        for turn, transcript, chat in rows:
+            print(f"{turn:>5} {transcript:>13.2f} {chat:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
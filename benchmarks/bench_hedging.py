@@ -0,0 +1,117 @@
+"""/chat latency with a slow-tailed API, with and without hedged requests.
+
+A stubbed API answers in about --api-ms, but one request in --slow-every
+takes --slow-ms, as a busy upstream does now and then; the stubbed local
+model answers in --local-ms. Both modes warm the backends' latency windows
+unhedged first. "hedged" turns on HEDGE_REQUESTS, so a request the API
+hasn't answered by its p95 also goes to the local model. Reports latency percentiles, the
+hedge rate and the estimated time saved per request a hedge answered.
+Fails if hedging doesn't cut p99.
+
+    python -m benchmarks.bench_hedging
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import time
+
+os.environ.setdefault("HF_API_TOKEN", "benchmark")
+os.environ.setdefault("LOCAL_MODEL_PATH", "/nonexistent")
+
+from app.models.llm import LLMHandler  # noqa: E402
+from app.models.router import Router  # noqa: E402
+from app.utils.metrics import HEDGE_LATENCY_SAVED, HEDGED_REQUESTS  # noqa: E402
+
+
+class SlowTailAPI:
+    def __init__(self, latency, slow, slow_every, seed=0):
+        self.latency = latency
+        self.slow = slow
+        self.slow_every = slow_every
+        self.random = random.Random(seed)
+        self.cancelled = 0
+
+    async def text_generation(self, prompt, **kwargs):
+        slow = self.random.randrange(self.slow_every) == 0
+        try:
+            await asyncio.sleep(self.slow if slow else self.latency * self.random.uniform(0.8, 1.2))
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        return "api response"
+
+
+class LocalModel:
+    def __init__(self, latency):
+        self.latency = latency
+
+    def __call__(self, prompt, stream=False, stop=None):
+        time.sleep(self.latency)
+        return iter(["local response"]) if stream else "local response"
+
+
+async def run(handler, requests, concurrency, prefix):
+    latencies = []
+    slots = asyncio.Semaphore(concurrency)
+
+    async def one(i):
+        async with slots:
+            start = time.perf_counter()
+            await handler.generate_response_async(f"{prefix}: plan day {i} in Goa", [])
+            latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    return sorted(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--api-ms", type=float, default=50)
+    parser.add_argument("--slow-ms", type=float, default=1500)
+    parser.add_argument("--slow-every", type=int, default=50)
+    parser.add_argument("--local-ms", type=float, default=120)
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--warm-up", type=int, default=100, help="requests before measuring")
+    args = parser.parse_args()
+
+    print(f"{'':>8} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8} {'hedged':>8} {'saved ms':>9}")
+    results = {}
+    for name, hedging in (("off", "false"), ("hedged", "true")):
+        os.environ["HEDGE_REQUESTS"] = hedging
+        handler = LLMHandler()
+        handler.wait_for_local_model()
+        handler.local_model = LocalModel(args.local_ms / 1000)
+        handler._router = Router(("api", "local", "api_secondary"))
+        handler.async_api_model = SlowTailAPI(args.api_ms / 1000, args.slow_ms / 1000, args.slow_every)
+        # Warmed up unhedged, so the API's latency window has its slow tail
+        percentile, handler._hedge_percentile = handler._hedge_percentile, None
+        asyncio.run(run(handler, args.warm_up, args.concurrency, "warm-up"))
+        handler._hedge_percentile = percentile
+        before = {outcome: HEDGED_REQUESTS.value(outcome) for outcome in ("not_hedged", "primary", "hedge")}
+        saved = HEDGE_LATENCY_SAVED.values()[-1]
+        hedge_wins = HEDGED_REQUESTS.value("hedge")
+
+        latencies = asyncio.run(run(handler, args.requests, args.concurrency, name))
+        p50 = statistics.median(latencies)
+        p99 = latencies[min(int(len(latencies) * 0.99), len(latencies) - 1)]
+        results[name] = p99
+        hedged = sum(HEDGED_REQUESTS.value(outcome) - before[outcome] for outcome in ("primary", "hedge"))
+        saved = HEDGE_LATENCY_SAVED.values()[-1] - saved
+        hedge_wins = HEDGED_REQUESTS.value("hedge") - hedge_wins
+        print(
+            f"{name:>8} {p50 * 1000:>8.0f} {p99 * 1000:>8.0f} {latencies[-1] * 1000:>8.0f} "
+            f"{hedged / len(latencies):>8.1%} {saved / max(hedge_wins, 1) * 1000:>9.0f}"
+        )
+        handler._local_executor.shutdown()
+
+    if results["hedged"] >= results["off"]:
+        print("hedging doesn't cut p99 latency")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,254 @@
+"""Microbenchmarks of the CPU-bound hot paths, gated against stored baselines.
+
+Times preference extraction (update_preferences in both apps), the
+preferences panel (update_preferences_display), prompt building
+(LLMHandler._format_prompt, generate_system_prompt) and turning history
+into context (session_context, as the Gradio app's process_message does,
+and the API's _build_chat_context), over the messages in
+benchmarks/corpus.py and histories of 1-200 turns.
+
+Each case is timed in rounds of enough calls to take --min-seconds; the
+fastest of --rounds rounds gives its time per call. Times are also divided
+by a fixed pure-Python workload, timed in rounds alternating with the
+case's, so a baseline saved on one machine (or on a busy one) still means
+something on another. Fails if any case is more than --threshold slower, in
+those units, than in the baseline file, on a second measurement as well as
+the first. --save writes the baseline instead. Cases whose app can't be
+imported (no gradio, or no fastapi for the API) are reported and skipped.
+
+    python -m benchmarks.bench_hot_paths
+    python -m benchmarks.bench_hot_paths --filter context --threshold 0.1
+    python -m benchmarks.bench_hot_paths --save
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import sys
+import time
+
+os.environ.setdefault("LLM_BACKEND", "fake")
+os.environ.setdefault("GOOGLE_API_KEY", "benchmark")
+
+from app.utils.sessions import Preferences, SessionStore  # noqa: E402
+from benchmarks.corpus import LONG_MESSAGES, SHORT_MESSAGES  # noqa: E402
+
+BASELINE = os.path.join(os.path.dirname(__file__), "baselines", "hot_paths.json")
+HISTORY_TURNS = (1, 10, 50, 200)
+
+REPLY = (
+    "Day {day}: start early at the old town market for breakfast, then walk to the fort "
+    "(entry about 300, allow two hours). After lunch at a local thali place, take the ferry "
+    "across the river and finish with sunset at the beach. Budget roughly 2500 for the day, "
+    "mostly transport and food; carry cash, as smaller places don't take cards."
+)
+
+PREFERENCES = {
+    "destination": "Goa",
+    "duration": 5,
+    "budget": 50000.0,
+    "currency": "INR",
+    "interests": ["food", "culture", "beach"],
+    "travel_style": "mid-range"
+}
+
+
+class Request:
+    # What Gradio passes a handler, as far as the handlers use it
+    session_hash = "hot-paths"
+
+
+def history(turns):
+    # Distinct turns, so none of them is measured from another's cache entry
+    return [(SHORT_MESSAGES[i % len(SHORT_MESSAGES)] + f" (turn {i})", REPLY.format(day=i + 1)) for i in range(turns)]
+
+
+def calibration():
+    # A fixed mix of what the hot paths do: string building, dict and list work
+    words = {}
+    for i in range(40):
+        word = f"word{i % 37}"
+        words[word] = words.get(word, 0) + len(word.upper())
+    return ", ".join(sorted(words))
+
+
+def app_cases(name, module):
+    prefs = Preferences()
+
+    def update_preferences():
+        for message in SHORT_MESSAGES:
+            module.update_preferences(message, prefs)
+
+    def update_preferences_long():
+        for message in LONG_MESSAGES:
+            module.update_preferences(message, prefs)
+
+    with module.sessions.session(Request.session_hash) as session:
+        session.preferences.update(PREFERENCES)
+    return [
+        (f"{name}.update_preferences/short", update_preferences, len(SHORT_MESSAGES)),
+        (f"{name}.update_preferences/long", update_preferences_long, len(LONG_MESSAGES)),
+        (f"{name}.update_preferences_display", lambda: module.update_preferences_display(Request), 1),
+    ]
+
+
+def cases():
+    # (name, function, calls it makes) in report order; a string instead of
+    # a function when the case can't run here
+    from app.models.llm import LLMHandler
+    from app.utils.context import build_context, session_context
+    from app.utils.prompts import generate_system_prompt
+
+    try:
+        from app import main as api
+    except ImportError as e:
+        api = None
+        api_skipped = f"skipped: {type(e).__name__}: {e}"
+
+    yield "generate_system_prompt", lambda: generate_system_prompt(PREFERENCES), 1
+
+    handler = LLMHandler()
+    store = SessionStore("hot-paths", max_turns=max(HISTORY_TURNS))
+    for turns in HISTORY_TURNS:
+        turns_list = history(turns)
+        summary = "The user is planning 5 days in Goa on a mid-range budget."
+        message = SHORT_MESSAGES[turns % len(SHORT_MESSAGES)]
+        # As the handler gets it: within the budget, with token counts
+        context = build_context(turns_list, message, summary)
+        yield f"format_prompt/turns={turns}", lambda c=context, m=message: handler._format_prompt(m, c), 1
+
+        with store.session(f"turns-{turns}") as session:
+            for user, assistant in turns_list:
+                session.add_turn(user, assistant)
+        yield (
+            f"session_context/turns={turns}",
+            lambda s=session, m=message: session_context(s, m, "gradio"),
+            1
+        )
+
+        if api is None:
+            yield f"build_chat_context/turns={turns}", api_skipped, 0
+            continue
+        user_input = api.UserInput(
+            message=message,
+            context=[{"user": user, "assistant": assistant} for user, assistant in turns_list]
+        )
+        yield f"build_chat_context/turns={turns}", lambda u=user_input: api._build_chat_context(u), 1
+
+    for name, module in (("gradio", "app.gradio_app"), ("gemini", "travel_assistant")):
+        try:
+            imported = __import__(module, fromlist=["_"])
+        except ImportError as e:
+            for case in ("update_preferences/short", "update_preferences/long", "update_preferences_display"):
+                yield f"{name}.{case}", f"skipped: {type(e).__name__}: {e}", 0
+            continue
+        yield from app_cases(name, imported)
+
+
+def loops_for(function, min_seconds):
+    # Calls of function that take at least min_seconds
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops):
+            function()
+        if time.perf_counter() - start >= min_seconds:
+            return loops
+        loops *= 2
+
+
+def timed(function, loops):
+    # With the collector off, as timeit does, so a collection that happens
+    # to land in one case's rounds doesn't count against it
+    gc.collect()
+    gc.disable()
+    try:
+        start = time.perf_counter()
+        for _ in range(loops):
+            function()
+        return (time.perf_counter() - start) / loops
+    finally:
+        gc.enable()
+
+
+def per_call(function, calls, rounds, min_seconds):
+    # Seconds per call of function and of the calibration workload, each the
+    # fastest of rounds that alternate between the two, so both are timed
+    # under the same load and clock speed
+    loops = loops_for(function, min_seconds)
+    unit_loops = loops_for(calibration, min_seconds)
+    best = unit = None
+    for _ in range(rounds):
+        seconds = timed(function, loops) / calls
+        best = seconds if best is None else min(best, seconds)
+        seconds = timed(calibration, unit_loops)
+        unit = seconds if unit is None else min(unit, seconds)
+    return best, unit
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--save", action="store_true", help="write the results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=0.3, help="fail when this much slower (0.3 = 30%%)")
+    parser.add_argument("--filter", default="", help="only cases whose name contains this")
+    parser.add_argument("--rounds", type=int, default=7)
+    parser.add_argument("--min-seconds", type=float, default=0.1)
+    args = parser.parse_args()
+
+    baseline = {}
+    if os.path.exists(args.baseline) and not args.save:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get("python") != platform.python_version():
+            print(f"baseline is from Python {baseline.get('python')}, this is {platform.python_version()}")
+
+    unit, _ = per_call(calibration, 1, args.rounds, args.min_seconds)
+    print(f"calibration workload: {unit * 1e6:.1f} us; times below are also given in units of it\n")
+    print(f"{'':<40} {'us/call':>9} {'units':>8} {'baseline':>9} {'change':>8}")
+
+    results = {}
+    regressions = []
+    for name, function, calls in cases():
+        if args.filter not in name:
+            continue
+        if isinstance(function, str):
+            print(f"{name:<40} {function}")
+            continue
+        before = baseline.get("cases", {}).get(name)
+        for attempt in range(2):
+            seconds, case_unit = per_call(function, calls, args.rounds, args.min_seconds)
+            units = seconds / case_unit
+            # A slowdown is measured twice before it counts, since one
+            # busy stretch on the machine can cost a short case a lot
+            if before is None or units / before["units"] - 1 <= args.threshold:
+                break
+        results[name] = {"us": round(seconds * 1e6, 3), "units": round(units, 5)}
+        if before is None:
+            print(f"{name:<40} {seconds * 1e6:>9.2f} {units:>8.3f} {'new':>9}")
+            continue
+        change = units / before["units"] - 1
+        flag = "  REGRESSION" if change > args.threshold else ""
+        print(f"{name:<40} {seconds * 1e6:>9.2f} {units:>8.3f} {before['units']:>9.3f} {change:>+8.0%}{flag}")
+        if flag:
+            regressions.append(name)
+
+    if args.save:
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, "w") as f:
+            json.dump({
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "calibration_us": round(unit * 1e6, 3),
+                "cases": results
+            }, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"\nbaseline saved to {args.baseline}")
+    elif regressions:
+        print(f"\n{len(regressions)} over the {args.threshold:.0%} threshold: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""Inference API call latency and connections opened: huggingface_hub's client vs the pooled transport.
+
+A local stand-in for the Inference API answers text-generation requests
+after --generate-ms. Every new connection first costs --handshake-ms, the
+round trips of a TCP and TLS handshake to a remote host. "huggingface_hub"
+is AsyncInferenceClient, which LLMHandler used to call; "pooled" is
+AsyncInferenceTransport with keep-alive connections. "pooled, 503s" has the
+stand-in answer every --fail-every-th request with a 503, as a loading
+model does, for the transport to retry. Reports latency, connections opened
+and retries. Fails if the pooled transport doesn't cut mean latency.
+
+    python -m benchmarks.bench_inference_transport
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import sys
+import time
+
+from app.models.transport import AsyncInferenceTransport
+from app.utils.metrics import INFERENCE_API_RETRIES
+
+
+class StandInAPI:
+    def __init__(self, handshake, generate, fail_every=0):
+        self.handshake = handshake
+        self.generate = generate
+        self.fail_every = fail_every
+        self.connections = 0
+        self.requests = 0
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        await asyncio.sleep(self.handshake)
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                length = 0
+                for line in head.split(b"\r\n"):
+                    name, _, value = line.partition(b":")
+                    if name.strip().lower() == b"content-length":
+                        length = int(value)
+                await reader.readexactly(length)
+                self.requests += 1
+                if self.fail_every and self.requests % self.fail_every == 0:
+                    status, body = "503 Service Unavailable", b'{"error": "Model is currently loading"}'
+                else:
+                    await asyncio.sleep(self.generate)
+                    status, body = "200 OK", json.dumps([{"generated_text": "Day 1: arrive in Goa"}]).encode()
+                writer.write(
+                    f"HTTP/1.1 {status}\r\nContent-Type: application/json\r\n"
+                    f"Content-Length: {len(body)}\r\n\r\n".encode() + body
+                )
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionResetError):
+            pass
+        finally:
+            writer.close()
+
+
+async def run(client, server, requests, concurrency):
+    stand_in = await asyncio.start_server(server.handle, "127.0.0.1", 0)
+    url = f"http://127.0.0.1:{stand_in.sockets[0].getsockname()[1]}/models/stand-in"
+    latencies = []
+    slots = asyncio.Semaphore(concurrency)
+
+    async def one(i):
+        async with slots:
+            start = time.perf_counter()
+            await client.text_generation(f"Plan day {i} in Goa", model=url, max_new_tokens=64, temperature=0.7)
+            latencies.append(time.perf_counter() - start)
+
+    try:
+        await asyncio.gather(*(one(i) for i in range(requests)))
+    finally:
+        if hasattr(client, "close"):
+            await client.close()
+        stand_in.close()
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--handshake-ms", type=float, default=60)
+    parser.add_argument("--generate-ms", type=float, default=20)
+    parser.add_argument("--fail-every", type=int, default=10)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    args = parser.parse_args()
+
+    clients = []
+    try:
+        from huggingface_hub import AsyncInferenceClient
+        clients.append(("huggingface_hub", lambda: AsyncInferenceClient(token="benchmark"), 0))
+    except ImportError:
+        print("huggingface_hub not installed; measuring the pooled transport only")
+    clients.append(("pooled", lambda: AsyncInferenceTransport("benchmark", backoff_seconds=0.05), 0))
+    clients.append(("pooled, 503s", lambda: AsyncInferenceTransport("benchmark", backoff_seconds=0.05), args.fail_every))
+
+    print(f"{'':>16} {'p50 ms':>8} {'mean ms':>8} {'p99 ms':>8} {'connections':>12} {'retries':>8}")
+    results = {}
+    for name, client, fail_every in clients:
+        server = StandInAPI(args.handshake_ms / 1000, args.generate_ms / 1000, fail_every)
+        retries = INFERENCE_API_RETRIES.total()
+        latencies = sorted(asyncio.run(run(client(), server, args.requests, args.concurrency)))
+        retries = INFERENCE_API_RETRIES.total() - retries
+        results[name] = statistics.mean(latencies)
+        p99 = latencies[min(int(len(latencies) * 0.99), len(latencies) - 1)]
+        print(
+            f"{name:>16} {statistics.median(latencies) * 1000:>8.1f} {results[name] * 1000:>8.1f} "
+            f"{p99 * 1000:>8.1f} {server.connections:>12} {retries:>8.0f}"
+        )
+
+    if "huggingface_hub" in results and results["pooled"] >= results["huggingface_hub"]:
+        print("the pooled transport doesn't cut Inference API latency")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
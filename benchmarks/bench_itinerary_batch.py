@@ -0,0 +1,121 @@
+"""Itineraries for a catalogue: one request per entry vs /generate-itineraries.
+
+Generates --entries preference sets, a quarter of them repeats of others
+(some differing only in case or spacing), against the fake LLM
+(app/models/fake.py) answering after --llm-ms. First as a client would do
+today, one /generate-itinerary call after another; then as one batch at
+several concurrency limits. Reports time to the first itinerary, total
+time and LLM calls, with the itinerary cache emptied before each run.
+Fails if a batch leaves an entry unanswered or generates a repeat twice.
+
+    python -m benchmarks.bench_itinerary_batch
+    python -m benchmarks.bench_itinerary_batch --entries 400 --llm-ms 50
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+
+os.environ["LLM_BACKEND"] = "fake"
+os.environ.setdefault("FAKE_LLM_TOKENS_PER_SECOND", "0")
+os.environ.pop("ITINERARY_CACHE_PATH", None)
+
+from app import main as api  # noqa: E402
+from app.utils.cache import ItineraryCache  # noqa: E402
+
+DESTINATIONS = ("Goa", "Lisbon", "Kyoto", "Jaipur", "Paris", "Bali", "Istanbul", "Cusco", "Hanoi", "Cape Town")
+STYLES = ("budget", "mid-range", "luxury")
+
+
+def catalogue(entries, seed=0):
+    rng = random.Random(seed)
+    unique = []
+    while len(unique) < entries - entries // 4:
+        entry = {
+            "destination": rng.choice(DESTINATIONS),
+            "duration": rng.randint(2, 14),
+            "travel_style": rng.choice(STYLES)
+        }
+        if entry not in unique:
+            unique.append(entry)
+    repeats = []
+    for entry in rng.sample(unique, entries - len(unique)):
+        repeats.append({**entry, "destination": rng.choice((entry["destination"].lower(), f" {entry['destination']} "))})
+    batch = unique + repeats
+    rng.shuffle(batch)
+    return [api.TravelPreferences(**entry) for entry in batch], len(unique)
+
+
+class Calls:
+    # Counts the prompts that reach the (fake) LLM
+    def __init__(self, transport):
+        self.transport = transport
+        self.count = 0
+
+    async def text_generation(self, prompt, **kwargs):
+        self.count += 1
+        return await self.transport.text_generation(prompt, **kwargs)
+
+
+async def one_by_one(batch):
+    start = time.perf_counter()
+    first = None
+    for preferences in batch:
+        await api.generate_itinerary(preferences)
+        first = first or time.perf_counter() - start
+    return first, time.perf_counter() - start, True
+
+
+async def batched(batch, concurrency):
+    api.ITINERARY_BATCH_CONCURRENCY = concurrency
+    start = time.perf_counter()
+    first = None
+    answered = []
+    response = await api.generate_itineraries(batch)
+    async for line in response.body_iterator:
+        result = json.loads(line)
+        if "itinerary" in result:
+            first = first or time.perf_counter() - start
+            answered += result["indices"]
+    return first, time.perf_counter() - start, sorted(answered) == list(range(len(batch)))
+
+
+async def measure(args):
+    batch, unique = catalogue(args.entries)
+    calls = Calls(api.llm_handler.async_api_model)
+    calls.transport.llm.first_token_seconds = args.llm_ms / 1000
+    api.llm_handler.async_api_model = calls
+    print(f"{args.entries} entries, {unique} distinct; LLM answers in {args.llm_ms:.0f} ms\n")
+    print(f"{'':<24} {'first s':>8} {'total s':>8} {'LLM calls':>10}")
+    failed = []
+    runs = [("one by one", None)] + [(f"batch, concurrency {n}", n) for n in (1, 8, 32)]
+    for name, concurrency in runs:
+        api.itinerary_cache = ItineraryCache(max_entries=args.entries * 2)
+        calls.count = 0
+        if concurrency is None:
+            first, total, complete = await one_by_one(batch)
+        else:
+            first, total, complete = await batched(batch, concurrency)
+            if not complete or calls.count != unique:
+                failed.append(name)
+        print(f"{name:<24} {first:>8.2f} {total:>8.2f} {calls.count:>10}")
+    return failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--entries", type=int, default=200)
+    parser.add_argument("--llm-ms", type=float, default=100)
+    args = parser.parse_args()
+
+    failed = asyncio.run(measure(args))
+    if failed:
+        print(f"\nentries unanswered or repeats generated again: {', '.join(failed)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
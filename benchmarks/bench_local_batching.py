@@ -0,0 +1,151 @@
+"""Local model under mixed load: one request at a time vs the batching scheduler.
+
+Itineraries (512 tokens) and chat replies (48 tokens) arrive over a few
+seconds at a synthetic model with ctransformers' token-level interface:
+prompt tokens cost --eval-ms each to evaluate, generated tokens --decode-ms.
+"serial" calls the model under a lock, as LLMHandler used to; "batched" goes
+through BatchScheduler. Reports time to first token (queue wait) and total
+latency per kind, tokens/sec, the batch size distribution and the tokens the
+scheduler evaluated again to switch between requests. Fails if chat replies
+don't finish sooner with the scheduler.
+
+    python -m benchmarks.bench_local_batching
+"""
+import argparse
+import statistics
+import sys
+import threading
+import time
+
+from app.models.scheduler import BatchScheduler
+from app.utils.metrics import LOCAL_BATCH_SIZE, LOCAL_TOKENS
+
+# (kind, prompt tokens, new tokens, count)
+WORKLOAD = (("itinerary", 300, 512, 4), ("chat", 200, 48, 16))
+ARRIVALS_SECONDS = 2.0
+
+
+class SyntheticModel:
+    class config:
+        max_new_tokens = 512
+
+    def __init__(self, eval_seconds, decode_seconds):
+        self.eval_seconds = eval_seconds
+        self.decode_seconds = decode_seconds
+        self.lock = threading.Lock()
+
+    def tokenize(self, text):
+        return [1] * len(text.split())
+
+    def generate(self, tokens):
+        # A single context: concurrent sequences would corrupt it
+        assert self.lock.acquire(blocking=False), "model used by two sequences at once"
+        try:
+            time.sleep(self.eval_seconds * len(tokens))
+            while True:
+                time.sleep(self.decode_seconds)
+                yield 2
+        finally:
+            self.lock.release()
+
+    def is_eos_token(self, token):
+        return False
+
+    def detokenize(self, tokens, decode=True):
+        return " tok" if decode else b" tok"
+
+    def __call__(self, prompt, stream=False, max_new_tokens=None):
+        tokens = self.generate(self.tokenize(prompt))
+        text = "".join(self.detokenize([next(tokens)]) for _ in range(max_new_tokens))
+        tokens.close()
+        return iter([text]) if stream else text
+
+
+class Serial:
+    # The old path: the model to itself for a whole generation
+    def __init__(self, model):
+        self.model = model
+        self.lock = threading.Lock()
+
+    def __call__(self, prompt, stream=False, max_new_tokens=None):
+        with self.lock:
+            return self.model(prompt, stream=stream, max_new_tokens=max_new_tokens)
+
+
+def run(backend):
+    results = {kind: [] for kind, *_ in WORKLOAD}
+    # The kinds interleaved over the arrival period
+    queues = [[(kind, prompt, new)] * count for kind, prompt, new, count in WORKLOAD]
+    requests = []
+    while any(queues):
+        for q in queues:
+            share = max(len(q) * len(queues) // max(sum(map(len, queues)), 1), 1)
+            requests.extend(q[:share])
+            del q[:share]
+    gap = ARRIVALS_SECONDS / len(requests)
+
+    def client(kind, prompt_tokens, new_tokens):
+        start = time.perf_counter()
+        first = None
+        for _ in backend("word " * prompt_tokens, stream=True, max_new_tokens=new_tokens):
+            if first is None:
+                first = time.perf_counter() - start
+        results[kind].append((first, time.perf_counter() - start))
+
+    start = time.perf_counter()
+    threads = []
+    for i, request in enumerate(requests):
+        time.sleep(max(start + i * gap - time.perf_counter(), 0))
+        thread = threading.Thread(target=client, args=request)
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    generated = sum(new * count for _, _, new, count in WORKLOAD)
+    return results, generated / elapsed
+
+
+def p95(values):
+    return sorted(values)[max(int(len(values) * 0.95) - 1, 0)]
+
+
+def report(name, results, tokens_per_second):
+    for kind, timings in results.items():
+        firsts = [first for first, _ in timings]
+        totals = [total for _, total in timings]
+        print(
+            f"{name:>8} {kind:>10} first token p50 {statistics.median(firsts):6.2f} s p95 {p95(firsts):6.2f} s"
+            f"   total p50 {statistics.median(totals):6.2f} s p95 {p95(totals):6.2f} s"
+        )
+    print(f"{name:>8} {tokens_per_second:.0f} tokens/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--eval-ms", type=float, default=0.2)
+    parser.add_argument("--decode-ms", type=float, default=2.0)
+    parser.add_argument("--quantum", type=int, default=32)
+    parser.add_argument("--max-batch", type=int, default=8)
+    args = parser.parse_args()
+
+    model = SyntheticModel(args.eval_ms / 1000, args.decode_ms / 1000)
+    serial, serial_rate = run(Serial(model))
+    report("serial", serial, serial_rate)
+    batched, batched_rate = run(BatchScheduler(model, max_batch=args.max_batch, quantum=args.quantum))
+    report("batched", batched, batched_rate)
+
+    series = LOCAL_BATCH_SIZE.values()
+    bounds = [f"<={b}" for b in LOCAL_BATCH_SIZE.buckets] + ["more"]
+    print("batch sizes per round: " + ", ".join(f"{b}: {n}" for b, n in zip(bounds, series) if n))
+    print(f"tokens evaluated again to switch requests: {LOCAL_TOKENS.value('reevaluated'):,.0f}")
+
+    serial_chat = p95([total for _, total in serial["chat"]])
+    batched_chat = p95([total for _, total in batched["chat"]])
+    if batched_chat >= serial_chat:
+        print("chat replies don't finish sooner with the scheduler")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""Per-box memory and throughput with 1, 4 and 8 API workers: a model per worker vs one sidecar.
+
+"in-process" is how the API ran under several uvicorn workers: each worker
+process loads its own copy of the local model. "sidecar" is one
+app.models.local_server process that owns the model, with each worker using
+a pooled LocalModelClient. Every worker sends the same number of
+generations, one at a time as LLMHandler's local executor does. Memory is
+the PSS of every process involved (the workers and, if any, the sidecar), so
+shared pages are not counted twice. Linux only.
+
+Without --model a synthetic model stands in for the GGUF: it holds --model-mb
+of memory and spends CPU on every token, outside the GIL like ctransformers.
+Fails if the sidecar box at the most workers uses as much memory as the
+in-process box.
+
+    python -m benchmarks.bench_local_sidecar
+    python -m benchmarks.bench_local_sidecar --model models/llama-2-7b-chat.gguf --requests 4
+"""
+import argparse
+import hashlib
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+from app.models.local_server import LocalModelClient, LocalModelServer, load_local_model
+
+WORKERS = (1, 4, 8)
+PROMPT = "User: Plan 3 days in Goa on a budget\nAssistant:"
+
+
+class SyntheticModel:
+    # Memory like a loaded model, and CPU per token like generating one
+    def __init__(self, mb, tokens=32, token_bytes=1 << 20):
+        self.weights = bytearray(b"\x01") * (mb << 20)
+        self.tokens = tokens
+        self.block = memoryview(self.weights)[:token_bytes]
+
+    def __call__(self, prompt, stream=False, max_new_tokens=None):
+        tokens = self._generate(min(max_new_tokens or self.tokens, self.tokens))
+        return tokens if stream else "".join(tokens)
+
+    def _generate(self, n):
+        for i in range(n):
+            hashlib.sha256(self.block).digest()
+            yield f" token{i}"
+
+
+def _model(args):
+    return load_local_model(args.model) if args.model else SyntheticModel(args.model_mb)
+
+
+def pss_mb(pid):
+    # Proportional set size; falls back to RSS without smaps_rollup
+    for path, field in ((f"/proc/{pid}/smaps_rollup", "Pss:"), (f"/proc/{pid}/status", "VmRSS:")):
+        try:
+            with open(path) as f:
+                for line in f:
+                    if line.startswith(field):
+                        return int(line.split()[1]) / 1024
+        except OSError:
+            continue
+    return 0.0
+
+
+def run_sidecar(path, args):
+    LocalModelServer(path, _model(args)).serve_forever()
+
+
+def run_worker(mode, path, args, ready, go, results):
+    # One API worker: load (or connect), then generate sequentially
+    model = _model(args) if mode == "in-process" else LocalModelClient(path, pool_size=1)
+    if mode == "sidecar":
+        model.status()
+    ready.put(os.getpid())
+    go.wait()
+    for _ in range(args.requests):
+        model(PROMPT)
+    results.put((os.getpid(), pss_mb(os.getpid())))
+
+
+def box(mode, workers, args, ctx):
+    path = os.path.join(tempfile.mkdtemp(), "llm.sock")
+    sidecar = None
+    if mode == "sidecar":
+        sidecar = ctx.Process(target=run_sidecar, args=(path, args), daemon=True)
+        sidecar.start()
+        while not os.path.exists(path):
+            time.sleep(0.05)
+
+    ready, results = ctx.Queue(), ctx.Queue()
+    go = ctx.Event()
+    procs = [ctx.Process(target=run_worker, args=(mode, path, args, ready, go, results)) for _ in range(workers)]
+    for p in procs:
+        p.start()
+    for _ in procs:
+        ready.get()
+    start = time.perf_counter()
+    go.set()
+    memory = [results.get()[1] for _ in procs]
+    elapsed = time.perf_counter() - start
+    if sidecar:
+        memory.append(pss_mb(sidecar.pid))
+    for p in procs:
+        p.join()
+    if sidecar:
+        sidecar.terminate()
+        sidecar.join()
+    return sum(memory), workers * args.requests / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--model", help="a GGUF file to use instead of the synthetic model")
+    parser.add_argument("--model-mb", type=int, default=256, help="size of the synthetic model")
+    parser.add_argument("--requests", type=int, default=10, help="generations per worker")
+    parser.add_argument("--workers", type=int, nargs="*", default=WORKERS)
+    args = parser.parse_args()
+
+    # uvicorn starts workers as fresh interpreters, not forks
+    ctx = multiprocessing.get_context("spawn")
+    print(f"{os.cpu_count()} CPUs; {'model ' + args.model if args.model else f'synthetic {args.model_mb} MB model'}")
+    print(f"{'workers':>8} {'in-process MB':>14} {'req/s':>7} {'sidecar MB':>11} {'req/s':>7}")
+    rows = []
+    for workers in args.workers:
+        inproc_mb, inproc_rps = box("in-process", workers, args, ctx)
+        sidecar_mb, sidecar_rps = box("sidecar", workers, args, ctx)
+        rows.append((workers, inproc_mb, sidecar_mb))
+        print(f"{workers:>8} {inproc_mb:>14,.0f} {inproc_rps:>7.1f} {sidecar_mb:>11,.0f} {sidecar_rps:>7.1f}")
+
+    workers, inproc_mb, sidecar_mb = rows[-1]
+    if sidecar_mb >= inproc_mb:
+        print(f"sidecar box uses no less memory than in-process at {workers} workers")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""Cost of recording a metric, and whether concurrent recording loses updates.
+
+Times Counter.inc and Histogram.observe on a series bound with labels(), as
+the hot paths record, and with label values looked up per call; a dict
+behind a lock is the baseline. Then --threads threads increment one counter
+and observe one histogram --per-thread times each, and the totals are
+checked, as are the rows left behind by --short-lived threads that record
+once each, as a thread started per request does. Also times rendering
+/metrics. Fails if an update is lost or exited threads keep their rows.
+
+    python -m benchmarks.bench_metrics
+"""
+import argparse
+import sys
+import threading
+import time
+
+from app.utils.metrics import Counter, Histogram, render_metrics
+
+
+def per_call_ns(fn, calls):
+    start = time.perf_counter()
+    fn(calls)
+    return (time.perf_counter() - start) / calls * 1e9
+
+
+def locked_counter(calls):
+    lock = threading.Lock()
+    values = {}
+    key = ("api", "ok")
+    for _ in range(calls):
+        with lock:
+            values[key] = values.get(key, 0) + 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--calls", type=int, default=1_000_000)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--per-thread", type=int, default=200_000)
+    parser.add_argument("--short-lived", type=int, default=5000)
+    args = parser.parse_args()
+
+    counter = Counter("bench_counter_total", "bench", labels=("backend", "outcome"))
+    histogram = Histogram("bench_seconds", "bench", labels=("backend",))
+    bound_counter = counter.labels("api", "ok")
+    bound_histogram = histogram.labels("api")
+
+    def bound_inc(calls):
+        for _ in range(calls):
+            bound_counter.inc()
+
+    def labelled_inc(calls):
+        for _ in range(calls):
+            counter.inc("api", "ok")
+
+    def bound_observe(calls):
+        for _ in range(calls):
+            bound_histogram.observe(0.042)
+
+    def labelled_observe(calls):
+        for _ in range(calls):
+            histogram.observe(0.042, "api")
+
+    def empty(calls):
+        for _ in range(calls):
+            pass
+
+    loop = per_call_ns(empty, args.calls)
+    print(f"{'':>26} {'ns/call':>8}")
+    for name, fn in (
+        ("counter, dict under lock", locked_counter),
+        ("counter, bound", bound_inc),
+        ("counter, labels per call", labelled_inc),
+        ("histogram, bound", bound_observe),
+        ("histogram, labels per call", labelled_observe),
+    ):
+        print(f"{name:>26} {per_call_ns(fn, args.calls) - loop:>8.0f}")
+
+    shared_counter = Counter("bench_shared_total", "bench").labels()
+    shared_histogram = Histogram("bench_shared_seconds", "bench").labels()
+
+    def record():
+        for _ in range(args.per_thread):
+            shared_counter.inc()
+            shared_histogram.observe(0.042)
+
+    threads = [threading.Thread(target=record) for _ in range(args.threads)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    expected = args.threads * args.per_thread
+    counted = shared_counter.value()
+    observed = sum(shared_histogram._rows.totals()[:-1])
+    print(f"{args.threads} threads: {expected:,} updates each in {elapsed:.2f} s, "
+          f"counter {counted:,.0f}, histogram {observed:,.0f}")
+
+    short_lived = Counter("bench_short_lived_total", "bench").labels()
+    for _ in range(args.short_lived):
+        thread = threading.Thread(target=short_lived.inc)
+        thread.start()
+        thread.join()
+    rows = len(short_lived._rows._rows)
+    print(f"{args.short_lived:,} short-lived threads: counter {short_lived.value():,.0f}, {rows} rows kept")
+
+    start = time.perf_counter()
+    text = render_metrics()
+    print(f"rendering /metrics: {(time.perf_counter() - start) * 1000:.2f} ms, {len(text):,} bytes")
+
+    if counted != expected or observed != expected:
+        print("concurrent recording lost updates")
+        sys.exit(1)
+    if short_lived.value() != args.short_lived or rows:
+        print("exited threads left rows behind or lost their updates")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""Local prompt-eval time per itinerary request, with and without the prompt-prefix cache.
+
+Sends itinerary prompts for a mix of preferences, formatted as LLMHandler
+sends them, through LlamaCppModel with LOCAL_PREFIX_CACHE_SIZE=0 ("off") and
+with the default cache. A chat request runs between itineraries, as it does
+on a shared model, so llama.cpp's own reuse of whatever is still in its
+context doesn't cover the instructions. Reports the itineraries' prompt-eval
+time (start of generation to first token) and the prompt tokens they had
+evaluated. Fails if the cache doesn't cut prompt evaluation.
+
+Without --model a stand-in for llama_cpp.Llama is used: it has the same
+prefix matching and state save/load, and each evaluated token costs
+--eval-ms. With --model the real GGUF is loaded through llama-cpp-python.
+
+    python -m benchmarks.bench_prefix_cache
+    python -m benchmarks.bench_prefix_cache --model models/llama-2-7b-chat.gguf
+"""
+import argparse
+import copy
+import re
+import statistics
+import sys
+import time
+import zlib
+
+from app.models.llama_backend import LlamaCppModel
+from app.models.llm import LLMHandler
+from app.utils.prompts import generate_system_prompt
+
+DESTINATIONS = ("Goa", "Lisbon", "Kyoto", "Jaipur", "Cape Town", "Reykjavik")
+STYLES = ("budget", "mid-range", "luxury")
+
+
+class StandInLlama:
+    # llama_cpp.Llama's context handling, with a fixed cost per evaluated token
+    def __init__(self, eval_seconds):
+        self.eval_seconds = eval_seconds
+        self.input_ids = []
+        self.n_tokens = 0
+        self.evaluated = 0
+
+    def tokenize(self, text):
+        return [1] + [zlib.crc32(t.encode()) for t in re.findall(r"\w+|[^\w\s]", text.decode())]
+
+    def detokenize(self, tokens):
+        return b" tok" * len(tokens)
+
+    def token_eos(self):
+        return 0
+
+    def reset(self):
+        self.n_tokens = 0
+
+    def eval(self, tokens):
+        time.sleep(self.eval_seconds * len(tokens))
+        self.evaluated += len(tokens)
+        self.input_ids = self.input_ids[:self.n_tokens] + list(tokens)
+        self.n_tokens += len(tokens)
+
+    def generate(self, tokens):
+        prefix = self.longest_token_prefix(self.input_ids[:self.n_tokens], tokens[:-1])
+        self.n_tokens = prefix
+        tokens = tokens[prefix:]
+        while True:
+            self.eval(tokens)
+            tokens = [2]
+            yield 2
+
+    def save_state(self):
+        return copy.copy((self.input_ids, self.n_tokens))
+
+    def load_state(self, state):
+        self.input_ids, self.n_tokens = list(state[0]), state[1]
+
+    @staticmethod
+    def longest_token_prefix(a, b):
+        n = 0
+        for x, y in zip(a, b):
+            if x != y:
+                break
+            n += 1
+        return n
+
+
+def chat_prompt(i):
+    context = [{"user": f"What should I eat in {DESTINATIONS[(i + 3) % len(DESTINATIONS)]}?",
+                "assistant": "Try the street food near the old town, and the seafood by the harbour."}]
+    return LLMHandler._format_prompt(None, f"And where should I stay for {i + 2} nights?", context)
+
+
+def prompts(count):
+    for i in range(count):
+        preferences = {
+            "destination": DESTINATIONS[i % len(DESTINATIONS)],
+            "duration": 2 + i % 6,
+            "budget": 500 + 250 * (i % 7),
+            "interests": ["food", "history", "beaches", "hiking"][: 1 + i % 4],
+            "travel_style": STYLES[i % len(STYLES)],
+        }
+        yield LLMHandler._format_prompt(None, generate_system_prompt(preferences), [])
+
+
+def run(model, count):
+    timings = []
+    evaluated = 0
+    for i, prompt in enumerate(prompts(count)):
+        before = getattr(model.llama, "evaluated", 0)
+        start = time.perf_counter()
+        tokens = model.generate(model.tokenize(prompt))
+        next(tokens)
+        timings.append(time.perf_counter() - start)
+        tokens.close()
+        evaluated += getattr(model.llama, "evaluated", 0) - before
+        # Another request takes the model in between
+        tokens = model.generate(model.tokenize(chat_prompt(i)))
+        next(tokens)
+        tokens.close()
+    return timings, evaluated
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--model", help="GGUF file to run through llama-cpp-python")
+    parser.add_argument("--eval-ms", type=float, default=2.0, help="stand-in cost per evaluated token")
+    parser.add_argument("--requests", type=int, default=30)
+    args = parser.parse_args()
+
+    if args.model:
+        loaded = LlamaCppModel.from_pretrained(args.model)
+        llama = loaded.llama
+    else:
+        llama = StandInLlama(args.eval_ms / 1000)
+    results = {}
+    for name, states in (("off", 0), ("cached", 2)):
+        model = LlamaCppModel(llama, prefix_states=states)
+        llama.reset()
+        results[name] = run(model, args.requests)
+
+    print(f"{'prefix cache':>12} {'p50 ms':>8} {'mean ms':>8} {'tokens evaluated':>17}")
+    for name, (timings, evaluated) in results.items():
+        print(
+            f"{name:>12} {statistics.median(timings) * 1000:>8.1f} {statistics.mean(timings) * 1000:>8.1f} "
+            f"{evaluated if not args.model else '-':>17}"
+        )
+
+    if statistics.mean(results["cached"][0]) >= statistics.mean(results["off"][0]):
+        print("the prefix cache doesn't reduce prompt evaluation time")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""Session store memory per planner and cost per turn, with and without the memory cap.
+
+Compares a slotted session against the old ConversationState-style dicts,
+then drives 20,000 planners through a store capped at 4 MB. Fails if the
+store's estimate or the traced allocations go over the cap.
+
+    python -m benchmarks.bench_sessions
+"""
+import sys
+import time
+import tracemalloc
+
+from app.utils.extraction import extract_preferences
+from app.utils.sessions import SessionStore
+from benchmarks.corpus import SHORT_MESSAGES
+
+PLANNERS = 20000
+TURNS = 4
+CAP = 4 * 1024 * 1024
+
+
+class ConversationState:
+    # The per-process state the apps used to keep, one per planner here
+    def __init__(self):
+        self.history = []
+        self.current_preferences = {
+            "destination": None,
+            "duration": None,
+            "budget": None,
+            "currency": "INR",
+            "interests": [],
+            "travel_style": None
+        }
+
+
+def traced(build):
+    tracemalloc.start()
+    kept = build()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return kept, size
+
+
+def dict_states(n):
+    states = {}
+    for i in range(n):
+        state = states[f"session-{i}"] = ConversationState()
+        message = SHORT_MESSAGES[i % len(SHORT_MESSAGES)]
+        state.current_preferences.update(extract_preferences(message))
+        state.history.append((message, "ok"))
+    return states
+
+
+def slotted_sessions(n, store):
+    for i in range(n):
+        with store.session(f"session-{i}") as session:
+            message = SHORT_MESSAGES[i % len(SHORT_MESSAGES)]
+            session.preferences.update(extract_preferences(message))
+            session.add_turn(message, "ok")
+    return store
+
+
+def main():
+    n = 5000
+    _, dict_bytes = traced(lambda: dict_states(n))
+    _, slot_bytes = traced(lambda: slotted_sessions(n, SessionStore(max_bytes=1 << 40)))
+    print(f"per planner: dicts {dict_bytes / n:,.0f} B, slotted sessions {slot_bytes / n:,.0f} B")
+
+    store = SessionStore(max_sessions=PLANNERS, max_bytes=CAP, max_turns=TURNS)
+    tracemalloc.start()
+    start = time.perf_counter()
+    for turn in range(TURNS):
+        slotted_sessions(PLANNERS, store)
+    seconds = time.perf_counter() - start
+    traced_bytes, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    stats = store.stats()
+    turns = PLANNERS * TURNS
+    print(
+        f"{PLANNERS:,} planners x {TURNS} turns under a {CAP >> 20} MB cap: "
+        f"{turns / seconds:,.0f} turns/s, {stats['sessions']:,} sessions kept, "
+        f"{stats['bytes'] / 1024:,.0f} KB estimated, {traced_bytes / 1024:,.0f} KB traced, "
+        f"evictions {stats['evictions']}"
+    )
+    if stats["bytes"] > CAP or traced_bytes > CAP * 1.5:
+        print("session store grew past its memory cap")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+"""Cold import time of the app entry points, with a per-module profile and a budget gate.
+
+Each entry point is imported in a fresh interpreter several times; the
+fastest run, minus the interpreter's own startup, is its cold import time.
+Fails if any entry point goes over its budget, or if importing it loads a
+heavy dependency that it should only import on first use, or if an entry
+point that builds its interface on demand can't build it (against the fake
+LLM). Entry points whose dependencies aren't installed are reported and
+skipped.
+
+--profile re-runs each import under `python -X importtime` and lists the
+modules with the highest cumulative import cost; --json writes every
+module's self and cumulative time for comparing runs.
+
+    python -m benchmarks.bench_startup
+    python -m benchmarks.bench_startup --profile --json startup.json
+    python -m benchmarks.bench_startup --budget app.main=800
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+# Milliseconds on top of a bare interpreter start
+BUDGETS = {
+    "app.main": 1500,
+    "app.gradio_app": 4000,
+    "travel_assistant": 1000,
+}
+
+# Imported on first use, never at import time
+DEFERRED = {
+    "app.main": ("aiohttp", "requests", "ctransformers", "llama_cpp", "google.generativeai", "gradio"),
+    "travel_assistant": ("gradio", "google.generativeai"),
+}
+
+# Entry points that build their interface in a function rather than at
+# import, and that function
+INTERFACES = {
+    "travel_assistant": "create_gradio_interface",
+}
+
+RUNS = 5
+
+# Enough configuration for the entry points to import; no calls are made
+ENV = {"HF_API_TOKEN": "startup-benchmark", "GOOGLE_API_KEY": "startup-benchmark"}
+
+
+def _env(overrides=None):
+    env = dict(os.environ)
+    for key, value in ENV.items():
+        env.setdefault(key, value)
+    env.update(overrides or {})
+    return env
+
+
+def _run(code, importtime=False, env=None):
+    args = [sys.executable] + (["-X", "importtime"] if importtime else []) + ["-c", code]
+    start = time.perf_counter()
+    result = subprocess.run(args, env=_env(env), capture_output=True, text=True)
+    return time.perf_counter() - start, result
+
+
+def cold_import_ms(module, runs=RUNS):
+    # None if the module can't be imported here
+    baseline = min(_run("pass")[0] for _ in range(runs))
+    best = None
+    for _ in range(runs):
+        seconds, result = _run(f"import {module}")
+        if result.returncode:
+            return None, result.stderr.strip().splitlines()[-1]
+        best = seconds if best is None else min(best, seconds)
+    return (best - baseline) * 1000, None
+
+
+def loaded_early(module):
+    # The DEFERRED modules that importing `module` loads anyway
+    deferred = DEFERRED.get(module, ())
+    _, result = _run(f"import sys, {module}; print(' '.join(m for m in {deferred!r} if m in sys.modules))")
+    return result.stdout.split()
+
+
+def build_error(module):
+    # Why building `module`'s interface fails, or None; "skipped: ..." when
+    # its dependencies aren't installed
+    code = f"import {module}; {module}.{INTERFACES[module]}()"
+    _, result = _run(code, env={"LLM_BACKEND": "fake"})
+    if not result.returncode:
+        return None
+    error = result.stderr.strip().splitlines()[-1]
+    return f"skipped: {error}" if error.startswith("ModuleNotFoundError") else error
+
+
+def import_profile(module):
+    # [(module, self_us, cumulative_us)] from -X importtime
+    _, result = _run(f"import {module}", importtime=True)
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        rows.append((name.strip(), int(self_us), int(cumulative_us)))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("modules", nargs="*", default=list(BUDGETS), help="entry points to import")
+    parser.add_argument("--budget", action="append", default=[], metavar="MODULE=MS", help="override a budget")
+    parser.add_argument("--profile", action="store_true", help="list the costliest modules per entry point")
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--json", help="write the per-module profile here")
+    args = parser.parse_args()
+
+    budgets = dict(BUDGETS)
+    for item in args.budget:
+        module, ms = item.split("=")
+        budgets[module] = float(ms)
+
+    failed = []
+    profiles = {}
+    for module in args.modules:
+        ms, error = cold_import_ms(module)
+        if ms is None:
+            print(f"{module:<18} skipped: {error}")
+            continue
+        budget = budgets.get(module)
+        verdict = "" if budget is None else ("ok" if ms <= budget else "OVER BUDGET")
+        print(f"{module:<18} {ms:8.0f} ms cold import  (budget {budget or '-'} ms) {verdict}")
+        if budget is not None and ms > budget:
+            failed.append(module)
+        early = loaded_early(module)
+        if early:
+            print(f"{'':<18} imports at startup what it should import on first use: {', '.join(early)}")
+            failed.append(module)
+        if module in INTERFACES:
+            error = build_error(module)
+            if error is None:
+                print(f"{'':<18} {INTERFACES[module]}() ok")
+            elif error.startswith("skipped"):
+                print(f"{'':<18} {INTERFACES[module]}() {error}")
+            else:
+                print(f"{'':<18} {INTERFACES[module]}() fails: {error}")
+                failed.append(module)
+
+        if args.profile or args.json:
+            rows = profiles[module] = import_profile(module)
+        if args.profile:
+            for name, self_us, cumulative_us in sorted(rows, key=lambda r: -r[2])[:args.top]:
+                print(f"    {cumulative_us / 1000:8.1f} ms cumulative {self_us / 1000:7.1f} ms self  {name}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({
+                module: [{"module": n, "self_us": s, "cumulative_us": c} for n, s, c in rows]
+                for module, rows in profiles.items()
+            }, f, indent=2)
+
+    if failed:
+        print(f"cold import over budget, too eager or failing to build: {', '.join(failed)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
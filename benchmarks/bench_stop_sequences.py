@@ -0,0 +1,110 @@
+"""Tokens generated and latency per chat reply, without and with stop sequences.
+
+A scripted model with ctransformers' token-level interface answers each
+prompt with a reply of 30-120 words, then does what models do with a
+"User: ...\nAssistant:" transcript: writes the user's next message and its
+own answer, turn after turn, until max_new_tokens. Each generated token
+costs --decode-ms. Replies go through BatchScheduler as LLMHandler sends
+them, without stop sequences (as before) and with STOP_SEQUENCES. Reports
+tokens generated and latency per reply, and how many replies showed a
+fabricated turn. Fails if stop sequences don't cut tokens per reply, or
+if a fabricated turn gets through.
+
+    python -m benchmarks.bench_stop_sequences
+"""
+import argparse
+import random
+import re
+import statistics
+import sys
+import time
+
+from app.models.scheduler import BatchScheduler
+from app.utils.metrics import LOCAL_TOKENS
+from app.utils.stops import STOP_SEQUENCES
+
+WORDS = ("beach", "fort", "market", "spice", "ferry", "temple", "sunset", "curry", "scooter", "monsoon")
+FOLLOW_UPS = ("What about food?", "Is it safe at night?", "How do I get there?", "Any day trips?")
+
+
+class ScriptedModel:
+    class config:
+        max_new_tokens = 512
+
+    def __init__(self, decode_seconds, seed=0):
+        self.decode_seconds = decode_seconds
+        self.random = random.Random(seed)
+        self.vocab = {}
+        self.pieces = []
+
+    def _id(self, piece):
+        if piece not in self.vocab:
+            self.vocab[piece] = len(self.pieces)
+            self.pieces.append(piece)
+        return self.vocab[piece]
+
+    def tokenize(self, text):
+        return [self._id(piece) for piece in re.findall(r"\n|[^\s\w]|\s?\w+", text)]
+
+    def _script(self):
+        # The reply, then made-up turns for as long as it is allowed to go on
+        reply = " ".join(self.random.choice(WORDS) for _ in range(self.random.randint(30, 120)))
+        text = " " + reply.capitalize() + "."
+        while True:
+            yield text
+            text = (f"\nUser: {self.random.choice(FOLLOW_UPS)}\nAssistant: "
+                    + " ".join(self.random.choice(WORDS) for _ in range(40)) + ".")
+
+    def generate(self, tokens):
+        for text in self._script():
+            for token in self.tokenize(text):
+                time.sleep(self.decode_seconds)
+                yield token
+
+    def is_eos_token(self, token):
+        return False
+
+    def detokenize(self, tokens, decode=True):
+        text = "".join(self.pieces[token] for token in tokens)
+        return text if decode else text.encode()
+
+
+def run(model, replies, stop):
+    scheduler = BatchScheduler(model, window=0)
+    latencies = []
+    tokens = []
+    fabricated = 0
+    for i in range(replies):
+        before = LOCAL_TOKENS.value("generated")
+        start = time.perf_counter()
+        text = scheduler(f"User: Plan day {i + 1} in Goa\nAssistant:", stop=stop)
+        latencies.append(time.perf_counter() - start)
+        tokens.append(LOCAL_TOKENS.value("generated") - before)
+        fabricated += "User:" in text
+    return latencies, tokens, fabricated
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--decode-ms", type=float, default=2.0)
+    parser.add_argument("--replies", type=int, default=20)
+    args = parser.parse_args()
+
+    print(f"{'':>14} {'tokens/reply':>13} {'p50 ms':>8} {'mean ms':>8} {'fabricated turns':>17}")
+    results = {}
+    for name, stop in (("no stops", None), ("stop sequences", STOP_SEQUENCES)):
+        latencies, tokens, fabricated = run(ScriptedModel(args.decode_ms / 1000), args.replies, stop)
+        results[name] = (statistics.mean(tokens), fabricated)
+        print(
+            f"{name:>14} {statistics.mean(tokens):>13.0f} {statistics.median(latencies) * 1000:>8.0f} "
+            f"{statistics.mean(latencies) * 1000:>8.0f} {fabricated:>12}/{args.replies}"
+        )
+
+    tokens, fabricated = results["stop sequences"]
+    if tokens >= results["no stops"][0] or fabricated:
+        print("stop sequences don't end replies at the assistant's turn")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
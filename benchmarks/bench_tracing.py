@@ -0,0 +1,108 @@
+"""/chat latency by tracing mode, and what a traced request records.
+
+Sends --requests /chat requests with a session through the ASGI app, with a
+stubbed Inference API that answers at once so tracing's own cost isn't lost
+in generation time. Modes: tracing off (the default), Server-Timing on every
+request, 1% and 100% sampled to a trace file, and 100% sampled with
+cProfile. Reports mean and p99 latency per request, then the Server-Timing
+header and trace file spans of one request. Fails if a traced request is
+missing a stage in either.
+
+    python -m benchmarks.bench_tracing
+"""
+import argparse
+import asyncio
+import glob
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+os.environ.setdefault("HF_API_TOKEN", "benchmark")
+
+import httpx  # noqa: E402
+
+from app import main as api  # noqa: E402
+
+STAGES = ("prompt_build", "llm.api", "llm", "extraction", "postprocess")
+
+MODES = (
+    ("off", dict(sample_rate=0.0, server_timing=False, profile=False)),
+    ("server timing", dict(sample_rate=0.0, server_timing=True, profile=False)),
+    ("1% sampled", dict(sample_rate=0.01, server_timing=False, profile=False)),
+    ("100% sampled", dict(sample_rate=1.0, server_timing=False, profile=False)),
+    ("100% + cProfile", dict(sample_rate=1.0, server_timing=False, profile=True)),
+)
+
+
+class StubAsyncInferenceClient:
+    async def text_generation(self, prompt, **kwargs):
+        return "Day 1: arrive in Goa, beaches in the afternoon."
+
+
+async def run(client, requests, sessions):
+    latencies = []
+    timing = None
+    for i in range(requests):
+        start = time.perf_counter()
+        response = await client.post(
+            "/chat",
+            json={"message": f"I want a budget trip to Goa for {i % 7 + 2} days", "session_id": f"{sessions}-{i % 50}"}
+        )
+        latencies.append(time.perf_counter() - start)
+        response.raise_for_status()
+        timing = response.headers.get("server-timing", timing)
+    return sorted(latencies), timing
+
+
+async def measure(args, directory):
+    api.llm_handler.async_api_model = StubAsyncInferenceClient()
+    api.tracer.directory = directory
+    transport = httpx.ASGITransport(app=api.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        await run(client, 50, "warm-up")
+        print(f"{'':>16} {'mean us':>8} {'p99 us':>8}")
+        timing = None
+        for name, options in MODES:
+            for option, value in options.items():
+                setattr(api.tracer, option, value)
+            # Fresh sessions, so each mode builds the same contexts
+            latencies, header = await run(client, args.requests, name)
+            timing = header or timing
+            p99 = latencies[min(int(len(latencies) * 0.99), len(latencies) - 1)]
+            print(f"{name:>16} {statistics.mean(latencies) * 1e6:>8.0f} {p99 * 1e6:>8.0f}")
+    return timing
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=1000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        timing = asyncio.run(measure(args, directory))
+        traces = glob.glob(os.path.join(directory, "*.trace.json"))
+        profiles = glob.glob(os.path.join(directory, "*.prof"))
+        text = open(traces[0]).read() if traces else "["
+        # The file's closing "]" is left out, as the format allows
+        events = json.loads(text.rstrip().rstrip(",") + "]")
+
+    print(f"\nServer-Timing: {timing}")
+    spans = [event for event in events if event["ph"] == "X"]
+    last = spans[-1]["tid"] if spans else None
+    print(f"trace file: {len(events)} events, {len(profiles)} profiles kept; one request:")
+    for event in spans:
+        if event["tid"] == last:
+            print(f"  {event['name']:<14} {event['dur']:>7} us  {event['args']}")
+
+    recorded = {event["name"] for event in spans if event["tid"] == last}
+    missing = [stage for stage in STAGES if stage not in (timing or "") or stage not in recorded]
+    if missing:
+        print(f"stages missing from the trace: {', '.join(missing)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
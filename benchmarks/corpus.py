@@ -0,0 +1,33 @@
+# Sample chat messages shared by the benchmarks
+
+SHORT_MESSAGES = [
+    "I want to plan a trip to Goa for 5 days",
+    "Budget is around 50000 rupees, mid-range hotels please",
+    "We love beaches, local cuisine and nightlife",
+    "Thinking of going to Japan for 2 weeks with a budget of $3,000",
+    "Can you suggest something cheap for a family of four?",
+    "dreaming about Paris, 4 nights, 1.5 lakh, luxury",
+    "What's the weather like in December?",
+    "spend 10 days in the mountains, adventure and wildlife",
+    "Is it safe to travel solo there?",
+    "Thanks, that looks great!",
+]
+
+BLOG_POST = """Our week in the hills started with a slow train out of the city. The carriages were packed with families
+heading home for the festival, and we spent most of the ride watching terraced tea gardens roll past the window.
+By the time we reached the station it was nearly dark, and the guesthouse owner met us with a lantern and a jeep
+that had clearly seen better decades. Dinner was dal, rice and a fiery pickle his mother had made that spring.
+The next morning we hiked up to the monastery, about 6 km of steep switchbacks through rhododendron forest. Prayer
+flags snapped in the wind at the top, and a young monk showed us the murals inside the main hall, some of them
+over 300 years old. We paid 50 each for entry and another 20 to climb the bell tower. On the way down it rained,
+the path turned to mud, and we arrived back soaked but happy. Over the following days we explored the old bazaar,
+haggled for shawls, took a cooking class, and sat for hours in a tiny cafe that served the best momos we have ever
+eaten. If you are planning something similar, pack layers, carry cash, and leave room in your schedule for
+the unexpected detours that end up being the highlight of the trip.
+"""
+
+# Pasted blog posts, with and without a request at the end
+LONG_MESSAGES = [
+    BLOG_POST * 4,
+    BLOG_POST * 4 + "Can you plan a trip to Darjeeling for 6 days under 40,000 rupees?",
+]
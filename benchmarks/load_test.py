@@ -0,0 +1,248 @@
+"""Load generator for the API and the Gradio handlers, with a JSON report.
+
+Drives one target at a fixed arrival rate (--rps: requests start on
+schedule whether or not earlier ones have finished, and latency counts from
+the scheduled start) or at a fixed concurrency (--concurrency: that many
+clients, each sending its next request when the last one is answered), for
+--duration seconds. Prints throughput, latency percentiles and error rate as
+JSON, also written to --out, so runs can be compared. Targets:
+
+    chat, itinerary                  POST /chat or /generate-itinerary, on --url
+                                     or in-process on app.main without one
+    gradio-chat, gradio-itinerary    app.gradio_app's handlers, in-process
+    gemini-chat, gemini-itinerary    travel_assistant's handlers, in-process
+
+Messages and trip preferences are drawn from --seed, over --sessions
+sessions. With LLM_BACKEND=fake (app/models/fake.py) nothing leaves the
+machine and no tokens are paid for:
+
+    LLM_BACKEND=fake python -m benchmarks.load_test chat --concurrency 32 --duration 30
+    LLM_BACKEND=fake python -m benchmarks.load_test gradio-chat --rps 20 --out run.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+DESTINATIONS = ("Goa", "Lisbon", "Kyoto", "Jaipur", "Paris", "Bali", "Istanbul", "Cusco", "Hanoi", "Cape Town")
+INTERESTS = ("food", "history", "beach", "nature", "culture", "shopping", "adventure")
+STYLES = ("budget", "mid-range", "luxury")
+MESSAGES = (
+    "I want to visit {destination} for {duration} days",
+    "My budget is ${budget} and I love {interest}",
+    "What should I eat in {destination}?",
+    "Is {destination} good for a {style} trip?",
+    "Plan something with {interest} on day {day}",
+)
+
+
+class Request:
+    # What Gradio passes a handler, as far as the handlers use it
+    def __init__(self, session_hash):
+        self.session_hash = session_hash
+
+
+class Workload:
+    def __init__(self, seed, sessions):
+        self.random = random.Random(seed)
+        self.sessions = sessions
+
+    def trip(self):
+        return {
+            "destination": self.random.choice(DESTINATIONS),
+            "duration": self.random.randint(2, 10),
+            "budget": self.random.choice((500, 1000, 2000, 5000)),
+            "interests": self.random.sample(INTERESTS, 2),
+            "travel_style": self.random.choice(STYLES)
+        }
+
+    def message(self):
+        trip = self.trip()
+        return self.random.choice(MESSAGES).format(
+            interest=trip["interests"][0],
+            style=trip["travel_style"],
+            day=self.random.randint(1, trip["duration"]),
+            **trip
+        )
+
+    def session(self):
+        return f"load-{self.random.randrange(self.sessions)}"
+
+
+class Failed(Exception):
+    pass
+
+
+def http_target(name, url, timeout, workload):
+    import httpx
+    if url:
+        client = httpx.AsyncClient(base_url=url, timeout=timeout, limits=httpx.Limits(max_connections=None))
+    else:
+        from app import main as api
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=api.app), base_url="http://load-test", timeout=timeout)
+
+    async def call():
+        if name == "chat":
+            response = await client.post("/chat", json={"message": workload.message(), "session_id": workload.session()})
+        else:
+            response = await client.post("/generate-itinerary", json=workload.trip())
+        if response.status_code >= 400:
+            raise Failed(f"HTTP {response.status_code}")
+
+    return call
+
+
+def handler_target(name, workload, threads):
+    # Handlers catch their own errors and show them in the UI, counting them
+    # in ERRORS; the report takes the error count from there
+    app, handler = name.split("-")
+    if app == "gradio":
+        from app import gradio_app as module
+    else:
+        import travel_assistant as module
+
+    def start(session):
+        if handler == "chat":
+            return module.process_message(workload.message(), [], Request(session))
+        with module.sessions.session(session) as stored:
+            stored.preferences.update(workload.trip())
+        return module.generate_travel_itinerary(Request(session))
+
+    async def call():
+        items = start(workload.session())
+        if hasattr(items, "__anext__"):
+            async for _ in items:
+                pass
+        else:
+            await asyncio.get_running_loop().run_in_executor(threads, lambda: [None for _ in items])
+
+    return call
+
+
+async def fixed_rate(call, rps, duration, record):
+    start = time.perf_counter()
+    tasks = []
+
+    async def one(scheduled):
+        await record(call, scheduled)
+
+    for i in range(int(rps * duration)):
+        scheduled = start + i / rps
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.ensure_future(one(scheduled)))
+    await asyncio.gather(*tasks)
+
+
+async def fixed_concurrency(call, concurrency, duration, record):
+    deadline = time.perf_counter() + duration
+
+    async def client():
+        while time.perf_counter() < deadline:
+            await record(call, time.perf_counter())
+
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+
+
+def percentile(latencies, q):
+    return latencies[min(int(q * len(latencies)), len(latencies) - 1)] if latencies else None
+
+
+async def run(args):
+    from app.utils.metrics import ERRORS
+    workload = Workload(args.seed, args.sessions)
+    threads = ThreadPoolExecutor(max_workers=args.threads, thread_name_prefix="load-test")
+    handlers = args.target not in ("chat", "itinerary")
+    if handlers:
+        call = handler_target(args.target, workload, threads)
+    else:
+        call = http_target(args.target, args.url, args.timeout, workload)
+
+    latencies = []
+    errors = {}
+
+    async def record(call, started):
+        try:
+            await call()
+        except Exception as e:
+            kind = str(e) if isinstance(e, Failed) else type(e).__name__
+            errors[kind] = errors.get(kind, 0) + 1
+            return
+        latencies.append(time.perf_counter() - started)
+
+    started_at = datetime.now(timezone.utc).isoformat(timespec="seconds")
+    handled_errors = ERRORS.total()
+    start = time.perf_counter()
+    if args.rps:
+        await fixed_rate(call, args.rps, args.duration, record)
+    else:
+        await fixed_concurrency(call, args.concurrency, args.duration, record)
+    elapsed = time.perf_counter() - start
+    threads.shutdown()
+    handled_errors = ERRORS.total() - handled_errors
+    if handlers and handled_errors:
+        errors["handled"] = int(handled_errors)
+
+    latencies.sort()
+    failed = sum(errors.values())
+    requests = len(latencies) + sum(count for kind, count in errors.items() if kind != "handled")
+    return {
+        "target": args.target,
+        "url": args.url,
+        "mode": "rps" if args.rps else "concurrency",
+        "rps": args.rps,
+        "concurrency": None if args.rps else args.concurrency,
+        "llm_backend": os.getenv("LLM_BACKEND", "live"),
+        "fake_llm": {key: value for key, value in os.environ.items() if key.startswith("FAKE_LLM_")},
+        "seed": args.seed,
+        "started_at": started_at,
+        "duration_seconds": round(elapsed, 3),
+        "requests": requests,
+        "errors": failed,
+        "error_rate": round(failed / requests, 4) if requests else None,
+        "errors_by_kind": errors,
+        "throughput_rps": round(requests / elapsed, 2),
+        "latency_ms": {
+            "mean": round(statistics.mean(latencies) * 1000, 1) if latencies else None,
+            **{
+                name: round(percentile(latencies, q) * 1000, 1) if latencies else None
+                for name, q in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99), ("max", 1.0))
+            }
+        }
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("target", choices=("chat", "itinerary", "gradio-chat", "gradio-itinerary", "gemini-chat", "gemini-itinerary"))
+    load = parser.add_mutually_exclusive_group()
+    load.add_argument("--rps", type=float, help="requests started per second")
+    load.add_argument("--concurrency", type=int, default=8, help="clients sending requests back to back")
+    parser.add_argument("--duration", type=float, default=30, help="seconds")
+    parser.add_argument("--url", help="a running API, e.g. http://127.0.0.1:8000; in-process if left out")
+    parser.add_argument("--sessions", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--threads", type=int, default=64, help="threads for travel_assistant's blocking handlers")
+    parser.add_argument("--out", help="also write the report here")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text + "\n")
+    if not report["requests"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
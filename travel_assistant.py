@@ -1,16 +1,44 @@
-import gradio as gr
-import google.generativeai as genai
-from typing import List
-import re
+from typing import TYPE_CHECKING, Iterator, List, Optional, Tuple
 import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from app.utils.cache import ItineraryCache, itinerary_key
+from app.utils.context import session_context, summarize_overflow
+from app.utils.extraction import extract_preferences
+from app.utils.metrics import (
+    BACKEND_REQUESTS,
+    ERRORS,
+    LLM_REQUEST_SECONDS,
+    LLM_TOKENS,
+    STAGE_SECONDS,
+    TIME_TO_FIRST_TOKEN,
+    mount_metrics
+)
+from app.utils.prompts import generate_chat_instruction, generate_summary_prompt
+from app.utils.sessions import Session, SessionStore
+from app.utils.singleflight import ThreadSingleFlight
+from app.utils.stops import STOP_SEQUENCES, trim_stream
+from app.utils.tokens import count_tokens
+from app.utils.tracing import Tracer, current_trace, record_stage
+
+# Gradio is only needed to build the interface, and is imported there, so
+# the handlers can be imported (by the load test, say) without it. Gradio
+# resolves the handlers' "gr.Request" hints when they are wired up, so the
+# import binds `gr` as a module global.
+if TYPE_CHECKING:
+    import gradio as gr
+
+# With LLM_BACKEND=fake a stand-in answers in place of Gemini, for load
+# tests and running offline (app/models/fake.py)
+FAKE_LLM = os.getenv("LLM_BACKEND", "live").lower() == "fake"
 
 # Initialize Gemini API
 GOOGLE_API_KEY = os.getenv('GOOGLE_API_KEY')
-if not GOOGLE_API_KEY:
+if not GOOGLE_API_KEY and not FAKE_LLM:
     raise ValueError("Please set the GOOGLE_API_KEY environment variable")
 
-genai.configure(api_key=GOOGLE_API_KEY)
-
 # Set up the model with safety settings
 safety_settings = [
     {
@@ -31,28 +59,73 @@ safety_settings = [
     },
 ]
 
-model = genai.GenerativeModel(
-    model_name='gemini-2.0-flash-lite',
-    safety_settings=safety_settings
-)
+MODEL_NAME = 'gemini-2.0-flash-lite'
 
-# Store conversation history and preferences
-class ConversationState:
-    def __init__(self):
-        self.history = []
-        self.current_preferences = {
-            "destination": None,
-            "duration": None,
-            "budget": None,
-            "currency": "INR",  # Default currency
-            "interests": [],
-            "travel_style": None
-        }
+_genai = None
+_model = None
+
+def gemini():
+    # google.generativeai, and gRPC under it, are imported on first use
+    # rather than at startup
+    global _genai
+    if _genai is None and FAKE_LLM:
+        from app.models.fake import FakeGemini, FakeLLM
+        _genai = FakeGemini(FakeLLM.from_env())
+    if _genai is None:
+        import google.generativeai as genai
+        genai.configure(api_key=GOOGLE_API_KEY)
+        _genai = genai
+    return _genai
+
+def get_model(system_instruction: Optional[str] = None):
+    global _model
+    if system_instruction is not None:
+        return gemini().GenerativeModel(
+            model_name=MODEL_NAME,
+            safety_settings=safety_settings,
+            system_instruction=system_instruction
+        )
+    if _model is None:
+        _model = gemini().GenerativeModel(
+            model_name=MODEL_NAME,
+            safety_settings=safety_settings
+        )
+    return _model
+
+# Conversation state, one session per browser tab
+sessions = SessionStore.from_env("gemini", currency="INR")  # Default currency
+
+def session_id(request: "gr.Request") -> str:
+    # Gradio passes no request when a handler is called directly
+    return request.session_hash if request and request.session_hash else "local"
+
+# Old turns are summarised here, after the reply has been shown
+summarizer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="summarizer")
+
+# Identical trips share one generated itinerary
+itinerary_cache = ItineraryCache.from_env("gemini")
+
+# ...and identical prompts in flight at the same time share one Gemini call
+gemini_flights = ThreadSingleFlight("gemini")
 
-state = ConversationState()
+# Sampled handler calls are traced to a file (see app/utils/tracing.py)
+tracer = Tracer.from_env("gemini")
 
-def update_preferences_display():
-    prefs = state.current_preferences
+# Metric series, bound once
+_GEMINI_FIRST_TOKEN = TIME_TO_FIRST_TOKEN.labels("gemini")
+_GEMINI_DURATION = LLM_REQUEST_SECONDS.labels("gemini")
+_GEMINI_OK = BACKEND_REQUESTS.labels("gemini", "ok")
+_GEMINI_ERRORS = BACKEND_REQUESTS.labels("gemini", "error")
+_GEMINI_TOKENS_IN = LLM_TOKENS.labels("gemini", "in")
+_GEMINI_TOKENS_OUT = LLM_TOKENS.labels("gemini", "out")
+_PROMPT_BUILD = STAGE_SECONDS.labels("gemini", "prompt_build")
+_EXTRACTION = STAGE_SECONDS.labels("gemini", "extraction")
+_LLM = STAGE_SECONDS.labels("gemini", "llm")
+_POSTPROCESS = STAGE_SECONDS.labels("gemini", "postprocess")
+
+def update_preferences_display(request: "gr.Request"):
+    with sessions.session(session_id(request)) as session:
+        prefs = session.preferences
     return f"""
     ### Current Travel Preferences
     - Destination: {prefs['destination'] or 'Not specified'}
@@ -62,211 +135,227 @@ def update_preferences_display():
     - Travel Style: {prefs['travel_style'] or 'Not specified'}
     """
 
-def generate_response(message: str, history: List) -> str:
+class GeminiChat:
+    # A session's Gemini ChatSession, the system instruction it was made
+    # with, and whether a reply is streaming on it. `nbytes` estimates the
+    # ChatSession's own copy of the conversation, which counts towards the
+    # session's size.
+    __slots__ = ("instruction", "session", "busy", "nbytes")
+
+    def __init__(self, instruction: str, session, turns: List[dict]):
+        self.instruction = instruction
+        self.session = session
+        self.busy = False
+        self.nbytes = sys.getsizeof(instruction)
+        for turn in turns:
+            self.add(turn["user"], turn["assistant"])
+
+    def add(self, message: str, reply: str):
+        self.nbytes += sys.getsizeof(message) + sys.getsizeof(reply)
+
+# Taken to hand out a session's chat to one message at a time
+_chats_lock = threading.Lock()
+
+def chat_for(session: Session, message: str) -> GeminiChat:
+    # The session's Gemini chat, created once and then appended to. It is
+    # only rebuilt, from the summary and the recent turns that fit the
+    # context budget, when the preferences or the summary change or when it
+    # has grown past the budget, or when another message's reply is still
+    # streaming on it (a ChatSession takes one message at a time). Marked
+    # busy until the caller is done with it.
+    context = session_context(session, message, "gemini")
+    summary = context[0]["summary"] if context and "summary" in context[0] else None
+    turns = [turn for turn in context if "summary" not in turn]
+    instruction = generate_chat_instruction(session.preferences, summary)
+    with _chats_lock:
+        chat = session.chat
+        if (
+            chat is None
+            or chat.busy
+            or chat.instruction != instruction
+            or _history_length(chat.session) > 2 * len(turns)
+        ):
+            history = []
+            for turn in turns:
+                history.append({"role": "user", "parts": [turn["user"]]})
+                history.append({"role": "model", "parts": [turn["assistant"]]})
+            chat_model = get_model(system_instruction=instruction)
+            chat = session.chat = GeminiChat(instruction, chat_model.start_chat(history=history), turns)
+        chat.busy = True
+    return chat
+
+def _history_length(chat) -> float:
+    # A streamed reply that wasn't read to the end leaves the ChatSession's
+    # history unreadable (IncompleteIterationError); such a chat is rebuilt
+    try:
+        return len(chat.history)
+    except Exception:
+        return float("inf")
+
+def forget_chat(sid: str, chat=None):
+    # After a failed or unfinished send the ChatSession's history can't be
+    # trusted. With `chat`, only if the session still uses that ChatSession.
+    with sessions.session(sid, create=False) as session:
+        if session is not None and (chat is None or (session.chat is not None and session.chat.session is chat)):
+            session.chat = None
+
+def stream_reply(prompt: str, generation_config, chat=None, key=None, sid: Optional[str] = None) -> Iterator[str]:
+    # Sends the prompt to Gemini and yields the text as it arrives, joining
+    # an identical request that is already streaming if there is one. With a
+    # `chat` the prompt continues that conversation, the chat of session
+    # `sid`, which is reset if the reply isn't read to the end. Trimmed at
+    # the stop sequences, should Gemini write the next turn itself.
+    return gemini_flights.stream(
+        key or prompt,
+        lambda: trim_stream(_stream_gemini(chat or get_model().start_chat(history=[]), prompt, generation_config, sid))
+    )
+
+def _stream_gemini(chat, prompt: str, generation_config, sid: Optional[str] = None) -> Iterator[str]:
+    start = time.perf_counter()
+    _GEMINI_TOKENS_IN.inc(count_tokens(prompt))
+    # None if the caller stops reading, which says nothing about Gemini
+    ok = None
+    first_token = None
+    try:
+        response = chat.send_message(prompt, generation_config=generation_config, stream=True)
+        for chunk in response:
+            text = chunk.text
+            if not text:
+                continue
+            if first_token is None:
+                first_token = time.perf_counter() - start
+                _GEMINI_FIRST_TOKEN.observe(first_token)
+            _GEMINI_TOKENS_OUT.inc(count_tokens(text))
+            yield text
+        ok = True
+    except Exception:
+        ok = False
+        raise
+    finally:
+        end = time.perf_counter()
+        if ok is not None:
+            (_GEMINI_OK if ok else _GEMINI_ERRORS).inc()
+            _GEMINI_DURATION.observe(end - start)
+        elif sid is not None:
+            # Stopped early (at a stop sequence, or nobody is reading any
+            # more): the chat's history can't be read, so the next message
+            # starts a new chat from the session's turns
+            forget_chat(sid, chat)
+        trace = current_trace()
+        if trace is not None:
+            args = {"outcome": "abandoned" if ok is None else "ok" if ok else "error"}
+            if first_token is not None:
+                args["first_token_ms"] = round(first_token * 1000, 1)
+            trace.add("llm.gemini", start, end, args)
+
+def summarize(summary: Optional[str], turns: List[Tuple[str, str]]) -> str:
+    response = get_model().generate_content(
+        generate_summary_prompt(summary, turns),
+        generation_config={
+            "temperature": 0.2,
+            "max_output_tokens": 300,
+            "candidate_count": 1
+        }
+    )
+    return response.text
+
+def generate_response(message: str, chat: GeminiChat, sid: str) -> Iterator[str]:
+    # Yields the response so far, growing as Gemini streams it
     try:
-        # Prepare the conversation context
-        prefs = state.current_preferences
-        context = f"""You are a helpful travel assistant. Your role is to help users plan their trips, 
-        provide travel recommendations, and answer questions about destinations. Be friendly, informative, 
-        and specific in your responses.
-        
-        Current travel preferences:
-        - Destination: {prefs['destination'] or 'Not specified'}
-        - Duration: {f"{prefs['duration']} days" if prefs['duration'] else 'Not specified'}
-        - Budget: {f"{prefs['currency']} {prefs['budget']}" if prefs['budget'] else 'Not specified'}
-        - Interests: {', '.join(prefs['interests']) if prefs['interests'] else 'Not specified'}
-        - Travel Style: {prefs['travel_style'] or 'Not specified'}
-        
-        Previous conversation:
-        """
-        
-        for user_msg, bot_msg in history:
-            context += f"User: {user_msg}\nAssistant: {bot_msg}\n"
-        
-        context += f"User: {message}\nAssistant:"
-        
         # Generate response using Gemini
-        chat = model.start_chat(history=[])
-        response = chat.send_message(
-            context,
-            generation_config=genai.types.GenerationConfig(
-                temperature=0.8,
-                top_p=0.95,
-                top_k=50,
-                max_output_tokens=2048,
-                candidate_count=1
-            )
-        )
-        
-        if not response.text:
-            return "I'm here to help you plan your trip! Could you tell me more about your travel plans?"
+        text = ""
+        for chunk in stream_reply(
+            message,
+            {
+                "temperature": 0.8,
+                "top_p": 0.95,
+                "top_k": 50,
+                "max_output_tokens": 2048,
+                "candidate_count": 1,
+                "stop_sequences": list(STOP_SEQUENCES)
+            },
+            chat=chat.session,
+            key=(sid, message),
+            sid=sid
+        ):
+            text += chunk
+            yield text.strip()
+        chat.add(message, text)
         
-        return response.text.strip()
+        if not text.strip():
+            yield "I'm here to help you plan your trip! Could you tell me more about your travel plans?"
     except Exception as e:
+        ERRORS.inc("gemini", "chat")
         print(f"Error in generate_response: {str(e)}")
-        return "I'm here to help you plan your trip! Could you tell me more about your travel plans?"
+        forget_chat(sid)
+        yield "I'm here to help you plan your trip! Could you tell me more about your travel plans?"
+    finally:
+        chat.busy = False
 
-def process_message(message, history):
+@tracer.traced("chat")
+def process_message(message, history, request: "gr.Request"):
+    history = history or []
     try:
         if not message.strip():
-            return history or []
+            yield history
+            return
+        
+        sid = session_id(request)
+        start = time.perf_counter()
+        with sessions.session(sid) as session:
+            chat = chat_for(session, message)
+        record_stage(_PROMPT_BUILD, "prompt_build", start)
             
-        # Generate response
-        response = generate_response(message, history)
+        # Stream the response into the chat as it is generated
+        history.append((message, ""))
+        start = time.perf_counter()
+        for response in generate_response(message, chat, sid):
+            history[-1] = (message, response)
+            yield history
+        record_stage(_LLM, "llm", start)
         
         # Update preferences
-        update_preferences(message)
+        start = time.perf_counter()
+        with sessions.session(sid) as session:
+            session.add_turn(*history[-1])
+            added = record_stage(_POSTPROCESS, "postprocess", start)
+            update_preferences(message, session.preferences)
+            record_stage(_EXTRACTION, "extraction", added)
+        yield history
         
-        # Return the history in the format Gradio expects
-        history = history or []
-        history.append((message, response))
-        return history
+        # Fold turns that no longer fit the context into the summary
+        summarizer.submit(summarize_overflow, sessions, sid, summarize)
     except Exception as e:
+        ERRORS.inc("gemini", "chat")
         print(f"Error in process_message: {str(e)}")
-        history = history or []
+        if history and history[-1][0] == message:
+            history.pop()
         history.append((message, f"Error: {str(e)}"))
-        return history
+        yield history
 
-def update_preferences(message):
+def update_preferences(message, prefs):
     # Simple preference extraction logic
-    message = message.lower()
-    
-    # Extract destination using multiple patterns
-    destination_patterns = [
-        r"trip (?:to|of|in) ([a-zA-Z\s]+)(?:\s|$)",            # trip to Goa
-        r"visit ([a-zA-Z\s]+)(?:\s|$)",                        # visit Goa
-        r"going to ([a-zA-Z\s]+)(?:\s|$)",                     # going to Goa
-        r"travel to ([a-zA-Z\s]+)(?:\s|$)",                    # travel to Goa
-        r"plan a trip (?:to|of|in) ([a-zA-Z\s]+)(?:\s|$)",     # plan a trip to Goa
-        r"want to go (?:to )?([a-zA-Z\s]+)(?:\s|$)",           # want to go Goa / want to go to Goa
-        r"interested in ([a-zA-Z\s]+)(?:\s|$)",                # interested in Goa
-        r"like ([a-zA-Z\s]+)(?:\s|$)",                         # like Goa
-        r"love ([a-zA-Z\s]+)(?:\s|$)",                         # love Goa
-        r"go ([a-zA-Z\s]+)(?:\s|$)",                           # go Goa
-        r"trip for ([a-zA-Z\s]+)(?:\s|$)",                     # trip for Goa
-        r"prefer ([a-zA-Z\s]+)(?:\s|$)",                       # prefer Goa
-        r"looking for ([a-zA-Z\s]+)(?:\s|$)",                  # looking for Goa
-        r"dream(?:ing)? (?:about|of)? ([a-zA-Z\s]+)(?:\s|$)",  # dreaming about Goa / dream Goa
-    ]
-
-    
-    for pattern in destination_patterns:
-        match = re.search(pattern, message)
-        if match:
-            destination = match.group(1).strip()
-            if destination:
-                state.current_preferences["destination"] = destination
-                break
-    
-    # Extract duration using multiple patterns
-    duration_patterns = [
-        # Days
-        r"for (\d+)\s*(?:days?|d)",                      # "for 2 days", "for 2d"
-        r"(\d+)\s*(?:days?|d)(?:\s|$)",                  # "2 days", "2d"
-
-        # Nights
-        r"for (\d+)\s*(?:nights?|n)",                    # "for 2 nights", "for 2n"
-        r"(\d+)\s*(?:nights?|n)(?:\s|$)",                # "2 nights", "2n"
-
-        # Weeks
-        r"for (\d+)\s*(?:weeks?|w)",                     # "for 2 weeks", "for 2w"
-        r"(\d+)\s*(?:weeks?|w)(?:\s|$)",                 # "2 weeks", "2w"
-
-        # Months
-        r"for (\d+)\s*(?:months?|mo|mnth|m)",            # "for 2 months", "for 2mo", "for 2m"
-        r"(\d+)\s*(?:months?|mo|mnth|m)(?:\s|$)",        # "2 months", "2mo", "2m"
-
-        # Generic phrasing
-        r"stay for (\d+)\s*(?:days?|nights?|weeks?|months?)",  # "stay for 2 weeks"
-        r"spend (\d+)\s*(?:days?|nights?|weeks?|months?)"      # "spend 5 days"
-    ]
+    prefs.update(extract_preferences(message))
 
-    
-    for pattern in duration_patterns:
-        match = re.search(pattern, message)
-        if match:
-            try:
-                duration = int(match.group(1))
-                state.current_preferences["duration"] = duration
-                break
-            except ValueError:
-                pass
-    
-    # Extract budget
-    budget_patterns = [
-        r"\$(\d+(?:,\d{3})*(?:\.\d{2})?)",  # $1,000 or $1,000.00
-        r"₹(\d+(?:,\d{2})*(?:,\d{2})*(?:\.\d{2})?)",  # ₹1,00,000
-        r"(\d+(?:,\d{3})*(?:\.\d{2})?) dollars?",  # 1,000 dollars
-        r"(\d+(?:,\d{2})*(?:,\d{2})*(?:\.\d{2})?) rupees?",  # 1,00,000 rupees
-        r"(\d+(?:,\d{2})*(?:,\d{2})*(?:\.\d{2})?) inr",  # 1,00,000 inr
-        r"(\d+(?:,\d{2})*(?:,\d{2})*(?:\.\d{2})?) rs",  # 1,00,000 rs
-        r"(\d+(?:,\d{2})*(?:,\d{2})*(?:\.\d{2})?) lakh",  # 1 lakh
-        r"(\d+(?:,\d{2})*(?:,\d{2})*(?:\.\d{2})?) lakhs",  # 2 lakhs
-        r"(\d+(?:,\d{2})*(?:,\d{2})*(?:\.\d{2})?) crore",  # 1 crore
-        r"(\d+(?:,\d{2})*(?:,\d{2})*(?:\.\d{2})?) crores",  # 2 crores
-        r"budget of (\d+(?:,\d{3})*(?:\.\d{2})?)",  # budget of 1,000
-        r"around (\d+(?:,\d{3})*(?:\.\d{2})?)"  # around 1,000
-    ]
-    
-    for pattern in budget_patterns:
-        match = re.search(pattern, message)
-        if match:
-            try:
-                amount = match.group(1).replace(',', '')
-                # Convert lakhs and crores to rupees
-                if "lakh" in pattern:
-                    amount = float(amount) * 100000
-                elif "crore" in pattern:
-                    amount = float(amount) * 10000000
-                else:
-                    amount = float(amount)
-                
-                # Store the amount and currency
-                state.current_preferences["budget"] = amount
-                state.current_preferences["currency"] = "INR" if "₹" in pattern or "rupees" in pattern or "inr" in pattern or "rs" in pattern or "lakh" in pattern or "crore" in pattern else "USD"
-                break
-            except ValueError:
-                pass
-    
-    # Extract interests with more comprehensive list
-    interests = [
-        "culture", "food", "adventure", "relaxation", "shopping", "history", "nature",
-        "beach", "mountains", "city", "countryside", "art", "music", "sports",
-        "wildlife", "architecture", "local cuisine", "nightlife", "family",
-        "romantic", "solo", "group", "luxury", "budget", "mid-range"
-    ]
-    
-    found_interests = []
-    for interest in interests:
-        if interest in message:
-            found_interests.append(interest)
-    
-    if found_interests:
-        state.current_preferences["interests"] = found_interests
-    
-    # Extract travel style with more options
-    styles = {
-        "luxury": ["luxury", "premium", "high-end", "5-star", "five star"],
-        "budget": ["budget", "cheap", "economy", "low-cost", "affordable"],
-        "mid-range": ["mid-range", "moderate", "standard", "comfortable"]
-    }
-    
-    for style, keywords in styles.items():
-        if any(keyword in message for keyword in keywords):
-            state.current_preferences["travel_style"] = style
-            break
-
-def generate_travel_itinerary():
-    prefs = state.current_preferences
+@tracer.traced("itinerary")
+def generate_travel_itinerary(request: "gr.Request"):
+    with sessions.session(session_id(request)) as session:
+        prefs = session.preferences.as_dict()
     
     if not prefs["destination"]:
-        return "Please provide a destination first."
+        yield "Please provide a destination first."
+        return
     
     try:
-        prompt = f"""Create a detailed day-by-day travel itinerary for {prefs['destination']} 
-        for {prefs['duration']} days with a budget of {prefs['currency']} {prefs['budget']}.
+        key = itinerary_key(prefs)
+        cached = itinerary_cache.get(key)
+        if cached is not None:
+            yield cached
+            return
         
-        Create a detailed itinerary that includes:
+        # Instructions first, trip details last, so every itinerary request
+        # starts with the same tokens, as prompt-prefix caching needs
+        prompt = f"""Create a detailed itinerary that includes:
 
         For each day:
         1. Morning Activities (9:00 AM - 12:00 PM)
@@ -298,41 +387,44 @@ def generate_travel_itinerary():
         - Local customs and etiquette to be aware of
         - Emergency contact numbers if available
         
-        Please format the response in a clear, easy-to-read manner with proper spacing and bullet points."""
+        Please format the response in a clear, easy-to-read manner with proper spacing and bullet points.
+
+        Create this detailed day-by-day travel itinerary for {prefs['destination']} 
+        for {prefs['duration']} days with a budget of {prefs['currency']} {prefs['budget']}."""
         
-        chat = model.start_chat(history=[])
-        response = chat.send_message(
+        itinerary = ""
+        start = time.perf_counter()
+        for chunk in stream_reply(
             prompt,
-            generation_config=genai.types.GenerationConfig(
-                temperature=0.7,
-                top_p=0.95,
-                top_k=50,
-                max_output_tokens=4096,
-                candidate_count=1
-            )
-        )
+            {
+                "temperature": 0.7,
+                "top_p": 0.95,
+                "top_k": 50,
+                "max_output_tokens": 4096,
+                "candidate_count": 1
+            }
+        ):
+            itinerary += chunk
+            yield itinerary.strip()
+        record_stage(_LLM, "llm", start)
         
-        if not response.text:
-            return "I apologize, but I couldn't generate an itinerary at this time. Please try again later."
-        
-        return response.text.strip()
+        if not itinerary.strip():
+            yield "I apologize, but I couldn't generate an itinerary at this time. Please try again later."
+        else:
+            itinerary_cache.put(key, itinerary.strip())
     except Exception as e:
+        ERRORS.inc("gemini", "itinerary")
         print(f"Error in generate_travel_itinerary: {str(e)}")
-        return "I apologize, but I encountered an error while generating the itinerary. Please try again later."
-
-def clear_conversation():
-    state.history = []
-    state.current_preferences = {
-        "destination": None,
-        "duration": None,
-        "budget": None,
-        "currency": "INR",  # Default currency
-        "interests": [],
-        "travel_style": None
-    }
-    return [], update_preferences_display()
+        yield "I apologize, but I encountered an error while generating the itinerary. Please try again later."
+
+def clear_conversation(request: "gr.Request"):
+    sessions.drop(session_id(request))
+    return [], update_preferences_display(request)
 
 def create_gradio_interface():
+    global gr
+    import gradio as gr
+
     with gr.Blocks(title="Travel Assistant", theme=gr.themes.Soft()) as demo:
         gr.Markdown("""
         # 🌍 AI Travel Assistant
@@ -418,7 +510,13 @@ def create_gradio_interface():
 
 if __name__ == "__main__":
     demo = create_gradio_interface()
+    # Streaming handlers need the queue
+    demo.queue()
     demo.launch(
         server_name="127.0.0.1",
-        share=True
-    ) 
\ No newline at end of file
+        share=True,
+        prevent_thread_lock=True
+    )
+    # Gradio's app only exists once launched
+    mount_metrics(demo.app)
+    demo.block_thread() 
\ No newline at end of file